@@ -1,9 +1,22 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
-from models import User, Institution, Program, Application, Payment, AdminLog, db, UserRole, ApplicationStatus, PaymentStatus
+from models import User, Institution, Program, Application, Payment, AdminLog, ExchangeRate, DailyStat, db, UserRole, ApplicationStatus, PaymentStatus
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, or_
+from sqlalchemy import func, desc, or_, and_, insert
+from sqlalchemy.orm import joinedload, contains_eager
+from search_index import match_institutions
+from currency import set_exchange_rates, base_currency
+from rollups import month_starts
+from analytics import get_report
+from pagination import paginate_list, InvalidCursor
+from totals import count_total
+import audit_log
+from decisions import run_batch_decision, BatchDecisionError, MAX_NOTES_LENGTH
+from exports import export_response, FORMATS as EXPORT_FORMATS
+from audit_archive import LOG_FILTERS, log_criteria, archived_months, archive_page
+from bulk_ops import run_bulk_operation, BulkOperationError, TARGETS, OPERATIONS
+from decimal import Decimal, InvalidOperation
 import json
 
 admin = Blueprint('admin', __name__)
@@ -19,54 +32,67 @@ def admin_required(f):
     return decorated_function
 
 def log_admin_action(action, target_type=None, target_id=None, details=None):
-    """Log admin actions for audit trail"""
+    """Log admin actions for audit trail; the entry is written in the background (audit_log.py)"""
+    audit_log.record(
+        admin_id=current_user.id,
+        action=action,
+        target_type=target_type,
+        target_id=target_id,
+        details=json.dumps(details, default=str) if details else None,
+        ip_address=request.remote_addr
+    )
+
+def admin_list_page(query, keys, per_page=20, descending=False):
+    """One page of an admin list: ?cursor= pages by key, ?page= by number with a cached total"""
+    page = request.args.get('page', 1, type=int)
     try:
-        log = AdminLog(
-            admin_id=current_user.id,
-            action=action,
-            target_type=target_type,
-            target_id=target_id,
-            details=json.dumps(details) if details else None,
-            ip_address=request.remote_addr
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception as e:
-        print(f"Error logging admin action: {e}")
+        return paginate_list(query, keys, page, request.args.get('cursor'), per_page, descending, count_total)
+    except InvalidCursor:
+        return paginate_list(query, keys, 1, None, per_page, descending, count_total)
 
 @admin.route('/dashboard')
 @admin_required
 def dashboard():
-    # Get dashboard statistics
+    # Totals and the monthly trend come from the daily rollups in one query
+    months = month_starts(12)
+    rows = db.session.query(DailyStat.day, DailyStat.metric, DailyStat.count, DailyStat.amount).filter(or_(
+        DailyStat.metric.like('total:%'),
+        DailyStat.metric == 'revenue',
+        and_(DailyStat.metric == 'applications', DailyStat.day >= months[0])
+    )).all()
+    
+    totals = {}
+    revenue = Decimal('0')
+    monthly_counts = {start: 0 for start in months}
+    for day, metric, count, amount in rows:
+        if metric == 'revenue':
+            revenue += amount or 0
+        elif metric == 'applications':
+            monthly_counts[day.replace(day=1)] += count
+        else:
+            totals[metric] = totals.get(metric, 0) + count
+    
     stats = {
-        'total_users': User.query.filter_by(role=UserRole.STUDENT).count(),
-        'total_institutions': Institution.query.filter_by(is_active=True).count(),
-        'total_programs': Program.query.filter_by(is_active=True).count(),
-        'total_applications': Application.query.count(),
-        'pending_applications': Application.query.filter_by(status=ApplicationStatus.SUBMITTED).count(),
-        'total_revenue': db.session.query(func.sum(Payment.amount)).filter_by(status=PaymentStatus.COMPLETED).scalar() or 0
+        'total_users': totals.get('total:students', 0),
+        'total_institutions': totals.get('total:institutions', 0),
+        'total_programs': totals.get('total:programs', 0),
+        'total_applications': sum(count for metric, count in totals.items() if metric.startswith('total:status:')),
+        'pending_applications': totals.get(f'total:status:{ApplicationStatus.SUBMITTED.value}', 0),
+        'total_revenue': revenue
     }
     
     # Recent activity
-    recent_applications = Application.query.order_by(desc(Application.created_at)).limit(10).all()
+    recent_applications = Application.query.options(
+        joinedload(Application.user), joinedload(Application.institution), joinedload(Application.program)
+    ).order_by(desc(Application.created_at)).limit(10).all()
     recent_users = User.query.filter_by(role=UserRole.STUDENT).order_by(desc(User.created_at)).limit(10).all()
-    recent_payments = Payment.query.order_by(desc(Payment.created_at)).limit(10).all()
-    
-    # Monthly application trends (last 12 months)
-    monthly_stats = []
-    for i in range(12):
-        start_date = datetime.now().replace(day=1) - timedelta(days=30*i)
-        end_date = start_date.replace(day=28) + timedelta(days=4)  # end of month
-        count = Application.query.filter(
-            Application.created_at >= start_date,
-            Application.created_at < end_date
-        ).count()
-        monthly_stats.append({
-            'month': start_date.strftime('%b %Y'),
-            'applications': count
-        })
+    recent_payments = Payment.query.options(joinedload(Payment.user)).order_by(desc(Payment.created_at)).limit(10).all()
     
-    monthly_stats.reverse()
+    # Monthly application trends (last 12 calendar months)
+    monthly_stats = [{
+        'month': start.strftime('%b %Y'),
+        'applications': monthly_counts[start]
+    } for start in months]
     
     return render_template('admin/dashboard.html', 
                          stats=stats,
@@ -79,7 +105,6 @@ def dashboard():
 @admin.route('/users')
 @admin_required
 def users():
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     role_filter = request.args.get('role', '')
     
@@ -95,9 +120,7 @@ def users():
     if role_filter:
         query = query.filter_by(role=UserRole(role_filter))
     
-    users = query.order_by(desc(User.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    users = admin_list_page(query, [User.created_at, User.id], descending=True)
     
     return render_template('admin/users.html', users=users, search=search, role_filter=role_filter)
 
@@ -127,25 +150,18 @@ def toggle_user_status(user_id):
 @admin.route('/institutions')
 @admin_required
 def institutions():
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     country_filter = request.args.get('country', '')
     
     query = Institution.query
     
     if search:
-        query = query.filter(or_(
-            Institution.name.contains(search),
-            Institution.city.contains(search),
-            Institution.country.contains(search)
-        ))
+        query = match_institutions(query, search)
     
     if country_filter:
         query = query.filter_by(country_code=country_filter)
     
-    institutions = query.order_by(Institution.name).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    institutions = admin_list_page(query, [Institution.name, Institution.id])
     
     # Get unique countries for filter
     countries = db.session.query(Institution.country_code, Institution.country).distinct().all()
@@ -253,7 +269,6 @@ def edit_institution(institution_id):
 @admin.route('/programs')
 @admin_required
 def programs():
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     institution_filter = request.args.get('institution', '', type=int)
     field_filter = request.args.get('field', '')
@@ -272,9 +287,7 @@ def programs():
     if field_filter:
         query = query.filter(Program.field_of_study.contains(field_filter))
     
-    programs = query.order_by(Institution.name, Program.name).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    programs = admin_list_page(query, [Institution.name, Program.name, Program.id])
     
     # Get institutions for filter
     institutions = Institution.query.filter_by(is_active=True).order_by(Institution.name).all()
@@ -290,12 +303,22 @@ def programs():
 @admin.route('/applications')
 @admin_required
 def applications():
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     search = request.args.get('search', '')
     
-    query = Application.query.join(User).join(Institution).join(Program)
+    query = filter_applications(
+        Application.query.join(User).join(Institution).join(Program, Application.program_id == Program.id),
+        status_filter, search
+    )
+    applications = admin_list_page(query, [Application.created_at, Application.id], descending=True)
     
+    return render_template('admin/applications.html', 
+                         applications=applications,
+                         status_filter=status_filter,
+                         search=search)
+
+def filter_applications(query, status_filter, search):
+    """Apply the applications list filters; the query must join User"""
     if status_filter:
         query = query.filter(Application.status == ApplicationStatus(status_filter))
     
@@ -306,15 +329,7 @@ def applications():
             User.last_name.contains(search),
             Application.reference_number.contains(search)
         ))
-    
-    applications = query.order_by(desc(Application.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
-    
-    return render_template('admin/applications.html', 
-                         applications=applications,
-                         status_filter=status_filter,
-                         search=search)
+    return query
 
 @admin.route('/applications/<int:application_id>')
 @admin_required
@@ -353,63 +368,329 @@ def update_application_status(application_id):
     
     return redirect(url_for('admin.application_detail', application_id=application_id))
 
+@admin.route('/applications/decisions', methods=['POST'])
+@admin_required
+def batch_application_decisions():
+    """Move many applications to one status; reports success or failure per id as JSON
+
+    Takes JSON {"status": ..., "ids": [...]} or {"status": ..., "filter": {"status", "institution_id",
+    "program_id"}}, optionally with "notes", or the same fields as a form (ids repeated).
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+    else:
+        data = {
+            'status': request.form.get('status'),
+            # Numeric form values become ids; anything else is rejected below
+            'ids': [int(value) if value.strip().isdigit() else value
+                    for value in request.form.getlist('ids')] or None,
+            'filter': {name: request.form.get(name) for name in ('filter_status', 'institution_id', 'program_id')},
+            'notes': request.form.get('decision_notes'),
+        }
+        data['filter']['status'] = data['filter'].pop('filter_status')
+    
+    ids = data.get('ids')
+    if ids is not None and not (isinstance(ids, list) and all(
+            isinstance(application_id, int) and not isinstance(application_id, bool) for application_id in ids)):
+        return jsonify({'status': 'error', 'message': 'ids must be a list of application ids'}), 400
+    if data.get('filter') is not None and not isinstance(data['filter'], dict):
+        return jsonify({'status': 'error', 'message': 'filter must be an object'}), 400
+    notes = data.get('notes')
+    if notes is not None:
+        if not isinstance(notes, str):
+            return jsonify({'status': 'error', 'message': 'notes must be a string'}), 400
+        notes = notes.strip() or None
+        if notes and len(notes) > MAX_NOTES_LENGTH:
+            return jsonify({'status': 'error', 'message': f'notes must be at most {MAX_NOTES_LENGTH} characters'}), 400
+    
+    try:
+        results, summary = run_batch_decision(data.get('status'), ids, data.get('filter'), notes)
+        # One audit entry per changed application, committed with the changes themselves
+        now = datetime.utcnow()
+        audit_rows = [{
+            'admin_id': current_user.id,
+            'action': 'application_status_updated',
+            'target_type': 'application',
+            'target_id': result['id'],
+            'details': json.dumps({
+                'old_status': result['old_status'],
+                'new_status': result['new_status'],
+                'reference_number': result['reference_number'],
+                'batch': True
+            }),
+            'ip_address': request.remote_addr,
+            'created_at': now,
+        } for result in results if result['success']]
+        if audit_rows:
+            db.session.execute(insert(AdminLog), audit_rows)
+        db.session.commit()
+    except BatchDecisionError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error applying batch decision: {e}")
+        return jsonify({'status': 'error', 'message': 'Error applying batch decision'}), 500
+    
+    return jsonify(dict(summary, status='success', results=results))
+
 # Payment Management
 @admin.route('/payments')
 @admin_required
 def payments():
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     
-    query = Payment.query.join(User)
+    query = filter_payments(Payment.query.join(User), status_filter)
+    payments = admin_list_page(query, [Payment.created_at, Payment.id], descending=True)
     
+    return render_template('admin/payments.html', payments=payments, status_filter=status_filter)
+
+def filter_payments(query, status_filter):
+    """Apply the payments list filters"""
     if status_filter:
         query = query.filter(Payment.status == PaymentStatus(status_filter))
+    return query
+
+# Exports
+def _export_format():
+    export_format = request.args.get('format', 'csv')
+    return export_format if export_format in EXPORT_FORMATS else None
+
+@admin.route('/applications/export')
+@admin_required
+def export_applications():
+    """Stream the filtered applications, with applicant, institution and program, as CSV or NDJSON"""
+    export_format = _export_format()
+    status_filter = request.args.get('status', '')
+    search = request.args.get('search', '')
     
-    payments = query.order_by(desc(Payment.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    try:
+        query = filter_applications(db.session.query(
+            Application.id,
+            Application.reference_number,
+            Application.status,
+            Application.created_at,
+            Application.submitted_at,
+            Application.decision_date,
+            User.id.label('user_id'),
+            User.email,
+            User.first_name,
+            User.last_name,
+            User.country.label('user_country'),
+            Institution.id.label('institution_id'),
+            Institution.name.label('institution_name'),
+            Institution.country_code.label('institution_country'),
+            Program.id.label('program_id'),
+            Program.name.label('program_name'),
+            Program.degree_type
+        ).join(User, Application.user_id == User.id).join(
+            Institution, Application.institution_id == Institution.id
+        ).join(Program, Application.program_id == Program.id), status_filter, search)
+    except ValueError:
+        export_format = None
+    if export_format is None:
+        flash('Invalid export format or status filter.', 'error')
+        return redirect(url_for('admin.applications'))
+    
+    log_admin_action('applications_exported', 'application', None, {
+        'format': export_format, 'status': status_filter, 'search': search
+    })
+    return export_response(query.order_by(Application.id).statement, export_format, 'applications')
+
+@admin.route('/payments/export')
+@admin_required
+def export_payments():
+    """Stream the filtered payments, with payer and application reference, as CSV or NDJSON"""
+    export_format = _export_format()
+    status_filter = request.args.get('status', '')
     
-    return render_template('admin/payments.html', payments=payments, status_filter=status_filter)
+    try:
+        query = filter_payments(db.session.query(
+            Payment.id,
+            Payment.status,
+            Payment.amount,
+            Payment.currency,
+            Payment.description,
+            Payment.created_at,
+            Payment.completed_at,
+            Payment.stripe_payment_intent_id,
+            User.id.label('user_id'),
+            User.email,
+            User.first_name,
+            User.last_name,
+            Payment.application_id,
+            Application.reference_number
+        ).join(User, Payment.user_id == User.id).outerjoin(
+            Application, Payment.application_id == Application.id
+        ), status_filter)
+    except ValueError:
+        export_format = None
+    if export_format is None:
+        flash('Invalid export format or status filter.', 'error')
+        return redirect(url_for('admin.payments'))
+    
+    log_admin_action('payments_exported', 'payment', None, {'format': export_format, 'status': status_filter})
+    return export_response(query.order_by(Payment.id).statement, export_format, 'payments')
+
+# Bulk operations
+BULK_FILTERS = ('ids', 'institution_id', 'country', 'field', 'degree_type', 'status')
+
+def _bulk_page(**context):
+    countries = db.session.query(Institution.country_code, Institution.country).distinct().all()
+    return render_template('admin/bulk.html',
+                         targets=TARGETS,
+                         operations=OPERATIONS,
+                         countries=countries,
+                         **context)
+
+@admin.route('/bulk')
+@admin_required
+def bulk():
+    return _bulk_page(form={})
+
+@admin.route('/bulk', methods=['POST'])
+@admin_required
+def bulk_operations():
+    target = request.form.get('target', '')
+    operation = request.form.get('operation', '')
+    filters = {name: request.form.get(name, '').strip() for name in BULK_FILTERS}
+    value = request.form.get('value', '').strip() or None
+    include_programs = bool(request.form.get('include_programs'))
+    dry_run = bool(request.form.get('dry_run'))
+    
+    try:
+        summary = run_bulk_operation(target, operation, filters, value,
+                                     include_programs=include_programs, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+            return _bulk_page(form=request.form, preview=summary)
+        
+        db.session.commit()
+        # One audit entry for the whole operation
+        log_admin_action(f'bulk_{operation}', target, None, summary)
+        
+        flash(f"{operation.replace('_', ' ').capitalize()} applied to {summary['updated']} {target}.", 'success')
+    except BulkOperationError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+        return _bulk_page(form=request.form)
+    except Exception as e:
+        db.session.rollback()
+        flash('Error running bulk operation.', 'error')
+        print(f"Error running bulk operation: {e}")
+    
+    return redirect(url_for('admin.bulk'))
 
 # Analytics and Reports
 @admin.route('/analytics')
 @admin_required
 def analytics():
-    # Application statistics by status
-    app_stats = db.session.query(
-        Application.status, 
-        func.count(Application.id).label('count')
-    ).group_by(Application.status).all()
+    group_by = request.args.get('group_by')
+    report = get_report(group_by, refresh=request.args.get('refresh') == '1')
     
-    # Revenue statistics by month
-    revenue_stats = db.session.query(
-        func.extract('month', Payment.completed_at).label('month'),
-        func.sum(Payment.amount).label('revenue')
-    ).filter_by(status=PaymentStatus.COMPLETED).group_by('month').all()
+    # Application statistics by status (current counts from the daily rollups)
+    app_stats = db.session.query(
+        DailyStat.metric,
+        func.sum(DailyStat.count).label('count')
+    ).filter(DailyStat.metric.like('total:status:%')).group_by(DailyStat.metric).all()
+    app_stats = [(ApplicationStatus(metric.split(':', 2)[2]), count) for metric, count in app_stats]
+    
+    # Revenue by calendar month, last 12 months
+    months = month_starts(12)
+    revenue_by_month = {start: Decimal('0') for start in months}
+    for day, amount in db.session.query(DailyStat.day, DailyStat.amount).filter(
+        DailyStat.metric == 'revenue',
+        DailyStat.day >= months[0]
+    ):
+        revenue_by_month[day.replace(day=1)] += amount or 0
+    revenue_stats = [(start.strftime('%b %Y'), revenue_by_month[start]) for start in months]
     
     # Top institutions by application count
     top_institutions = db.session.query(
         Institution.name,
         func.count(Application.id).label('count')
-    ).join(Application).group_by(Institution.name).order_by(desc('count')).limit(10).all()
+    ).join(Application).group_by(Institution.id, Institution.name).order_by(desc('count')).limit(10).all()
     
     return render_template('admin/analytics.html',
                          app_stats=app_stats,
                          revenue_stats=revenue_stats,
-                         top_institutions=top_institutions)
+                         top_institutions=top_institutions,
+                         report=report)
+
+@admin.route('/analytics/report')
+@admin_required
+def analytics_report():
+    """Funnel, time-in-stage and cohort report as JSON (?group_by=institution|country|program)"""
+    return jsonify(get_report(request.args.get('group_by'), refresh=request.args.get('refresh') == '1'))
 
 # Settings
 @admin.route('/settings')
 @admin_required
 def settings():
-    return render_template('admin/settings.html')
+    exchange_rates = ExchangeRate.query.order_by(ExchangeRate.currency).all()
+    return render_template('admin/settings.html',
+                         exchange_rates=exchange_rates,
+                         base_currency=base_currency())
+
+@admin.route('/settings/exchange-rates', methods=['POST'])
+@admin_required
+def update_exchange_rates():
+    currencies = request.form.getlist('currency')
+    rates = request.form.getlist('rate')
+    
+    try:
+        new_rates = {}
+        for currency, rate in zip(currencies, rates):
+            currency = currency.strip().upper()
+            if not currency:
+                continue
+            rate = Decimal(rate)
+            if len(currency) != 3 or rate <= 0:
+                raise ValueError(currency)
+            new_rates[currency] = rate
+    except (InvalidOperation, ValueError):
+        flash('Exchange rates must be 3-letter currency codes with positive rates.', 'error')
+        return redirect(url_for('admin.settings'))
+    
+    try:
+        # Stores the rates and recomputes every program's normalized costs in one transaction
+        updated = set_exchange_rates(new_rates)
+        
+        log_admin_action('exchange_rates_updated', 'exchange_rate', None, {
+            'rates': {currency: str(rate) for currency, rate in new_rates.items()},
+            'programs_updated': updated
+        })
+        
+        flash(f'Exchange rates updated; {updated} program costs recalculated.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Error updating exchange rates.', 'error')
+        print(f"Error updating exchange rates: {e}")
+    
+    return redirect(url_for('admin.settings'))
 
 # Admin logs
 @admin.route('/logs')
 @admin_required
 def logs():
-    page = request.args.get('page', 1, type=int)
-    logs = AdminLog.query.join(User).order_by(desc(AdminLog.created_at)).paginate(
-        page=page, per_page=50, error_out=False
-    )
-    return render_template('admin/logs.html', logs=logs)
\ No newline at end of file
+    filters = {name: request.args.get(name, '').strip() for name in LOG_FILTERS}
+    months = archived_months()
+    archive_month = request.args.get('archive', '')
+    
+    if archive_month:
+        # Slow path: scan one month's archive files
+        if archive_month not in months:
+            flash(f'No archived audit log for {archive_month}.', 'error')
+            return redirect(url_for('admin.logs'))
+        logs = archive_page(archive_month, filters, request.args.get('page', 1, type=int))
+    else:
+        query = AdminLog.query.join(User).options(contains_eager(AdminLog.admin)).filter(*log_criteria(filters))
+        logs = admin_list_page(query, [AdminLog.created_at, AdminLog.id], per_page=50, descending=True)
+    
+    return render_template('admin/logs.html',
+                         logs=logs,
+                         filters=filters,
+                         archive_month=archive_month,
+                         archived_months=months)
@@ -0,0 +1,226 @@
+"""
+Application funnel and cohort analytics.
+
+The columns needed (status, timestamps, institution, country, program and
+the applicant's signup date) are pulled for all applications in one query
+and held as NumPy arrays. Funnels, time-in-stage and signup-month cohorts
+are then computed with grouped bincounts instead of one SQL aggregate per
+figure. Results are cached for ANALYTICS_MAX_AGE seconds and carry the time
+they were computed, so the page can show how fresh they are.
+"""
+
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from app import db
+from models import User, Institution, Program, Application, ApplicationStatus, UserRole
+
+# Funnel stages, in order
+STAGES = ('draft', 'submitted', 'under_review', 'accepted')
+
+# Furthest funnel stage each status implies; rejected and waitlisted
+# applications have been reviewed but not accepted
+STAGE_OF_STATUS = {
+    ApplicationStatus.DRAFT: 0,
+    ApplicationStatus.SUBMITTED: 1,
+    ApplicationStatus.UNDER_REVIEW: 2,
+    ApplicationStatus.WAITLISTED: 2,
+    ApplicationStatus.REJECTED: 2,
+    ApplicationStatus.ACCEPTED: 3,
+}
+
+DIMENSIONS = ('institution', 'country', 'program')
+
+# Seconds a computed report is served before it is recomputed
+ANALYTICS_MAX_AGE = 600
+
+SECONDS_PER_DAY = 86400.0
+
+def _epoch_seconds(values):
+    """Timestamps as float seconds, NaN for missing ones"""
+    return np.array([value.timestamp() if value else np.nan for value in values], dtype=np.float64)
+
+def _month_index(values):
+    """Months since year 0 (year * 12 + month - 1), -1 for missing"""
+    return np.array([value.year * 12 + value.month - 1 if value else -1 for value in values], dtype=np.int32)
+
+class ApplicationColumns:
+    """All applications as parallel arrays"""
+
+    def __init__(self, rows, students_by_month):
+        self.stage = np.array([STAGE_OF_STATUS[row.status] for row in rows], dtype=np.int8)
+        self.accepted = np.array([row.status == ApplicationStatus.ACCEPTED for row in rows], dtype=bool)
+        self.created = _epoch_seconds([row.created_at for row in rows])
+        self.submitted = _epoch_seconds([row.submitted_at for row in rows])
+        self.decided = _epoch_seconds([row.decision_date for row in rows])
+        self.user_id = np.array([row.user_id for row in rows], dtype=np.int64)
+        self.signup_month = _month_index([row.signup_at for row in rows])
+        self.students_by_month = students_by_month
+
+        # Dimensions as codes into label lists
+        self.labels = {}
+        self.codes = {}
+        for dimension, key, label in (('institution', 'institution_id', 'institution_name'),
+                                      ('country', 'country_code', 'country_code'),
+                                      ('program', 'program_id', 'program_name')):
+            index = {}
+            labels = []
+            codes = np.zeros(len(rows), dtype=np.int32)
+            for i, row in enumerate(rows):
+                value = getattr(row, key)
+                if value not in index:
+                    index[value] = len(labels)
+                    labels.append({'id': value, 'name': getattr(row, label)})
+                codes[i] = index[value]
+            self.labels[dimension] = labels
+            self.codes[dimension] = codes
+
+    def __len__(self):
+        return len(self.stage)
+
+    def _groups(self, group_by):
+        if group_by is None:
+            return np.zeros(len(self), dtype=np.int32), [{'id': None, 'name': 'All'}]
+        return self.codes[group_by], self.labels[group_by]
+
+    def funnel(self, group_by=None):
+        """Applications reaching each stage, and conversion from the previous stage, per group"""
+        codes, labels = self._groups(group_by)
+        groups = len(labels)
+        reached = [np.bincount(codes[self.stage >= i], minlength=groups) for i in range(len(STAGES))]
+        # Only the accepted status counts as reaching "accepted"
+        reached[3] = np.bincount(codes[self.accepted], minlength=groups)
+
+        result = []
+        for g, label in enumerate(labels):
+            counts = [int(reached[i][g]) for i in range(len(STAGES))]
+            result.append(dict(label, stages=[{
+                'stage': stage,
+                'count': counts[i],
+                'conversion': round(counts[i] / counts[i - 1], 4) if i and counts[i - 1] else None
+            } for i, stage in enumerate(STAGES)]))
+        result.sort(key=lambda row: -row['stages'][0]['count'])
+        return result
+
+    def time_in_stage(self, group_by=None):
+        """Mean and median days spent as a draft (created -> submitted) and in review (submitted -> decision)
+
+        There is no timestamp for entering under_review, so review time spans
+        submission to decision.
+        """
+        codes, labels = self._groups(group_by)
+        spans = {
+            'draft': (self.submitted - self.created) / SECONDS_PER_DAY,
+            'review': (self.decided - self.submitted) / SECONDS_PER_DAY,
+        }
+
+        result = [dict(label) for label in labels]
+        for stage, days in spans.items():
+            known = ~np.isnan(days) & (days >= 0)
+            counts = np.bincount(codes[known], minlength=len(labels))
+            totals = np.bincount(codes[known], weights=days[known], minlength=len(labels))
+            # Medians per group: sort by (group, days) once and pick the middle of each run
+            order = np.lexsort((days[known], codes[known]))
+            sorted_days = days[known][order]
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            for g, row in enumerate(result):
+                if counts[g]:
+                    middle = sorted_days[starts[g]:starts[g] + counts[g]]
+                    row[stage] = {
+                        'count': int(counts[g]),
+                        'mean_days': round(float(totals[g] / counts[g]), 1),
+                        'median_days': round(float(np.median(middle)), 1),
+                    }
+                else:
+                    row[stage] = {'count': 0, 'mean_days': None, 'median_days': None}
+        return result
+
+    def cohorts(self, group_by=None, months=12):
+        """Per signup month of the applicant: applications, submitted and accepted, per group
+
+        Ungrouped cohorts also report students signed up and how many of
+        them applied.
+        """
+        codes, labels = self._groups(group_by)
+        cohort_months = sorted(set(self.signup_month[self.signup_month >= 0].tolist())
+                               | set(self.students_by_month))[-months:]
+        result = []
+        for month in cohort_months:
+            in_cohort = self.signup_month == month
+            applications = np.bincount(codes[in_cohort], minlength=len(labels))
+            submitted = np.bincount(codes[in_cohort & (self.stage >= 1)], minlength=len(labels))
+            accepted = np.bincount(codes[in_cohort & self.accepted], minlength=len(labels))
+            cohort = {
+                'cohort': f'{month // 12:04d}-{month % 12 + 1:02d}',
+                'groups': [dict(label,
+                                applications=int(applications[g]),
+                                submitted=int(submitted[g]),
+                                accepted=int(accepted[g]))
+                           for g, label in enumerate(labels) if applications[g]],
+            }
+            if group_by is None:
+                students = self.students_by_month.get(month, 0)
+                applicants = len(np.unique(self.user_id[in_cohort]))
+                cohort['students'] = students
+                cohort['applicants'] = applicants
+                cohort['applicant_rate'] = round(applicants / students, 4) if students else None
+            result.append(cohort)
+        return result
+
+def load_application_columns():
+    rows = db.session.query(
+        Application.status,
+        Application.created_at,
+        Application.submitted_at,
+        Application.decision_date,
+        Application.user_id,
+        Application.institution_id,
+        Application.program_id,
+        Institution.name.label('institution_name'),
+        Institution.country_code,
+        Program.name.label('program_name'),
+        User.created_at.label('signup_at')
+    ).join(Institution, Application.institution_id == Institution.id).join(
+        Program, Application.program_id == Program.id
+    ).join(User, Application.user_id == User.id).all()
+
+    students_by_month = {}
+    signups = db.session.query(User.created_at).filter(User.role == UserRole.STUDENT).all()
+    for month in _month_index([created_at for (created_at,) in signups]).tolist():
+        if month >= 0:
+            students_by_month[month] = students_by_month.get(month, 0) + 1
+    return ApplicationColumns(rows, students_by_month)
+
+# Loaded columns and the reports computed from them, per group_by
+_cache = {'loaded_at': None, 'computed_at': None, 'columns': None, 'reports': {}}
+_lock = threading.Lock()
+
+def get_report(group_by=None, refresh=False):
+    """Funnel, time-in-stage and cohort report, served from cache while fresh"""
+    if group_by not in DIMENSIONS:
+        group_by = None
+    with _lock:
+        if refresh or _cache['loaded_at'] is None or time.time() - _cache['loaded_at'] >= ANALYTICS_MAX_AGE:
+            _cache['columns'] = load_application_columns()
+            _cache['loaded_at'] = time.time()
+            _cache['computed_at'] = datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+            _cache['reports'] = {}
+        if group_by in _cache['reports']:
+            return _cache['reports'][group_by]
+        columns = _cache['columns']
+        computed_at = _cache['computed_at']
+
+    report = {
+        'group_by': group_by,
+        'computed_at': computed_at,
+        'max_age': ANALYTICS_MAX_AGE,
+        'applications': len(columns),
+        'funnel': columns.funnel(group_by),
+        'time_in_stage': columns.time_in_stage(group_by),
+        'cohorts': columns.cohorts(group_by),
+    }
+    with _lock:
+        if _cache['columns'] is columns:
+            _cache['reports'][group_by] = report
+    return report
@@ -1,10 +1,64 @@
 from flask import Blueprint, jsonify, request
-from models import Institution, Program, db
+from flask_login import login_required, current_user
+from models import Institution, Program, INSTITUTION_RANKING_KEY, PROGRAM_COST_KEYS, db
+from sqlalchemy import func, select
+from search_index import match_institutions, match_programs
+from pagination import keyset_page, InvalidCursor, encode_cursor, decode_cursor
+from facets import filters_from_args, apply_facet_filters, get_facets
+from catalog_engine import get_program_catalog
+from autocomplete import autocomplete
+from catalog_cache import catalog_etag
+from currency import base_currency
+from eligibility import profile_from_args, eligible_program_ids, eligibility_criteria, parse_english_requirements
+from intakes import parse_month, months_in_window, filter_by_intake, parse_intake_months, MONTH_NAMES
+from recommendations import recommend_programs
+from similar_institutions import similar_institutions, SIMILAR_COUNT
+from exports import ndjson_lines, streamed_response
+from sqlalchemy.orm import contains_eager, joinedload
+from datetime import date, datetime, timedelta
 import requests
 import json
 
 api = Blueprint('api', __name__)
 
+PER_PAGE = 20
+
+# Most programs /api/programs/compare accepts at once
+MAX_COMPARE = 6
+
+def wants_total():
+    """Cursor clients opt in to an exact total with ?include_total=1"""
+    return request.args.get('include_total', '').lower() in ('1', 'true', 'yes')
+
+def invalid_cursor_response():
+    return jsonify({
+        'status': 'error',
+        'message': 'Invalid cursor'
+    }), 400
+
+def active_program_counts(institution_ids):
+    """Map institution id -> number of active programs, in one grouped query"""
+    if not institution_ids:
+        return {}
+    rows = db.session.query(
+        Program.institution_id,
+        func.count(Program.id)
+    ).filter(
+        Program.institution_id.in_(institution_ids),
+        Program.is_active == True
+    ).group_by(Program.institution_id).all()
+    return dict(rows)
+
+def programs_by_ids(program_ids):
+    """Load programs with their institutions, keeping the order of program_ids"""
+    if not program_ids:
+        return []
+    programs = Program.query.options(joinedload(Program.institution)).filter(
+        Program.id.in_(program_ids)
+    ).all()
+    by_id = {prog.id: prog for prog in programs}
+    return [by_id[pid] for pid in program_ids if pid in by_id]
+
 # Mock external university API integration
 # In production, you would integrate with real APIs like:
 # - Universities API
@@ -12,6 +66,7 @@ api = Blueprint('api', __name__)
 # - Institution ranking services
 
 @api.route('/universities/search')
+@catalog_etag
 def search_universities():
     """Search universities with external API integration"""
     country = request.args.get('country', '')
@@ -25,16 +80,28 @@ def search_universities():
         query = query.filter_by(country_code=country)
     
     if search_term:
-        query = query.filter(
-            db.or_(
-                Institution.name.contains(search_term),
-                Institution.city.contains(search_term),
-                Institution.description.contains(search_term)
+        query = match_institutions(query, search_term)
+    
+    if 'cursor' in request.args:
+        # Keyset mode: stable (world_ranking, id) order, no OFFSET and no COUNT
+        # unless the client asks for it
+        try:
+            universities, next_cursor = keyset_page(
+                query,
+                [INSTITUTION_RANKING_KEY, Institution.id],
+                request.args.get('cursor'),
+                PER_PAGE
             )
-        )
+        except InvalidCursor:
+            return invalid_cursor_response()
+        total = query.order_by(None).count() if wants_total() else None
+        pagination = {'next_cursor': next_cursor, 'has_next': next_cursor is not None}
+    else:
+        universities = query.offset((page - 1) * PER_PAGE).limit(PER_PAGE).all()
+        total = query.count()
+        pagination = {'page': page, 'has_next': total > page * PER_PAGE}
     
-    universities = query.offset((page - 1) * 20).limit(20).all()
-    total = query.count()
+    program_counts = active_program_counts([uni.id for uni in universities])
     
     # Format response
     result = {
@@ -49,44 +116,132 @@ def search_universities():
             'type': uni.type,
             'world_ranking': uni.world_ranking,
             'application_fee': float(uni.application_fee) if uni.application_fee else 0,
-            'program_count': uni.programs.filter_by(is_active=True).count()
+            'program_count': program_counts.get(uni.id, 0)
         } for uni in universities],
         'total': total,
-        'page': page,
-        'has_next': total > page * 20
+        **pagination
     }
     
     return jsonify(result)
 
 @api.route('/programs/search')
+@catalog_etag
 def search_programs():
-    """Search programs with filtering"""
+    """Search programs with filtering
+
+    Fee filters (min_fee/max_fee on annual tuition, min_total_cost/
+    max_total_cost on the whole program) and sort=tuition|total_cost use
+    the costs normalized to the base currency. With eligible=1 only
+    programs whose requirements the profile in the args (gpa, ielts, toefl,
+    ...) meets are returned. intake_month=9 (or "sep") and
+    intake_window=9-11 (may wrap, e.g. 11-2) match programs with an intake
+    in those months.
+    """
     university_id = request.args.get('university_id', type=int)
     field = request.args.get('field', '')
-    degree_type = request.args.get('degree_type', '')
     min_fee = request.args.get('min_fee', type=float)
     max_fee = request.args.get('max_fee', type=float)
+    min_total_cost = request.args.get('min_total_cost', type=float)
+    max_total_cost = request.args.get('max_total_cost', type=float)
     page = request.args.get('page', 1, type=int)
+    sort = request.args.get('sort', 'tuition')
+    if sort not in PROGRAM_COST_KEYS:
+        sort = 'tuition'
+    # Base-currency cost with unpriced programs last; indexed as an expression
+    cost_key = PROGRAM_COST_KEYS[sort]
     
-    query = Program.query.filter_by(is_active=True).join(Institution)
-    
-    if university_id:
-        query = query.filter_by(institution_id=university_id)
-    
-    if field:
-        query = query.filter(Program.field_of_study.contains(field))
-    
-    if degree_type:
-        query = query.filter_by(degree_type=degree_type)
+    filters = filters_from_args(request.args)
     
-    if min_fee is not None:
-        query = query.filter(Program.tuition_fee >= min_fee)
+    intake_months = None
+    if request.args.get('intake_month'):
+        intake_months = [parse_month(request.args['intake_month'])]
+    elif request.args.get('intake_window'):
+        intake_months = months_in_window(request.args['intake_window'])
+    if intake_months is not None and (not intake_months or None in intake_months):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid intake month'
+        }), 400
     
-    if max_fee is not None:
-        query = query.filter(Program.tuition_fee <= max_fee)
+    profile = None
+    if request.args.get('eligible', '').lower() in ('1', 'true', 'yes'):
+        profile = profile_from_args(request.args)
     
-    programs = query.offset((page - 1) * 20).limit(20).all()
-    total = query.count()
+    # The snapshot is stored in tuition order, so it only serves that sort
+    catalog = get_program_catalog() if sort == 'tuition' else None
+    if catalog is not None:
+        # Filter and page over the shared array snapshot; only the page
+        # itself is loaded from the database
+        eligible_ids = eligible_program_ids(profile) if profile is not None else None
+        mask = catalog.select(filters, field, min_fee, max_fee, university_id,
+                              min_total_cost, max_total_cost, eligible_ids, intake_months)
+        if 'cursor' in request.args:
+            keys = [cost_key, Program.id]
+            try:
+                after = decode_cursor(request.args['cursor'], keys) if request.args['cursor'] else None
+            except InvalidCursor:
+                return invalid_cursor_response()
+            program_ids, next_key = catalog.page_after(mask, after, PER_PAGE)
+            next_cursor = encode_cursor(next_key) if next_key else None
+            total = int(mask.sum()) if wants_total() else None
+            pagination = {'next_cursor': next_cursor, 'has_next': next_cursor is not None}
+        else:
+            program_ids, total = catalog.page(mask, (page - 1) * PER_PAGE, PER_PAGE)
+            pagination = {'page': page, 'has_next': total > page * PER_PAGE}
+        programs = programs_by_ids(program_ids)
+    else:
+        query = Program.query.filter_by(is_active=True).join(Institution).filter(
+            Institution.is_active == True
+        ).options(contains_eager(Program.institution))
+        
+        if university_id:
+            query = query.filter_by(institution_id=university_id)
+        
+        if field:
+            query = match_programs(query, field, field_only=True)
+        
+        # country, degree_type, fee_range and the program feature flags
+        query = apply_facet_filters(query, filters)
+        
+        if profile is not None:
+            query = query.filter(*eligibility_criteria(profile))
+        
+        if intake_months:
+            query = filter_by_intake(query, intake_months)
+        
+        if min_fee is not None:
+            query = query.filter(Program.tuition_fee_base >= min_fee)
+        
+        if max_fee is not None:
+            query = query.filter(Program.tuition_fee_base <= max_fee)
+        
+        if min_total_cost is not None:
+            query = query.filter(Program.total_cost_base >= min_total_cost)
+        
+        if max_total_cost is not None:
+            query = query.filter(Program.total_cost_base <= max_total_cost)
+        
+        # Same deterministic order as the snapshot, so page numbers mean the
+        # same rows whichever path serves them
+        query = query.order_by(None).order_by(cost_key, Program.id)
+        
+        if 'cursor' in request.args:
+            # Keyset mode: cheapest first, ordered by (cost, id)
+            try:
+                programs, next_cursor = keyset_page(
+                    query,
+                    [cost_key, Program.id],
+                    request.args.get('cursor'),
+                    PER_PAGE
+                )
+            except InvalidCursor:
+                return invalid_cursor_response()
+            total = query.order_by(None).count() if wants_total() else None
+            pagination = {'next_cursor': next_cursor, 'has_next': next_cursor is not None}
+        else:
+            programs = query.offset((page - 1) * PER_PAGE).limit(PER_PAGE).all()
+            total = query.count()
+            pagination = {'page': page, 'has_next': total > page * PER_PAGE}
     
     result = {
         'programs': [{
@@ -98,19 +253,228 @@ def search_programs():
             'duration_months': prog.duration_months,
             'tuition_fee': float(prog.tuition_fee),
             'currency': prog.currency,
+            'tuition_fee_base': float(prog.tuition_fee_base) if prog.tuition_fee_base is not None else None,
+            'total_cost_base': float(prog.total_cost_base) if prog.total_cost_base is not None else None,
+            'base_currency': base_currency(),
             'language': prog.language_of_instruction,
+            'intake_months': prog.intake_months,
             'scholarships_available': prog.scholarships_available,
             'work_permit_eligible': prog.work_permit_eligible,
             'online_available': prog.online_available
         } for prog in programs],
         'total': total,
-        'page': page,
-        'has_next': total > page * 20
+        **pagination
+    }
+    
+    return jsonify(result)
+
+@api.route('/programs/eligibility')
+@catalog_etag
+def program_eligibility():
+    """Ids of all programs a student profile qualifies for (gpa, ielts, toefl, pte, duolingo, cambridge, english_exempt)"""
+    profile = profile_from_args(request.args)
+    program_ids = eligible_program_ids(profile)
+    
+    return jsonify({
+        'profile': {key: value for key, value in profile.items() if value not in (None, False)},
+        'total': len(program_ids),
+        'program_ids': program_ids
+    })
+
+@api.route('/recommendations')
+@login_required
+def program_recommendations():
+    """Programs recommended for the current user from their profile, best first"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    recommendations = recommend_programs(current_user, limit)
+    programs = programs_by_ids([program_id for program_id, _ in recommendations])
+    scores = dict(recommendations)
+    
+    return jsonify({
+        'programs': [{
+            'id': prog.id,
+            'name': prog.name,
+            'institution': prog.institution.name,
+            'country_code': prog.institution.country_code,
+            'degree_type': prog.degree_type,
+            'field_of_study': prog.field_of_study,
+            'tuition_fee': float(prog.tuition_fee),
+            'currency': prog.currency,
+            'scholarships_available': prog.scholarships_available,
+            'score': scores[prog.id]
+        } for prog in programs]
+    })
+
+@api.route('/deadlines')
+def upcoming_deadlines():
+    """Programs whose application deadline is in the next `days` days, soonest first
+
+    Programs without their own deadline use their institution's. Paged by
+    cursor over the (is_active, effective_deadline, id) index; accepts the
+    facet filters (country, field_of_study, degree_type, ...).
+    """
+    days = min(max(request.args.get('days', 30, type=int), 0), 365)
+    today = date.today()
+    
+    query = Program.query.filter(
+        Program.is_active == True,
+        Program.effective_deadline >= today,
+        Program.effective_deadline <= today + timedelta(days=days)
+    ).join(Institution).filter(
+        Institution.is_active == True
+    ).options(contains_eager(Program.institution))
+    query = apply_facet_filters(query, filters_from_args(request.args))
+    
+    try:
+        programs, next_cursor = keyset_page(
+            query,
+            [Program.effective_deadline, Program.id],
+            request.args.get('cursor'),
+            PER_PAGE
+        )
+    except InvalidCursor:
+        return invalid_cursor_response()
+    
+    return jsonify({
+        'programs': [{
+            'id': prog.id,
+            'name': prog.name,
+            'institution_id': prog.institution_id,
+            'institution': prog.institution.name,
+            'country_code': prog.institution.country_code,
+            'degree_type': prog.degree_type,
+            'field_of_study': prog.field_of_study,
+            'deadline': prog.effective_deadline.isoformat(),
+            'deadline_source': 'program' if prog.application_deadline else 'institution',
+            'days_left': (prog.effective_deadline - today).days
+        } for prog in programs],
+        'days': days,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    })
+
+@api.route('/programs/compare')
+@catalog_etag
+def compare_programs():
+    """Side-by-side comparison of up to MAX_COMPARE programs (?ids=1,2,3), loaded in one query"""
+    try:
+        program_ids = list(dict.fromkeys(int(part) for part in request.args.get('ids', '').split(',') if part.strip()))
+    except ValueError:
+        program_ids = []
+    if not program_ids or len(program_ids) > MAX_COMPARE:
+        return jsonify({
+            'status': 'error',
+            'message': f'Provide between 1 and {MAX_COMPARE} program ids'
+        }), 400
+    
+    programs = programs_by_ids(program_ids)
+    found = {prog.id for prog in programs}
+    
+    def money(value):
+        return float(value) if value is not None else None
+    
+    institutions = {}
+    for prog in programs:
+        inst = prog.institution
+        institutions[str(inst.id)] = {
+            'id': inst.id,
+            'name': inst.name,
+            'location': f"{inst.city}, {inst.country}",
+            'country_code': inst.country_code,
+            'type': inst.type,
+            'world_ranking': inst.world_ranking,
+            'application_fee': money(inst.application_fee),
+            'website': inst.website
+        }
+    
+    result = {
+        'base_currency': base_currency(),
+        'programs': [{
+            'id': prog.id,
+            'name': prog.name,
+            'institution_id': prog.institution_id,
+            'degree_type': prog.degree_type,
+            'field_of_study': prog.field_of_study,
+            'duration_months': prog.duration_months,
+            'language': prog.language_of_instruction,
+            'costs': {
+                'currency': prog.currency,
+                'tuition_fee': money(prog.tuition_fee),
+                'additional_fees': money(prog.additional_fees),
+                'total_cost': round(float(prog.tuition_fee) * prog.duration_months / 12
+                                    + float(prog.additional_fees or 0), 2),
+                'tuition_fee_base': money(prog.tuition_fee_base),
+                'total_cost_base': money(prog.total_cost_base)
+            },
+            'intake_months': [{
+                'month': month,
+                'name': MONTH_NAMES[month - 1].title()
+            } for month in parse_intake_months(prog.intake_months)],
+            'application_deadline': prog.effective_deadline.isoformat() if prog.effective_deadline else None,
+            'requirements': {
+                'min_gpa': float(prog.min_gpa) if prog.min_gpa is not None else None,
+                'english': parse_english_requirements(prog.english_requirements),
+                'other': prog.other_requirements
+            },
+            'scholarships_available': prog.scholarships_available,
+            'work_permit_eligible': prog.work_permit_eligible,
+            'online_available': prog.online_available,
+            'seats_available': prog.seats_available
+        } for prog in programs],
+        'institutions': institutions,
+        'missing': [program_id for program_id in program_ids if program_id not in found]
     }
     
     return jsonify(result)
 
+@api.route('/programs/facets')
+@catalog_etag
+def program_facets():
+    """Facet counts for the program search sidebar"""
+    return jsonify(get_facets(filters_from_args(request.args)))
+
+@api.route('/autocomplete')
+@catalog_etag
+def autocomplete_suggestions():
+    """Search-as-you-type suggestions: institutions, cities, fields and programs"""
+    prefix = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 25)
+    
+    return jsonify({
+        'query': prefix,
+        'suggestions': [{
+            key: value for key, value in suggestion.items() if key != 'weight'
+        } for suggestion in autocomplete(prefix, limit)]
+    })
+
+@api.route('/universities/<int:uni_id>/similar')
+@catalog_etag
+def similar_universities(uni_id):
+    """Precomputed most similar institutions, most similar first"""
+    limit = min(max(request.args.get('limit', SIMILAR_COUNT, type=int), 1), SIMILAR_COUNT)
+    similar = similar_institutions(uni_id, limit)
+    if not similar and db.session.get(Institution, uni_id) is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'University not found'
+        }), 404
+    
+    return jsonify({
+        'university_id': uni_id,
+        'similar': [{
+            'id': uni.id,
+            'name': uni.name,
+            'location': f"{uni.city}, {uni.country}",
+            'country_code': uni.country_code,
+            'type': uni.type,
+            'world_ranking': uni.world_ranking,
+            'logo_url': uni.logo_url,
+            'score': round(score, 4)
+        } for uni, score in similar]
+    })
+
 @api.route('/universities/<int:uni_id>/programs')
+@catalog_etag
 def university_programs(uni_id):
     """Get programs for a specific university"""
     university = Institution.query.get_or_404(uni_id)
@@ -136,6 +500,46 @@ def university_programs(uni_id):
     
     return jsonify(result)
 
+# Bulk catalog export
+def _export_rows(model, record_type, updated_since):
+    """NDJSON lines for every row of model, streamed in batches from a server-side cursor"""
+    table = model.__table__
+    statement = select(table).order_by(table.c.updated_at, table.c.id)
+    if updated_since:
+        statement = statement.where(table.c.updated_at >= updated_since)
+    return ndjson_lines(statement, record_type=record_type)
+
+@api.route('/catalog/export')
+def export_catalog():
+    """Stream all institutions, then all programs, as NDJSON
+
+    Each line's record_type is "meta" (the first line), "institution" or
+    "program"; the other keys are the row's columns.
+
+    ?updated_since=<ISO datetime> limits the export to rows changed since
+    then; pass the previous export's exported_at for incremental pulls. The
+    stream is gzip-encoded when the client accepts it.
+    """
+    updated_since = request.args.get('updated_since')
+    if updated_since:
+        try:
+            updated_since = datetime.fromisoformat(updated_since)
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'updated_since must be an ISO 8601 datetime'
+            }), 400
+    
+    header = {'record_type': 'meta', 'exported_at': datetime.utcnow().isoformat(),
+              'updated_since': updated_since.isoformat() if updated_since else None}
+    
+    def lines():
+        yield json.dumps(header) + '\n'
+        yield from _export_rows(Institution, 'institution', updated_since)
+        yield from _export_rows(Program, 'program', updated_since)
+    
+    return streamed_response(lines, 'application/x-ndjson', 'catalog.ndjson')
+
 # External API integration functions
 def fetch_university_rankings():
     """
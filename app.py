@@ -25,6 +25,19 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
 }
 
+# Serve catalog filter queries from the shared in-memory snapshot (catalog_engine.py)
+app.config["CATALOG_ENGINE"] = os.environ.get("CATALOG_ENGINE", "").lower() in ("1", "true", "yes")
+
+# Seconds browsers and proxies may reuse catalog JSON before revalidating its ETag
+app.config["CATALOG_CACHE_MAX_AGE"] = int(os.environ.get("CATALOG_CACHE_MAX_AGE", "60"))
+
+# Seconds a worker reuses the catalog version it read from the database; writes
+# on other hosts reach this one's caches and ETags within this delay
+app.config["CATALOG_VERSION_TTL"] = float(os.environ.get("CATALOG_VERSION_TTL", "1"))
+
+# Currency that program costs are normalized to for fee filters and sorting
+app.config["BASE_CURRENCY"] = os.environ.get("BASE_CURRENCY", "USD")
+
 # Initialize extensions
 db = SQLAlchemy(app, model_class=Base)
 login_manager = LoginManager()
@@ -0,0 +1,211 @@
+"""
+Monthly archives of the admin audit log.
+
+admin_logs only keeps the last AUDIT_HOT_MONTHS calendar months, so the log
+view, its filters (served by the created_at, action and target indexes) and
+its COUNT stay fast however long the team has been busy.
+compact_admin_logs() moves each older month out of the table into
+gzip-compressed files in the instance folder, one JSON object per line and
+one or more parts per month:
+
+    instance/audit_archive/admin_logs-2026-03.<first id>-<last id>.jsonl.gz
+
+Archived rows carry the admin's email and name, so they stay readable after
+the user changes. Archives are only read when the log view is asked for an
+archived month. Run the compactor periodically (e.g. from cron):
+
+    python audit_archive.py              # keep AUDIT_HOT_MONTHS months
+    python audit_archive.py --keep 6
+"""
+
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import func, delete
+from app import app, db
+from models import AdminLog, User
+from rollups import month_starts
+from pagination import ListPage
+
+# Calendar months kept in admin_logs, the current one included
+AUDIT_HOT_MONTHS = 3
+# Rows read and deleted per round trip while compacting
+ARCHIVE_BATCH = 1000
+
+ARCHIVE_DIR = os.path.join(app.instance_path, 'audit_archive')
+_PART = re.compile(r'^admin_logs-(\d{4}-\d{2})\.(\d+)-(\d+)\.jsonl\.gz$')
+
+LOG_FILTERS = ('action', 'target_type', 'target_id', 'admin_id', 'q')
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def log_criteria(filters):
+    """WHERE criteria on AdminLog for the log view filters"""
+    criteria = []
+    if filters.get('action'):
+        criteria.append(AdminLog.action == filters['action'])
+    if filters.get('target_type'):
+        criteria.append(AdminLog.target_type == filters['target_type'])
+    if _int(filters.get('target_id')) is not None:
+        criteria.append(AdminLog.target_id == _int(filters['target_id']))
+    if _int(filters.get('admin_id')) is not None:
+        criteria.append(AdminLog.admin_id == _int(filters['admin_id']))
+    if filters.get('q'):
+        criteria.append(AdminLog.details.ilike(f"%{filters['q']}%"))
+    return criteria
+
+def _matches(entry, filters):
+    """log_criteria() for an archived entry"""
+    if filters.get('action') and entry['action'] != filters['action']:
+        return False
+    if filters.get('target_type') and entry['target_type'] != filters['target_type']:
+        return False
+    if _int(filters.get('target_id')) is not None and entry['target_id'] != _int(filters['target_id']):
+        return False
+    if _int(filters.get('admin_id')) is not None and entry['admin_id'] != _int(filters['admin_id']):
+        return False
+    if filters.get('q') and filters['q'].lower() not in (entry['details'] or '').lower():
+        return False
+    return True
+
+def _month_key(day):
+    return f'{day.year:04d}-{day.month:02d}'
+
+def _next_month(day):
+    return day.replace(year=day.year + 1, month=1) if day.month == 12 else day.replace(month=day.month + 1)
+
+def archive_parts(month=None):
+    """[(month, first id, last id, path)] of the archive files, oldest first"""
+    parts = []
+    for path in glob.glob(os.path.join(ARCHIVE_DIR, 'admin_logs-*.jsonl.gz')):
+        match = _PART.match(os.path.basename(path))
+        if match and month in (None, match.group(1)):
+            parts.append((match.group(1), int(match.group(2)), int(match.group(3)), path))
+    return sorted(parts)
+
+def archived_months():
+    """Months ("YYYY-MM") with archived entries, newest first"""
+    return sorted({part[0] for part in archive_parts()}, reverse=True)
+
+def _read_part(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def _delete_ids(ids):
+    for start in range(0, len(ids), ARCHIVE_BATCH):
+        db.session.execute(delete(AdminLog).where(AdminLog.id.in_(ids[start:start + ARCHIVE_BATCH])))
+
+def _compact_month(start, end):
+    """Move one month's rows into a new archive part; returns the number moved"""
+    month = _month_key(start)
+    in_month = [AdminLog.created_at >= start, AdminLog.created_at < end]
+
+    # A run that stopped between writing a part and deleting its rows leaves them behind
+    archived_up_to = max((last for _, _, last, _ in archive_parts(month)), default=0)
+    if archived_up_to and db.session.query(AdminLog.id).filter(
+            *in_month, AdminLog.id <= archived_up_to).first() is not None:
+        _delete_ids([entry['id'] for _, _, _, path in archive_parts(month) for entry in _read_part(path)])
+
+    rows = db.session.query(
+        AdminLog, User.email, User.first_name, User.last_name
+    ).outerjoin(User, AdminLog.admin_id == User.id).filter(*in_month).order_by(AdminLog.id).yield_per(ARCHIVE_BATCH)
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = os.path.join(ARCHIVE_DIR, f'.compact-{os.getpid()}.tmp')
+    ids = []
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as file:
+            for log, email, first_name, last_name in rows:
+                file.write((json.dumps({
+                    'id': log.id,
+                    'admin_id': log.admin_id,
+                    'admin_email': email,
+                    'admin_first_name': first_name,
+                    'admin_last_name': last_name,
+                    'action': log.action,
+                    'target_type': log.target_type,
+                    'target_id': log.target_id,
+                    'details': log.details,
+                    'ip_address': log.ip_address,
+                    'created_at': log.created_at.isoformat(),
+                }) + '\n').encode('utf-8'))
+                ids.append(log.id)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    if not ids:
+        os.remove(tmp_path)
+        db.session.commit()
+        return 0
+    # The part is on disk before its rows are deleted
+    os.replace(tmp_path, os.path.join(ARCHIVE_DIR, f'admin_logs-{month}.{ids[0]}-{ids[-1]}.jsonl.gz'))
+    _delete_ids(ids)
+    db.session.commit()
+    return len(ids)
+
+def compact_admin_logs(keep_months=AUDIT_HOT_MONTHS):
+    """Archive every month older than the last keep_months; returns {month: rows moved}"""
+    cutoff = month_starts(max(keep_months, 1))[0]
+    oldest = db.session.query(func.min(AdminLog.created_at)).scalar()
+    moved = {}
+    if oldest is None:
+        return moved
+    start = oldest.date().replace(day=1)
+    while start < cutoff:
+        end = _next_month(start)
+        count = _compact_month(datetime.combine(start, datetime.min.time()),
+                               datetime.combine(end, datetime.min.time()))
+        if count:
+            moved[_month_key(start)] = count
+        start = end
+    return moved
+
+def _archived_log(entry):
+    """An archived entry with the attributes of an AdminLog"""
+    first_name = entry.get('admin_first_name') or ''
+    last_name = entry.get('admin_last_name') or ''
+    return SimpleNamespace(
+        id=entry['id'],
+        admin_id=entry['admin_id'],
+        admin=SimpleNamespace(id=entry['admin_id'], email=entry.get('admin_email'),
+                              first_name=first_name, last_name=last_name,
+                              full_name=f'{first_name} {last_name}'.strip()),
+        action=entry['action'],
+        target_type=entry['target_type'],
+        target_id=entry['target_id'],
+        details=entry['details'],
+        ip_address=entry['ip_address'],
+        created_at=datetime.fromisoformat(entry['created_at']),
+        archived=True,
+    )
+
+def archive_page(month, filters, page=1, per_page=50):
+    """One page of a month's archived entries matching filters, newest first"""
+    entries = [entry for _, _, _, path in archive_parts(month)
+               for entry in _read_part(path) if _matches(entry, filters)]
+    entries.sort(key=lambda entry: (entry['created_at'], entry['id']), reverse=True)
+    page = max(page, 1)
+    items = entries[(page - 1) * per_page:page * per_page]
+    return ListPage([_archived_log(entry) for entry in items], page, per_page, len(entries),
+                    has_next=page * per_page < len(entries))
+
+if __name__ == '__main__':
+    keep = AUDIT_HOT_MONTHS
+    if '--keep' in sys.argv[1:]:
+        keep = int(sys.argv[sys.argv.index('--keep') + 1])
+    with app.app_context():
+        moved = compact_admin_logs(keep)
+        for month, count in moved.items():
+            print(f"Archived {count} audit log entries from {month}")
+        print(f"Audit log compacted; keeping {keep} months in admin_logs")
@@ -0,0 +1,215 @@
+"""
+Write-behind audit log.
+
+record() only puts the entry on an in-process queue, so logging adds no
+database round trip to an admin request. A background thread inserts queued
+entries into admin_logs in batches of up to AUDIT_BATCH_SIZE rows, every
+AUDIT_FLUSH_INTERVAL seconds or as soon as a full batch is waiting; whatever is still
+queued is flushed when the process exits.
+
+The queue is bounded. When it is full, or when a batch cannot be inserted,
+entries are appended to a fallback file in the instance folder (one JSON
+object per line). The file is replayed into the table by the next batch that
+succeeds and on start-up, so entries survive a database outage or a restart.
+Appends and replays hold an exclusive lock on a lock file next to it, so
+an entry another worker spills while a replay claims the file is never lost.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from app import app, db
+from models import AdminLog
+from totals import note_written
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process fallback lock
+    fcntl = None
+
+# Entries held in memory before new ones go straight to the fallback file
+AUDIT_QUEUE_SIZE = 10000
+# Rows inserted per statement
+AUDIT_BATCH_SIZE = 500
+# Seconds an entry may wait for its batch
+AUDIT_FLUSH_INTERVAL = 1.0
+
+FALLBACK_FILE = os.path.join(app.instance_path, 'audit_fallback.jsonl')
+_FALLBACK_LOCK_FILE = f'{FALLBACK_FILE}.lock'
+
+COLUMNS = ('admin_id', 'action', 'target_type', 'target_id', 'details', 'ip_address', 'created_at')
+
+def _to_line(entry):
+    return json.dumps(dict(entry, created_at=entry['created_at'].isoformat())) + '\n'
+
+def _from_lines(lines):
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+            entry['created_at'] = datetime.fromisoformat(entry['created_at'])
+        except (ValueError, KeyError, TypeError):
+            # e.g. a line cut short by a crash mid-write
+            print(f"Skipping unreadable audit log fallback line: {line[:200]!r}")
+            continue
+        entries.append(entry)
+    return entries
+
+@contextmanager
+def _fallback_locked():
+    """Hold the fallback file's lock, across processes"""
+    os.makedirs(os.path.dirname(FALLBACK_FILE), exist_ok=True)
+    with open(_FALLBACK_LOCK_FILE, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class AuditWriter:
+    """Bounded queue of audit entries and the thread that writes them"""
+
+    def __init__(self):
+        self._pid = None
+        self._queue = None
+        self._wakeup = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Held while a batch is written, so flush() also waits for the batch in flight
+        self._write_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # A forked worker inherits the queue but not the thread; start afresh
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def record(self, entry):
+        """Queue one admin_logs row (a dict of COLUMNS); never blocks on the database"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.spill([entry])
+            return
+        if self._queue.qsize() >= AUDIT_BATCH_SIZE:
+            self._wakeup.set()
+
+    def _take(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Wake every AUDIT_FLUSH_INTERVAL, or as soon as a full batch is queued
+            self._wakeup.wait(AUDIT_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of entries taken"""
+        if self._pid != os.getpid():
+            return 0
+        taken = 0
+        with self._write_lock:
+            while True:
+                batch = self._take(AUDIT_BATCH_SIZE)
+                if not batch:
+                    return taken
+                self._write(batch)
+                taken += len(batch)
+
+    def _write(self, batch):
+        with app.app_context():
+            try:
+                self._insert(batch)
+            except Exception as e:
+                print(f"Error writing audit log batch, kept in {FALLBACK_FILE}: {e}")
+                self.spill(batch)
+                return
+            try:
+                replay_fallback()
+            except Exception as e:
+                print(f"Error replaying audit log fallback: {e}")
+
+    @staticmethod
+    def _insert(rows):
+        with db.engine.begin() as connection:
+            for start in range(0, len(rows), AUDIT_BATCH_SIZE):
+                connection.execute(AdminLog.__table__.insert(), rows[start:start + AUDIT_BATCH_SIZE])
+        note_written(AdminLog.__tablename__)
+
+    def spill(self, entries):
+        """Append entries to the fallback file and sync it to disk"""
+        with self._file_lock, _fallback_locked():
+            with open(FALLBACK_FILE, 'a') as file:
+                file.writelines(_to_line(entry) for entry in entries)
+                file.flush()
+                os.fsync(file.fileno())
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+def record(admin_id, action, target_type=None, target_id=None, details=None, ip_address=None):
+    """Queue an audit entry stamped with the current time"""
+    writer.record({
+        'admin_id': admin_id,
+        'action': action,
+        'target_type': target_type,
+        'target_id': target_id,
+        'details': details,
+        'ip_address': ip_address,
+        'created_at': datetime.utcnow(),
+    })
+
+def replay_fallback():
+    """Insert entries left in the fallback file; returns how many were replayed"""
+    if not os.path.exists(FALLBACK_FILE):
+        return 0
+    # Claim the file by renaming it, so concurrent workers never replay it twice.
+    # The lock keeps spill() from appending to it between the rename and the read.
+    claimed = f'{FALLBACK_FILE}.{os.getpid()}.replay'
+    with _fallback_locked():
+        try:
+            os.replace(FALLBACK_FILE, claimed)
+        except FileNotFoundError:
+            return 0
+        with open(claimed) as file:
+            entries = _from_lines(line for line in file if line.strip())
+    try:
+        AuditWriter._insert(entries)
+    except Exception:
+        # Put the entries back for the next attempt
+        writer.spill(entries)
+        os.remove(claimed)
+        raise
+    os.remove(claimed)
+    return len(entries)
+
+def init_audit_log():
+    """Replay entries a previous run left in the fallback file; call after db.create_all()"""
+    try:
+        replayed = replay_fallback()
+        if replayed:
+            print(f"Replayed {replayed} audit log entries")
+    except Exception as e:
+        print(f"Error replaying audit log fallback: {e}")
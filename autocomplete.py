@@ -0,0 +1,228 @@
+"""
+Prefix autocomplete over institution names, cities, fields of study and
+program names.
+
+Suggestions live in an in-memory sorted array of (search key, entry) pairs.
+Every word start of a suggestion is a search key, so "tor" finds
+"University of Toronto". A lookup is two bisections plus a scan of the
+matching range; short prefixes, whose ranges are the widest, are memoized
+until the index changes.
+
+The index is built at startup, with the keys sorted once at the end. When
+the catalog version moves it is patched with the rows whose updated_at is
+newer than the last refresh instead of being rebuilt; a full rebuild only
+happens if rows disappeared. Programs are only suggested while their
+institution is active too; a changed institution re-applies its programs.
+"""
+
+import bisect
+import heapq
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import func, or_
+from app import db
+from models import Institution, Program
+from catalog_cache import catalog_version
+from search_index import tokenize
+
+# Prefixes up to this length are memoized
+MEMO_PREFIX_LENGTH = 3
+MEMO_SIZE = 2048
+
+class PrefixIndex:
+    """Sorted-array prefix index of weighted suggestions"""
+
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+        self._memo = OrderedDict()
+        # While building, keys are appended and sorted once at the end
+        self._building = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _search_keys(text):
+        words = tokenize(text)
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    @contextmanager
+    def building(self):
+        """Add many suggestions with one sort instead of an insort per key"""
+        self._building = True
+        try:
+            yield self
+        finally:
+            self._building = False
+            self._keys.sort()
+            self._memo.clear()
+
+    def put(self, entry_key, text, weight, **extra):
+        """Add or replace a suggestion"""
+        if entry_key in self._entries:
+            self.discard(entry_key)
+        self._entries[entry_key] = dict(extra, text=text, weight=weight)
+        for search_key in self._search_keys(text):
+            if self._building:
+                self._keys.append((search_key, entry_key))
+            else:
+                bisect.insort(self._keys, (search_key, entry_key))
+        self._memo.clear()
+
+    def discard(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        if self._building:
+            self._keys.sort()
+        for search_key in self._search_keys(entry['text']):
+            i = bisect.bisect_left(self._keys, (search_key, entry_key))
+            if i < len(self._keys) and self._keys[i] == (search_key, entry_key):
+                del self._keys[i]
+        self._memo.clear()
+
+    def adjust(self, entry_key, text, delta, **extra):
+        """Change the weight of an aggregate suggestion (city, field); drops it at zero"""
+        entry = self._entries.get(entry_key)
+        weight = (entry['weight'] if entry else 0) + delta
+        if weight <= 0:
+            self.discard(entry_key)
+        elif entry:
+            entry['weight'] = weight
+            self._memo.clear()
+        else:
+            self.put(entry_key, text, weight, **extra)
+
+    def complete(self, prefix, limit=10):
+        """Top suggestions by weight whose text has a word starting with prefix"""
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+
+        memo_key = (prefix, limit)
+        if len(prefix) <= MEMO_PREFIX_LENGTH and memo_key in self._memo:
+            return self._memo[memo_key]
+
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        hi = bisect.bisect_left(self._keys, (prefix + '\uffff',))
+        entry_keys = {entry_key for _, entry_key in self._keys[lo:hi]}
+        best = heapq.nlargest(limit, entry_keys,
+                              key=lambda entry_key: (self._entries[entry_key]['weight'], entry_key))
+        result = [self._entries[entry_key] for entry_key in best]
+
+        if len(prefix) <= MEMO_PREFIX_LENGTH:
+            self._memo[memo_key] = result
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+def _institution_weight(world_ranking):
+    # Ranked institutions first, best ranked on top
+    return 1000 - min(world_ranking, 999) + 1 if world_ranking else 1
+
+class AutocompleteIndex:
+    """The prefix index plus what is needed to patch it from changed rows"""
+
+    def __init__(self):
+        self.index = PrefixIndex()
+        self.institutions = {}
+        self.programs = {}
+        self.version = None
+        self.since = None
+
+    def _apply_institution(self, row):
+        old = self.institutions.pop(row.id, None)
+        if old:
+            self.index.discard(('institution', row.id))
+            self.index.adjust(('city', old['city_key']), old['city'], -1)
+
+        if row.is_active:
+            self.index.put(('institution', row.id), row.name, _institution_weight(row.world_ranking),
+                           type='institution', id=row.id)
+            city_key = (row.city or '').lower()
+            if city_key:
+                self.index.adjust(('city', city_key), row.city, 1, type='city', country=row.country)
+            self.institutions[row.id] = {'city': row.city, 'city_key': city_key}
+
+    def _apply_program(self, row):
+        old = self.programs.pop(row.id, None)
+        if old:
+            self.index.discard(('program', row.id))
+            self.index.adjust(('field', old['field_key']), old['field'], -1)
+
+        if row.is_active and row.institution_active:
+            self.index.put(('program', row.id), row.name, 1, type='program', id=row.id,
+                           institution_id=row.institution_id)
+            field_key = (row.field_of_study or '').lower()
+            if field_key:
+                self.index.adjust(('field', field_key), row.field_of_study, 1, type='field')
+            self.programs[row.id] = {'field': row.field_of_study, 'field_key': field_key}
+
+    def load(self, since=None):
+        """Apply every row changed since `since` (all rows when None)"""
+        institution_query = db.session.query(
+            Institution.id, Institution.name, Institution.city, Institution.country,
+            Institution.world_ranking, Institution.is_active, Institution.updated_at
+        )
+        program_query = db.session.query(
+            Program.id, Program.name, Program.field_of_study, Program.institution_id,
+            Program.is_active, Program.updated_at, Institution.is_active.label('institution_active')
+        ).join(Institution, Program.institution_id == Institution.id)
+        if since is not None:
+            # Inclusive, so rows written in the same tick as the last refresh are not lost.
+            # Programs of a changed institution are re-applied, as it may have been (de)activated.
+            institution_query = institution_query.filter(Institution.updated_at >= since)
+            program_query = program_query.filter(or_(Program.updated_at >= since,
+                                                     Institution.updated_at >= since))
+
+        latest = since
+        for row in institution_query:
+            self._apply_institution(row)
+            if row.updated_at and (latest is None or row.updated_at > latest):
+                latest = row.updated_at
+        for row in program_query:
+            self._apply_program(row)
+            if row.updated_at and (latest is None or row.updated_at > latest):
+                latest = row.updated_at
+        self.since = latest
+
+    def build(self):
+        """Load every row into an empty index"""
+        with self.index.building():
+            self.load()
+
+    def in_sync(self):
+        """False when rows were deleted, which updated_at cannot reveal"""
+        active_institutions = db.session.query(func.count(Institution.id)).filter(
+            Institution.is_active == True).scalar()
+        active_programs = db.session.query(func.count(Program.id)).join(
+            Institution, Program.institution_id == Institution.id
+        ).filter(Program.is_active == True, Institution.is_active == True).scalar()
+        return active_institutions == len(self.institutions) and active_programs == len(self.programs)
+
+_current = None
+_lock = threading.Lock()
+
+def get_autocomplete_index():
+    """The process-wide index, built on first use and patched when the catalog changes"""
+    global _current
+    version = catalog_version()
+    with _lock:
+        if _current is not None and _current.version == version:
+            return _current.index
+
+        if _current is not None:
+            _current.load(since=_current.since)
+            if not _current.in_sync():
+                _current = None
+
+        if _current is None:
+            _current = AutocompleteIndex()
+            _current.build()
+        _current.version = version
+        return _current.index
+
+def autocomplete(prefix, limit=10):
+    return get_autocomplete_index().complete(prefix, limit)
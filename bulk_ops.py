@@ -0,0 +1,188 @@
+"""
+Bulk catalog operations for the admin.
+
+Each operation applies to a filtered selection of programs or institutions
+and runs as set-based UPDATEs in the caller's transaction: the rows are
+never loaded. Derived data that mapper events would normally maintain is
+refreshed with the matching set-based helpers (base-currency costs,
+effective deadlines, intake rows, dashboard rollups). With dry_run the
+selection is only counted.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import select, update, func
+from app import db
+from models import Institution, Program
+from currency import refresh_normalized_costs
+from deadlines import refresh_effective_deadlines
+from intakes import parse_intake_months, sync_program_intakes
+from rollups import bump
+
+TARGETS = ('programs', 'institutions')
+
+OPERATIONS = {
+    'activate': TARGETS,
+    'deactivate': TARGETS,
+    'fee_change': ('programs',),
+    'deadline_shift': TARGETS,
+    'intake_change': ('programs',),
+}
+
+# Accepted range for fee changes, in percent
+MIN_FEE_CHANGE = -90
+MAX_FEE_CHANGE = 500
+# Accepted range for deadline shifts, in days
+MAX_DEADLINE_SHIFT = 366
+
+class BulkOperationError(ValueError):
+    """Raised for an operation, selection or value the admin cannot apply"""
+
+def _ids(value):
+    try:
+        return [int(part) for part in str(value).replace(' ', '').split(',') if part]
+    except ValueError:
+        raise BulkOperationError('Ids must be a comma-separated list of numbers.')
+
+def _status_criteria(model, status):
+    if status == 'active':
+        return [model.is_active == True]
+    if status == 'inactive':
+        return [model.is_active == False]
+    return []
+
+def institution_criteria(filters):
+    """WHERE criteria on Institution for the selection filters (ids, country, status)"""
+    criteria = []
+    if filters.get('ids'):
+        criteria.append(Institution.id.in_(_ids(filters['ids'])))
+    if filters.get('country'):
+        criteria.append(Institution.country_code == filters['country'].upper())
+    criteria += _status_criteria(Institution, filters.get('status'))
+    return criteria
+
+def program_criteria(filters):
+    """WHERE criteria on Program for the selection filters
+
+    ids, institution_id, country, field (substring), degree_type, status.
+    """
+    criteria = []
+    if filters.get('ids'):
+        criteria.append(Program.id.in_(_ids(filters['ids'])))
+    if filters.get('institution_id'):
+        criteria.append(Program.institution_id.in_(_ids(filters['institution_id'])))
+    if filters.get('country'):
+        criteria.append(Program.institution_id.in_(
+            select(Institution.id).where(Institution.country_code == filters['country'].upper())
+        ))
+    if filters.get('field'):
+        criteria.append(Program.field_of_study.contains(filters['field']))
+    if filters.get('degree_type'):
+        criteria.append(Program.degree_type == filters['degree_type'])
+    criteria += _status_criteria(Program, filters.get('status'))
+    return criteria
+
+def _count(model, criteria):
+    return db.session.query(func.count(model.id)).filter(*criteria).scalar()
+
+def _update(model, criteria, values):
+    statement = update(model).where(*criteria).values(**values)
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+
+def _shifted(column, days):
+    """column + days, for a DATE column"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column, f'{days:+d} days')
+    return column + days
+
+def _set_active(model, criteria, active, metric):
+    # Only rows whose flag actually flips move the dashboard gauge
+    changing = criteria + [model.is_active == (not active)]
+    updated = _update(model, changing, {'is_active': active})
+    if updated:
+        bump(db.session.connection(), datetime.utcnow().date(), metric, updated if active else -updated)
+    return updated
+
+def run_bulk_operation(target, operation, filters, value=None, include_programs=False, dry_run=False):
+    """Apply operation to the selection; returns a summary dict
+
+    Nothing is committed here, so the caller can add its audit entry to the
+    same transaction. With dry_run only the matching rows are counted.
+    """
+    if target not in TARGETS or target not in OPERATIONS.get(operation, ()):
+        raise BulkOperationError(f'{operation} is not available for {target}.')
+
+    if target == 'programs':
+        model, criteria = Program, program_criteria(filters)
+    else:
+        model, criteria = Institution, institution_criteria(filters)
+    if not criteria:
+        raise BulkOperationError('Select at least one filter; bulk operations never apply to everything.')
+
+    # Validate the value before touching anything
+    if operation == 'fee_change':
+        try:
+            percent = Decimal(str(value).strip())
+        except ArithmeticError:
+            raise BulkOperationError('Fee change must be a percentage.')
+        if not MIN_FEE_CHANGE <= percent <= MAX_FEE_CHANGE or percent == 0:
+            raise BulkOperationError(f'Fee change must be between {MIN_FEE_CHANGE}% and {MAX_FEE_CHANGE}%, and not 0.')
+    elif operation == 'deadline_shift':
+        try:
+            days = int(value)
+        except (TypeError, ValueError):
+            raise BulkOperationError('Deadline shift must be a whole number of days.')
+        if days == 0 or abs(days) > MAX_DEADLINE_SHIFT:
+            raise BulkOperationError(f'Deadline shift must be between 1 and {MAX_DEADLINE_SHIFT} days either way.')
+    elif operation == 'intake_change':
+        months = parse_intake_months(value)
+        if not months:
+            raise BulkOperationError('Intake months must list at least one month, e.g. "1,9" or "Jan, Sep".')
+        intake_months = ','.join(str(month) for month in months)
+
+    summary = {
+        'target': target,
+        'operation': operation,
+        'filters': {key: val for key, val in filters.items() if val},
+        'value': value,
+        'matched': _count(model, criteria),
+        'dry_run': dry_run,
+    }
+    cascade = target == 'institutions' and include_programs and operation in ('activate', 'deactivate')
+    if cascade:
+        program_selection = [Program.institution_id.in_(select(Institution.id).where(*criteria))]
+        summary['programs_matched'] = _count(Program, program_selection)
+    if dry_run:
+        return summary
+
+    if operation in ('activate', 'deactivate'):
+        active = operation == 'activate'
+        summary['updated'] = _set_active(model, criteria, active, f'total:{target}')
+        if cascade:
+            summary['programs_updated'] = _set_active(Program, program_selection, active, 'total:programs')
+
+    elif operation == 'fee_change':
+        # A Decimal factor keeps the arithmetic in NUMERIC on PostgreSQL
+        factor = 1 + percent / 100
+        summary['updated'] = _update(Program, criteria, {
+            'tuition_fee': func.round(Program.tuition_fee * factor, 2),
+            'additional_fees': func.round(Program.additional_fees * factor, 2),
+        })
+        refresh_normalized_costs(*criteria)
+
+    elif operation == 'deadline_shift':
+        deadline = model.application_deadline
+        summary['updated'] = _update(model, criteria + [deadline.isnot(None)],
+                                     {'application_deadline': _shifted(deadline, days)})
+        if target == 'programs':
+            refresh_effective_deadlines(*criteria)
+        else:
+            refresh_effective_deadlines(
+                Program.institution_id.in_(select(Institution.id).where(*criteria))
+            )
+
+    elif operation == 'intake_change':
+        summary['updated'] = _update(Program, criteria, {'intake_months': intake_months})
+        sync_program_intakes(*criteria)
+
+    return summary
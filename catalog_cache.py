@@ -0,0 +1,184 @@
+"""
+Catalog change tracking and caching.
+
+Every committed write to an Institution or Program bumps a catalog version
+stamp. The stamp is the single row of the catalog_version table, bumped in
+the same transaction as the write, so every worker on every host sees it.
+Workers reuse the stamp they read for CATALOG_VERSION_TTL seconds; their own
+commits update it immediately. Caches tag their entries with the stamp and
+drop them as soon as it moves, and catalog JSON endpoints derive their ETags
+from it.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+from app import app, db
+from models import Institution, Program, CatalogVersion
+
+CATALOG_MODELS = (Institution, Program)
+
+_version_table = CatalogVersion.__table__
+# (version, time.monotonic() it was read or written)
+_known = None
+_known_lock = threading.Lock()
+
+def _remember(version):
+    global _known
+    with _known_lock:
+        _known = (version, time.monotonic())
+
+def catalog_version():
+    """Current catalog version stamp (an opaque string)"""
+    with _known_lock:
+        if _known is not None and time.monotonic() - _known[1] < app.config['CATALOG_VERSION_TTL']:
+            return _known[0]
+    with db.engine.connect() as connection:
+        version = connection.execute(select(_version_table.c.version)).scalar()
+    version = '0' if version is None else str(version)
+    _remember(version)
+    return version
+
+def _next_version(connection):
+    version = connection.execute(
+        update(_version_table).values(version=_version_table.c.version + 1).returning(_version_table.c.version)
+    ).scalar()
+    if version is None:
+        # First bump; starting from the clock keeps a re-created table from reusing old ETags
+        version = time.time_ns()
+        connection.execute(insert(_version_table).values(id=1, version=version))
+    return str(version)
+
+def _published(version):
+    _remember(version)
+    for callback in list(_listeners):
+        try:
+            callback(version)
+        except Exception as e:
+            print(f"Error in catalog change listener: {e}")
+
+def bump_catalog_version():
+    """Publish a new catalog version in a transaction of its own
+
+    Writes through the session are stamped in their own transaction instead
+    (see mark_catalog_changed()).
+    """
+    with db.engine.begin() as connection:
+        version = _next_version(connection)
+    _published(version)
+    return version
+
+def mark_catalog_changed(session=None):
+    """Bump the version when session next commits, for writes the events below cannot see"""
+    (session or db.session).info['catalog_changed'] = True
+
+_listeners = []
+
+def on_catalog_change(callback):
+    """Register callback(version) to run in this process after a catalog write commits"""
+    _listeners.append(callback)
+    return callback
+
+# Change detection. ORM flushes are caught in before_flush, bulk
+# query.update()/delete() calls in do_orm_execute. The stamp is bumped in
+# before_commit, inside the transaction, and published to this process's
+# listeners in after_commit, so nobody sees a version for uncommitted data.
+def _touches_catalog(objects):
+    return any(isinstance(obj, CATALOG_MODELS) for obj in objects)
+
+@event.listens_for(Session, 'before_flush')
+def _track_flush(session, flush_context, instances):
+    if _touches_catalog(session.new) or _touches_catalog(session.dirty) or _touches_catalog(session.deleted):
+        session.info['catalog_changed'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in CATALOG_MODELS:
+        orm_execute_state.session.info['catalog_changed'] = True
+
+@event.listens_for(Session, 'before_commit')
+def _stamp_change(session):
+    if session.in_nested_transaction():
+        return
+    # Flush now, so changes the commit would flush are seen here too
+    session.flush()
+    if session.info.pop('catalog_changed', False):
+        session.info['catalog_version'] = _next_version(session.connection())
+
+@event.listens_for(Session, 'after_commit')
+def _publish_change(session):
+    version = session.info.pop('catalog_version', None)
+    if version is not None:
+        _published(version)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_change(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('catalog_changed', None)
+    session.info.pop('catalog_version', None)
+
+class CatalogCache:
+    """Bounded, thread-safe LRU cache whose entries expire when the catalog changes"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        version = catalog_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        value = compute()
+
+        with self._lock:
+            # Don't store a result computed against a catalog that has since moved on
+            if self._version == version:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def catalog_etag(f):
+    """Conditional GET for catalog JSON endpoints.
+
+    The ETag is derived from the catalog version and the request URL, so a
+    matching If-None-Match is answered with 304 before the view (and the
+    database) is touched.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        etag = hashlib.sha1(f'{catalog_version()}|{request.full_path}'.encode()).hexdigest()
+        cache_control = f"public, max-age={app.config['CATALOG_CACHE_MAX_AGE']}"
+
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    return decorated_function
@@ -0,0 +1,302 @@
+"""
+Shared-memory, array-backed snapshot of the active program catalog.
+
+The snapshot is a NumPy structured array with one row per active program
+(base-currency tuition and total cost, duration, feature flags, institution
+id and dictionary-encoded strings), written to the instance folder and
+opened with mmap, so every gunicorn worker on the host shares one copy of
+the pages. Rows are stored pre-sorted by (tuition_fee_base, id), which is the
+order the search API pages in, so filtering is a handful of vectorized
+comparisons and no sort. Costs without an exchange rate are stored as NaN.
+
+A rebuild writes a new file and then swaps a pointer file with os.replace(),
+so readers always see a complete snapshot. A snapshot whose catalog version
+no longer matches the current stamp is ignored (callers fall back to SQL)
+until the background rebuild has finished.
+
+Enabled with CATALOG_ENGINE=1.
+"""
+
+import json
+import os
+import threading
+import uuid
+from decimal import Decimal
+import numpy as np
+from app import app, db
+from models import Institution, Program, PROGRAM_COST_KEYS
+from catalog_cache import catalog_version, on_catalog_change
+from currency import UNPRICED
+from search_index import tokenize
+from intakes import parse_intake_months, intake_mask
+from facets import FEE_RANGES
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock
+    fcntl = None
+
+ENGINE_DIR = os.path.join(app.instance_path, 'catalog_engine')
+_POINTER_FILE = os.path.join(ENGINE_DIR, 'CURRENT')
+_LOCK_FILE = os.path.join(ENGINE_DIR, 'build.lock')
+
+# Bits in the flags column
+SCHOLARSHIPS = 1
+WORK_PERMIT = 2
+ONLINE = 4
+INSTITUTION_ACTIVE = 8
+
+FLAG_FILTERS = {
+    'scholarships_available': SCHOLARSHIPS,
+    'work_permit_eligible': WORK_PERMIT,
+    'online_available': ONLINE,
+}
+
+PROGRAM_DTYPE = np.dtype([
+    ('id', np.int32),
+    ('institution_id', np.int32),
+    ('tuition_fee_base', np.float64),
+    ('total_cost_base', np.float64),
+    ('duration_months', np.int16),
+    ('intake_mask', np.uint16),
+    ('flags', np.uint8),
+    ('field_of_study', np.int32),
+    ('degree_type', np.int32),
+    ('currency', np.int32),
+    ('country_code', np.int32),
+])
+
+# Columns stored as codes into a per-snapshot dictionary
+ENCODED_COLUMNS = ('field_of_study', 'degree_type', 'currency', 'country_code')
+
+class ProgramCatalog:
+    """A loaded, read-only catalog snapshot"""
+
+    def __init__(self, build, meta, data):
+        self.build = build
+        self.catalog_version = meta['catalog_version']
+        self.dictionaries = meta['dictionaries']
+        self._codes = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in self.dictionaries.items()
+        }
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def _code(self, column, value):
+        return self._codes[column].get(value, -1)
+
+    def select(self, filters=None, field=None, min_fee=None, max_fee=None, university_id=None,
+               min_total_cost=None, max_total_cost=None, program_ids=None, intake_months=None):
+        """Boolean mask of rows matching the search API filters"""
+        data = self.data
+        filters = filters or {}
+        # Programs of deactivated institutions are stored but never listed
+        mask = (data['flags'] & INSTITUTION_ACTIVE) != 0
+
+        if program_ids is not None:
+            mask &= np.isin(data['id'], program_ids)
+        if intake_months:
+            mask &= (data['intake_mask'] & intake_mask(intake_months)) != 0
+
+        if university_id:
+            mask &= data['institution_id'] == university_id
+        if field:
+            # Same semantics as the full-text field filter: every token must
+            # prefix a word of field_of_study
+            tokens = tokenize(field)
+            codes = [code for code, value in enumerate(self.dictionaries['field_of_study'])
+                     if all(any(word.startswith(token) for word in tokenize(value)) for token in tokens)]
+            mask &= np.isin(data['field_of_study'], codes)
+        if filters.get('country'):
+            mask &= data['country_code'] == self._code('country_code', filters['country'])
+        if filters.get('field_of_study'):
+            mask &= data['field_of_study'] == self._code('field_of_study', filters['field_of_study'])
+        if filters.get('degree_type'):
+            mask &= data['degree_type'] == self._code('degree_type', filters['degree_type'])
+        for name, bit in FLAG_FILTERS.items():
+            if filters.get(name) is not None:
+                mask &= ((data['flags'] & bit) != 0) == filters[name]
+        if filters.get('fee_range'):
+            _, lower, upper = next(r for r in FEE_RANGES if r[0] == filters['fee_range'])
+            mask &= data['tuition_fee_base'] >= lower
+            if upper is not None:
+                mask &= data['tuition_fee_base'] < upper
+        # NaN compares false, so unpriced programs drop out like NULLs in SQL
+        if min_fee is not None:
+            mask &= data['tuition_fee_base'] >= min_fee
+        if max_fee is not None:
+            mask &= data['tuition_fee_base'] <= max_fee
+        if min_total_cost is not None:
+            mask &= data['total_cost_base'] >= min_total_cost
+        if max_total_cost is not None:
+            mask &= data['total_cost_base'] <= max_total_cost
+        return mask
+
+    def page(self, mask, offset=0, per_page=20):
+        """Program ids of one page in (tuition_fee_base, id) order, plus the match count"""
+        rows = np.flatnonzero(mask)
+        return self.data['id'][rows[offset:offset + per_page]].tolist(), len(rows)
+
+    def page_after(self, mask, after=None, per_page=20):
+        """Keyset page after a (tuition key, id) key; returns (ids, next key or None)
+
+        The tuition key is tuition_fee_base with UNPRICED standing in for NaN,
+        matching the SQL path's coalesce(), so cursors work on either path.
+        """
+        if after is not None:
+            fee, program_id = float(after[0]), int(after[1])
+            tuition = np.nan_to_num(self.data['tuition_fee_base'], nan=UNPRICED)
+            mask = mask & ((tuition > fee) | ((tuition == fee) & (self.data['id'] > program_id)))
+        rows = np.flatnonzero(mask)[:per_page + 1]
+        if len(rows) > per_page:
+            last = self.data[rows[per_page - 1]]
+            fee = UNPRICED if np.isnan(last['tuition_fee_base']) else last['tuition_fee_base']
+            next_key = [Decimal(f"{fee:.2f}"), int(last['id'])]
+            rows = rows[:per_page]
+        else:
+            next_key = None
+        return self.data['id'][rows].tolist(), next_key
+
+def _float_or_nan(value):
+    return float(value) if value is not None else np.nan
+
+def build_snapshot():
+    """Write a fresh snapshot and publish it; returns the build id (or None if another worker is building)"""
+    os.makedirs(ENGINE_DIR, exist_ok=True)
+    lock_file = open(_LOCK_FILE, 'w')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+        # Read the stamp first: a write that lands during the build makes
+        # this snapshot stale instead of silently missing from it
+        version = catalog_version()
+
+        rows = db.session.query(
+            Program.id,
+            Program.institution_id,
+            Program.tuition_fee_base,
+            Program.total_cost_base,
+            Program.duration_months,
+            Program.intake_months,
+            Program.scholarships_available,
+            Program.work_permit_eligible,
+            Program.online_available,
+            Institution.is_active,
+            Program.field_of_study,
+            Program.degree_type,
+            Program.currency,
+            Institution.country_code
+        ).join(Institution, Program.institution_id == Institution.id).filter(
+            Program.is_active == True
+        ).order_by(PROGRAM_COST_KEYS['tuition'], Program.id).all()
+
+        dictionaries = {name: [] for name in ENCODED_COLUMNS}
+        codes = {name: {} for name in ENCODED_COLUMNS}
+
+        def encode(name, value):
+            if value not in codes[name]:
+                codes[name][value] = len(dictionaries[name])
+                dictionaries[name].append(value)
+            return codes[name][value]
+
+        data = np.zeros(len(rows), dtype=PROGRAM_DTYPE)
+        for i, row in enumerate(rows):
+            flags = ((SCHOLARSHIPS if row.scholarships_available else 0)
+                     | (WORK_PERMIT if row.work_permit_eligible else 0)
+                     | (ONLINE if row.online_available else 0)
+                     | (INSTITUTION_ACTIVE if row.is_active else 0))
+            data[i] = (row.id, row.institution_id, _float_or_nan(row.tuition_fee_base),
+                       _float_or_nan(row.total_cost_base), row.duration_months or 0,
+                       intake_mask(parse_intake_months(row.intake_months)), flags,
+                       encode('field_of_study', row.field_of_study),
+                       encode('degree_type', row.degree_type),
+                       encode('currency', row.currency),
+                       encode('country_code', (row.country_code or '').upper()))
+
+        build = uuid.uuid4().hex
+        np.save(os.path.join(ENGINE_DIR, f'programs-{build}.npy'), data)
+        with open(os.path.join(ENGINE_DIR, f'programs-{build}.json'), 'w') as file:
+            json.dump({'catalog_version': version, 'dictionaries': dictionaries}, file)
+
+        tmp_pointer = f'{_POINTER_FILE}.{os.getpid()}.tmp'
+        with open(tmp_pointer, 'w') as file:
+            file.write(build)
+        os.replace(tmp_pointer, _POINTER_FILE)
+
+        # Workers still mapping an old snapshot keep their pages until they reload
+        for name in os.listdir(ENGINE_DIR):
+            if name.startswith('programs-') and build not in name:
+                os.remove(os.path.join(ENGINE_DIR, name))
+        return build
+    finally:
+        lock_file.close()
+
+_loaded = None
+_load_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+def _read_pointer():
+    try:
+        with open(_POINTER_FILE, 'r') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _load(build):
+    with open(os.path.join(ENGINE_DIR, f'programs-{build}.json'), 'r') as file:
+        meta = json.load(file)
+    data = np.load(os.path.join(ENGINE_DIR, f'programs-{build}.npy'), mmap_mode='r')
+    return ProgramCatalog(build, meta, data)
+
+def schedule_rebuild():
+    """Rebuild the snapshot in a background thread unless one is already running"""
+    if not _rebuild_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                build_snapshot()
+        except Exception as e:
+            print(f"Error building catalog snapshot: {e}")
+        finally:
+            _rebuild_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def get_program_catalog():
+    """The current snapshot, or None when disabled, missing or stale"""
+    global _loaded
+    if not app.config.get('CATALOG_ENGINE'):
+        return None
+
+    build = _read_pointer()
+    if build is None:
+        schedule_rebuild()
+        return None
+
+    with _load_lock:
+        if _loaded is None or _loaded.build != build:
+            try:
+                _loaded = _load(build)
+            except (OSError, ValueError):
+                # Pointer moved again between reading it and opening the files
+                return None
+        catalog = _loaded
+
+    if catalog.catalog_version != catalog_version():
+        schedule_rebuild()
+        return None
+    return catalog
+
+@on_catalog_change
+def _rebuild_on_change(version):
+    if app.config.get('CATALOG_ENGINE'):
+        schedule_rebuild()
@@ -0,0 +1,103 @@
+"""
+Currency normalization for program costs.
+
+Program.tuition_fee is stored in the program's own currency, so it cannot be
+compared or sorted across programs. Each program also carries
+tuition_fee_base (annual tuition) and total_cost_base (tuition over the
+whole duration plus additional fees) in the base currency, converted with
+the rates in the local exchange_rates table. Single program writes are
+converted by a mapper event; rate changes recompute every program in one
+set-based UPDATE.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import event, select, update, func
+from app import app, db
+from models import Program, ExchangeRate, UNPRICED
+
+# Starting rates to USD, used only to seed an empty table (see default_rates())
+DEFAULT_RATES = {
+    'USD': '1.0',
+    'CAD': '0.73',
+    'GBP': '1.27',
+    'EUR': '1.08',
+    'AUD': '0.66',
+    'NZD': '0.60',
+    'INR': '0.012',
+}
+
+CENTS = Decimal('0.01')
+RATE_PLACES = Decimal('0.00000001')
+
+def base_currency():
+    return app.config['BASE_CURRENCY']
+
+def default_rates(base):
+    """DEFAULT_RATES rebased onto base, or None when base has no default rate"""
+    if base not in DEFAULT_RATES:
+        return None
+    base_rate = Decimal(DEFAULT_RATES[base])
+    return {currency: (Decimal(rate) / base_rate).quantize(RATE_PLACES, ROUND_HALF_UP)
+            for currency, rate in DEFAULT_RATES.items()}
+
+def normalized_cost_values():
+    """SQL expressions for the base-currency columns, for set-based UPDATEs"""
+    rate = select(ExchangeRate.rate_to_base).where(
+        ExchangeRate.currency == func.coalesce(Program.currency, base_currency())
+    ).scalar_subquery()
+    tuition = Program.tuition_fee * rate
+    total = (Program.tuition_fee * Program.duration_months / Decimal(12)
+             + func.coalesce(Program.additional_fees, 0)) * rate
+    return {
+        'tuition_fee_base': func.round(tuition, 2),
+        'total_cost_base': func.round(total, 2),
+    }
+
+def refresh_normalized_costs(*criteria):
+    """Recompute the base-currency columns for all programs (or those matching criteria)"""
+    statement = update(Program).values(**normalized_cost_values())
+    if criteria:
+        statement = statement.where(*criteria)
+    result = db.session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount
+
+def set_exchange_rates(rates):
+    """Store new rates ({'CAD': '0.74', ...}) and recompute program costs in the same transaction"""
+    for currency, rate in rates.items():
+        db.session.merge(ExchangeRate(currency=currency.upper(), rate_to_base=Decimal(str(rate))))
+    db.session.flush()
+    updated = refresh_normalized_costs()
+    db.session.commit()
+    return updated
+
+def init_exchange_rates():
+    """Seed the rate table and fill costs missing on existing programs; call after db.create_all()"""
+    if db.session.query(ExchangeRate.currency).first() is None:
+        rates = default_rates(base_currency())
+        if rates is None:
+            print(f"No default exchange rates for base currency {base_currency()}; set them with set_exchange_rates()")
+        else:
+            for currency, rate in rates.items():
+                db.session.add(ExchangeRate(currency=currency, rate_to_base=rate))
+            db.session.flush()
+    refresh_normalized_costs(Program.tuition_fee_base.is_(None))
+    db.session.commit()
+
+@event.listens_for(Program, 'before_insert')
+@event.listens_for(Program, 'before_update')
+def _normalize_costs(mapper, connection, target):
+    rate = connection.execute(
+        select(ExchangeRate.rate_to_base).where(
+            ExchangeRate.currency == (target.currency or base_currency())
+        )
+    ).scalar()
+    if rate is None or target.tuition_fee is None:
+        target.tuition_fee_base = None
+        target.total_cost_base = None
+        return
+
+    tuition = Decimal(str(target.tuition_fee))
+    additional = Decimal(str(target.additional_fees or 0))
+    months = Decimal(target.duration_months or 0)
+    target.tuition_fee_base = (tuition * rate).quantize(CENTS, ROUND_HALF_UP)
+    target.total_cost_base = ((tuition * months / 12 + additional) * rate).quantize(CENTS, ROUND_HALF_UP)
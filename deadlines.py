@@ -0,0 +1,59 @@
+"""
+Effective application deadlines.
+
+A program without an application_deadline of its own inherits its
+institution's. The resolved date is stored in Program.effective_deadline,
+indexed together with is_active, so "what closes in the next 30 days" is
+an index range scan in date order. A mapper event sets it on program
+writes; a change to an institution's deadline updates its programs in one
+set-based UPDATE, and bulk updates call refresh_effective_deadlines().
+"""
+
+from sqlalchemy import event, inspect, select, update, func
+from app import db
+from models import Institution, Program
+
+def effective_deadline_value():
+    """SQL expression for Program.effective_deadline, for set-based UPDATEs"""
+    institution_deadline = select(Institution.application_deadline).where(
+        Institution.id == Program.institution_id
+    ).scalar_subquery()
+    return func.coalesce(Program.application_deadline, institution_deadline)
+
+def refresh_effective_deadlines(*criteria):
+    """Recompute effective_deadline for all programs (or those matching criteria); the caller commits"""
+    statement = update(Program).values(effective_deadline=effective_deadline_value())
+    if criteria:
+        statement = statement.where(*criteria)
+    result = db.session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount
+
+def init_effective_deadlines():
+    """Fill effective_deadline for programs written before it existed; call after db.create_all()"""
+    refresh_effective_deadlines(Program.effective_deadline.is_(None))
+    db.session.commit()
+
+@event.listens_for(Program, 'before_insert')
+@event.listens_for(Program, 'before_update')
+def _resolve_deadline(mapper, connection, target):
+    state = inspect(target)
+    if (state.persistent
+            and not state.attrs.application_deadline.history.has_changes()
+            and not state.attrs.institution_id.history.has_changes()):
+        return
+
+    if target.application_deadline is not None:
+        target.effective_deadline = target.application_deadline
+    else:
+        target.effective_deadline = connection.execute(
+            select(Institution.application_deadline).where(Institution.id == target.institution_id)
+        ).scalar()
+
+@event.listens_for(Institution, 'after_update')
+def _propagate_deadline(mapper, connection, target):
+    if inspect(target).attrs.application_deadline.history.has_changes():
+        connection.execute(
+            update(Program.__table__)
+            .where(Program.institution_id == target.id, Program.application_deadline.is_(None))
+            .values(effective_deadline=target.application_deadline)
+        )
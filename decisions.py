@@ -0,0 +1,184 @@
+"""
+Batch application decisions.
+
+run_batch_decision() moves a selection of applications to one status in a
+single transaction. Each application's transition is validated, the allowed
+ones are applied with one UPDATE per previous status, and a notification per
+changed application is queued in the same transaction. Bulk UPDATEs bypass
+the rollup mapper events, so the daily_stats gauges and status flows are
+bumped here (see rollups.py).
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import update
+from app import db
+from models import Application, Institution, Program, Notification, ApplicationStatus
+from rollups import bump
+
+# Statuses a batch can move applications to, and the statuses each may come from
+ALLOWED_TRANSITIONS = {
+    ApplicationStatus.UNDER_REVIEW: {ApplicationStatus.SUBMITTED},
+    ApplicationStatus.WAITLISTED: {ApplicationStatus.SUBMITTED, ApplicationStatus.UNDER_REVIEW},
+    ApplicationStatus.ACCEPTED: {ApplicationStatus.SUBMITTED, ApplicationStatus.UNDER_REVIEW,
+                                 ApplicationStatus.WAITLISTED},
+    ApplicationStatus.REJECTED: {ApplicationStatus.SUBMITTED, ApplicationStatus.UNDER_REVIEW,
+                                 ApplicationStatus.WAITLISTED},
+}
+
+# Statuses that set decision_date, as a single status update does
+DECISION_STATUSES = {ApplicationStatus.ACCEPTED, ApplicationStatus.REJECTED}
+
+NOTIFICATION_SUBJECTS = {
+    ApplicationStatus.UNDER_REVIEW: 'Your application to {program} at {institution} is under review',
+    ApplicationStatus.WAITLISTED: 'You have been waitlisted for {program} at {institution}',
+    ApplicationStatus.ACCEPTED: 'Congratulations! You have been accepted to {program} at {institution}',
+    ApplicationStatus.REJECTED: 'A decision has been made on your application to {program} at {institution}',
+}
+
+# Applications one batch may touch
+MAX_BATCH = 5000
+# Ids per IN list
+ID_CHUNK = 500
+# Characters of decision notes a batch may set
+MAX_NOTES_LENGTH = 2000
+
+class BatchDecisionError(ValueError):
+    """Raised for a target status or selection a batch cannot apply"""
+
+def _chunks(ids):
+    for start in range(0, len(ids), ID_CHUNK):
+        yield ids[start:start + ID_CHUNK]
+
+def _status(value):
+    try:
+        return ApplicationStatus(value)
+    except ValueError:
+        raise BatchDecisionError(f'Unknown status: {value}')
+
+def selection_ids(filters):
+    """Ids of the applications matching filters (status, institution_id, program_id)"""
+    criteria = []
+    if filters.get('status'):
+        criteria.append(Application.status == _status(filters['status']))
+    for name, column in (('institution_id', Application.institution_id), ('program_id', Application.program_id)):
+        if filters.get(name):
+            try:
+                criteria.append(column == int(filters[name]))
+            except (TypeError, ValueError):
+                raise BatchDecisionError(f'{name} must be a number.')
+    if not criteria:
+        raise BatchDecisionError('Select applications by id or by at least one filter.')
+    return [application_id for (application_id,) in db.session.query(Application.id).filter(
+        *criteria).order_by(Application.id).limit(MAX_BATCH + 1)]
+
+def run_batch_decision(status, ids=None, filters=None, notes=None):
+    """Move the applications (by ids, else by filters) to status
+
+    Returns (results, summary): one result per requested id, in order, with
+    success and either the old status or an error. Nothing is committed
+    here; the caller commits.
+    """
+    target = _status(status)
+    if target not in ALLOWED_TRANSITIONS:
+        raise BatchDecisionError(f'Applications cannot be moved to {target.value} in a batch.')
+    if ids is None:
+        ids = selection_ids(filters or {})
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise BatchDecisionError('No applications selected.')
+    if len(ids) > MAX_BATCH:
+        raise BatchDecisionError(f'A batch can change at most {MAX_BATCH} applications.')
+
+    # Current state of the selection
+    rows = {}
+    for chunk in _chunks(ids):
+        for row in db.session.query(
+            Application.id,
+            Application.status,
+            Application.user_id,
+            Application.reference_number,
+            Program.name.label('program_name'),
+            Institution.name.label('institution_name')
+        ).join(Program, Application.program_id == Program.id).join(
+            Institution, Application.institution_id == Institution.id
+        ).filter(Application.id.in_(chunk)):
+            rows[row.id] = row
+
+    errors = {}
+    by_status = defaultdict(list)
+    for application_id in ids:
+        row = rows.get(application_id)
+        if row is None:
+            errors[application_id] = 'Application not found'
+        elif row.status == target:
+            errors[application_id] = f'Already {target.value}'
+        elif row.status not in ALLOWED_TRANSITIONS[target]:
+            errors[application_id] = f'Cannot move from {row.status.value} to {target.value}'
+        else:
+            by_status[row.status].append(application_id)
+
+    now = datetime.utcnow()
+    values = {'status': target}
+    if target in DECISION_STATUSES:
+        values['decision_date'] = now
+    if notes:
+        values['decision_notes'] = notes
+
+    updated = []
+    moved = {}
+    for old_status, group in by_status.items():
+        moved[old_status] = 0
+        for chunk in _chunks(group):
+            # The status guard skips rows another request changed since they were read
+            statement = update(Application).where(
+                Application.id.in_(chunk), Application.status == old_status
+            ).values(**values).returning(Application.id)
+            changed = db.session.execute(statement.execution_options(synchronize_session=False)).scalars().all()
+            updated += changed
+            moved[old_status] += len(changed)
+    updated_ids = set(updated)
+    for group in by_status.values():
+        for application_id in group:
+            if application_id not in updated_ids:
+                errors[application_id] = 'Changed by another request; not updated'
+
+    if updated:
+        connection = db.session.connection()
+        day = now.date()
+        for old_status, count in moved.items():
+            if count:
+                bump(connection, day, f'total:status:{old_status.value}', -count)
+        bump(connection, day, f'total:status:{target.value}', len(updated))
+        bump(connection, day, f'status:{target.value}', len(updated))
+
+        db.session.execute(Notification.__table__.insert(), [{
+            'user_id': rows[application_id].user_id,
+            'application_id': application_id,
+            'kind': f'application_{target.value}',
+            'subject': NOTIFICATION_SUBJECTS[target].format(program=rows[application_id].program_name,
+                                                            institution=rows[application_id].institution_name),
+            'body': f'Application {rows[application_id].reference_number} is now {target.value.replace("_", " ")}.',
+            'created_at': now,
+        } for application_id in updated])
+
+    results = []
+    for application_id in ids:
+        if application_id in errors:
+            results.append({'id': application_id, 'success': False, 'error': errors[application_id]})
+        else:
+            row = rows[application_id]
+            results.append({
+                'id': application_id,
+                'success': True,
+                'reference_number': row.reference_number,
+                'old_status': row.status.value,
+                'new_status': target.value,
+            })
+    summary = {
+        'new_status': target.value,
+        'requested': len(ids),
+        'updated': len(updated),
+        'failed': len(errors),
+    }
+    return results, summary
@@ -0,0 +1,208 @@
+"""
+Batch eligibility matching of one student profile against the catalog.
+
+Each active program's requirements (min_gpa and the english_requirements
+JSON) are compiled once into columns of NumPy arrays: a minimum GPA and one
+minimum score per recognised English test, NaN where there is no
+requirement. Checking a student is then a few vectorized comparisons over
+the whole catalog instead of parsing JSON per program. The compiled form is
+cached and rebuilt when the catalog version changes.
+
+For SQL queries the parsed English minimums are also kept in the
+program_english_requirements table, one (program_id, test) row per accepted
+test, so eligibility_criteria() can filter in the database without passing
+a list of eligible ids. Rows are kept in sync by mapper events for ORM
+writes; bulk updates of english_requirements call
+sync_english_requirements().
+
+english_requirements is a JSON object of test -> minimum score, e.g.
+{"ielts": 6.5, "toefl": 90}; a score may also be given as {"overall": 6.5}.
+Any one listed test satisfies the requirement.
+"""
+
+import json
+import numpy as np
+from sqlalchemy import event, inspect, select, delete, exists, and_, or_
+from app import db
+from models import Institution, Program, ProgramEnglishRequirement
+from catalog_cache import CatalogCache
+
+ENGLISH_TESTS = ('ielts', 'toefl', 'pte', 'duolingo', 'cambridge')
+
+# Other spellings of the test names found in requirement JSON
+TEST_ALIASES = {
+    'toefl_ibt': 'toefl',
+    'pte_academic': 'pte',
+    'det': 'duolingo',
+    'duolingo_english_test': 'duolingo',
+    'cae': 'cambridge',
+}
+
+_requirements_cache = CatalogCache(max_entries=1)
+
+def _score(value):
+    if isinstance(value, dict):
+        value = value.get('overall', value.get('min', value.get('minimum')))
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_english_requirements(raw):
+    """Map test -> minimum score from the english_requirements JSON; {} if none or unreadable"""
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    minimums = {}
+    for name, value in data.items():
+        test = str(name).strip().lower().replace(' ', '_')
+        test = TEST_ALIASES.get(test, test)
+        score = _score(value)
+        if test in ENGLISH_TESTS and score is not None:
+            minimums[test] = score
+    return minimums
+
+class CompiledRequirements:
+    """Requirements of every active program as parallel arrays"""
+
+    def __init__(self, rows):
+        count = len(rows)
+        self.program_ids = np.zeros(count, dtype=np.int32)
+        self.min_gpa = np.full(count, np.nan)
+        self.english = np.full((count, len(ENGLISH_TESTS)), np.nan)
+
+        for i, row in enumerate(rows):
+            self.program_ids[i] = row.id
+            if row.min_gpa is not None:
+                self.min_gpa[i] = float(row.min_gpa)
+            for test, score in parse_english_requirements(row.english_requirements).items():
+                self.english[i, ENGLISH_TESTS.index(test)] = score
+
+        self.requires_english = ~np.isnan(self.english).all(axis=1)
+
+    def __len__(self):
+        return len(self.program_ids)
+
+    def match(self, profile):
+        """Boolean mask of the programs the profile meets the requirements of
+
+        A requirement the profile has no value for counts as not met.
+        """
+        gpa = profile.get('gpa')
+        if gpa is None:
+            gpa_ok = np.isnan(self.min_gpa)
+        else:
+            # NaN minimums compare false, so they are or-ed back in
+            gpa_ok = np.isnan(self.min_gpa) | (self.min_gpa <= gpa)
+
+        if profile.get('english_exempt'):
+            english_ok = np.ones(len(self), dtype=bool)
+        else:
+            scores = np.array([np.nan if profile.get(test) is None else profile[test]
+                               for test in ENGLISH_TESTS])
+            with np.errstate(invalid='ignore'):
+                english_ok = ~self.requires_english | (self.english <= scores).any(axis=1)
+
+        return gpa_ok & english_ok
+
+    def eligible_ids(self, profile):
+        return self.program_ids[self.match(profile)].tolist()
+
+def _english_rows(program_id, raw):
+    return [{'program_id': program_id, 'test': test, 'min_score': score}
+            for test, score in parse_english_requirements(raw).items()]
+
+def _replace_requirements(connection, program_id, raw):
+    connection.execute(delete(ProgramEnglishRequirement).where(ProgramEnglishRequirement.program_id == program_id))
+    rows = _english_rows(program_id, raw)
+    if rows:
+        connection.execute(ProgramEnglishRequirement.__table__.insert(), rows)
+
+@event.listens_for(Program, 'after_insert')
+def _add_requirements(mapper, connection, target):
+    _replace_requirements(connection, target.id, target.english_requirements)
+
+@event.listens_for(Program, 'after_update')
+def _update_requirements(mapper, connection, target):
+    if inspect(target).attrs.english_requirements.history.has_changes():
+        _replace_requirements(connection, target.id, target.english_requirements)
+
+@event.listens_for(Program, 'before_delete')
+def _remove_requirements(mapper, connection, target):
+    connection.execute(delete(ProgramEnglishRequirement).where(ProgramEnglishRequirement.program_id == target.id))
+
+def sync_english_requirements(*criteria):
+    """Rebuild the requirement rows of all programs (or those matching criteria)
+
+    Runs in the current transaction; the caller commits.
+    """
+    program_ids = select(Program.id)
+    if criteria:
+        program_ids = program_ids.where(*criteria)
+    db.session.execute(delete(ProgramEnglishRequirement).where(
+        ProgramEnglishRequirement.program_id.in_(program_ids)))
+
+    rows = db.session.query(Program.id, Program.english_requirements).filter(
+        Program.english_requirements.isnot(None), *criteria
+    )
+    values = [row for program_id, raw in rows for row in _english_rows(program_id, raw)]
+    if values:
+        db.session.execute(ProgramEnglishRequirement.__table__.insert(), values)
+
+def init_english_requirements():
+    """Fill program_english_requirements for programs written before it existed; call after db.create_all()"""
+    if (db.session.query(ProgramEnglishRequirement.program_id).first() is None
+            and db.session.query(Program.id).filter(Program.english_requirements.isnot(None)).first() is not None):
+        sync_english_requirements()
+        db.session.commit()
+
+def eligibility_criteria(profile):
+    """WHERE criteria on Program matching CompiledRequirements.match(profile)"""
+    gpa = profile.get('gpa')
+    if gpa is None:
+        criteria = [Program.min_gpa.is_(None)]
+    else:
+        criteria = [or_(Program.min_gpa.is_(None), Program.min_gpa <= gpa)]
+
+    if not profile.get('english_exempt'):
+        requirement = ProgramEnglishRequirement
+        for_program = requirement.program_id == Program.id
+        english_ok = ~exists().where(for_program)
+        scores = [and_(requirement.test == test, requirement.min_score <= profile[test])
+                  for test in ENGLISH_TESTS if profile.get(test) is not None]
+        if scores:
+            english_ok = or_(english_ok, exists().where(for_program, or_(*scores)))
+        criteria.append(english_ok)
+    return criteria
+
+def _compile():
+    rows = db.session.query(
+        Program.id,
+        Program.min_gpa,
+        Program.english_requirements
+    ).join(Institution, Program.institution_id == Institution.id).filter(
+        Program.is_active == True,
+        Institution.is_active == True
+    ).order_by(Program.id).all()
+    return CompiledRequirements(rows)
+
+def get_compiled_requirements():
+    return _requirements_cache.get_or_compute('programs', _compile)
+
+def profile_from_args(args):
+    """Student profile from request args: gpa, one score per English test, english_exempt"""
+    profile = {'gpa': args.get('gpa', type=float)}
+    for test in ENGLISH_TESTS:
+        profile[test] = args.get(test, type=float)
+    profile['english_exempt'] = args.get('english_exempt', '').lower() in ('1', 'true', 'yes')
+    return profile
+
+def eligible_program_ids(profile):
+    """Ids of the active programs whose requirements the profile meets, in id order"""
+    return get_compiled_requirements().eligible_ids(profile)
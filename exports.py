@@ -0,0 +1,112 @@
+"""
+Streamed bulk exports.
+
+Rows are read in batches of EXPORT_BATCH_SIZE through yield_per (a
+server-side cursor where the driver supports one) and each batch is encoded
+and sent as soon as it is read, so memory stays flat however many rows an
+export has. Responses are gzip-encoded when the client accepts it.
+
+CSV cells that a spreadsheet would read as a formula are prefixed with a
+quote (see csv_value()).
+"""
+
+import csv
+import enum
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from flask import Response, request, stream_with_context
+from app import db
+
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Leading characters that make a spreadsheet evaluate a cell
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def export_value(value):
+    """A column value as JSON-friendly data"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+def csv_value(value):
+    """export_value() for a CSV cell, with text that could run as a formula quoted"""
+    value = export_value(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_batches(statement):
+    """Rows of a select, in lists of up to EXPORT_BATCH_SIZE"""
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    yield from result.partitions()
+
+def ndjson_lines(statement, **extra):
+    """One JSON object per row, plus any extra keys, a batch per chunk
+
+    Raises ValueError when an extra key would overwrite a selected column.
+    """
+    clashes = set(extra) & set(statement.selected_columns.keys())
+    if clashes:
+        raise ValueError(f"Extra keys clash with exported columns: {', '.join(sorted(clashes))}")
+    return _ndjson_batches(statement, extra)
+
+def _ndjson_batches(statement, extra):
+    for rows in stream_batches(statement):
+        yield ''.join(
+            json.dumps(dict({k: export_value(v) for k, v in row._mapping.items()}, **extra)) + '\n'
+            for row in rows
+        )
+
+def csv_lines(statement):
+    """A header row, then the rows as CSV, a batch per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(statement.selected_columns.keys())
+    for rows in stream_batches(statement):
+        writer.writerows([csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def streamed_response(lines, mimetype, filename):
+    """A streamed download of the chunks produced by lines(), gzipped when accepted"""
+    compress = 'gzip' in request.accept_encodings
+
+    def generate():
+        if not compress:
+            yield from lines()
+            return
+
+        # wbits=31 writes a gzip container; each batch is flushed as it is produced
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in lines():
+            yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def export_response(statement, export_format, name):
+    """Stream a select as CSV or NDJSON (export_format must be a key of FORMATS)"""
+    if export_format == 'csv':
+        lines = lambda: csv_lines(statement)
+    else:
+        lines = lambda: ndjson_lines(statement)
+    return streamed_response(lines, FORMATS[export_format], f'{name}.{export_format}')
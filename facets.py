@@ -0,0 +1,161 @@
+"""
+Faceted search over the program catalog.
+
+All facet counts come from one grouped query: programs are counted per
+combination of facet values, and each facet is then tallied in Python from
+those combinations using every filter except its own (so a sidebar still
+shows the alternatives to the current selection). Results are cached per
+filter combination until the catalog changes.
+"""
+
+from sqlalchemy import case, func
+from app import db
+from models import Institution, Program
+from catalog_cache import CatalogCache
+from search_index import match_programs
+
+# Annual tuition buckets in the base currency: (label, lower bound inclusive, upper bound exclusive)
+FEE_RANGES = [
+    ('0-10000', 0, 10000),
+    ('10000-20000', 10000, 20000),
+    ('20000-35000', 20000, 35000),
+    ('35000-50000', 35000, 50000),
+    ('50000+', 50000, None),
+]
+
+FACETS = ('country', 'field_of_study', 'degree_type', 'scholarships_available',
+          'work_permit_eligible', 'online_available', 'fee_range')
+
+BOOLEAN_FACETS = ('scholarships_available', 'work_permit_eligible', 'online_available')
+
+_facet_cache = CatalogCache(max_entries=512)
+
+def _parse_bool(value):
+    value = (value or '').lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    return None
+
+def filters_from_args(args):
+    """Read facet selections and text filters from request args"""
+    filters = {
+        'q': args.get('q', '').strip() or None,
+        'university_id': args.get('university_id', type=int),
+        'country': args.get('country', '').upper() or None,
+        'field_of_study': args.get('field_of_study', '') or None,
+        'degree_type': args.get('degree_type', '') or None,
+        'fee_range': args.get('fee_range', '') or None,
+    }
+    for name in BOOLEAN_FACETS:
+        filters[name] = _parse_bool(args.get(name))
+    if filters['fee_range'] not in [label for label, _, _ in FEE_RANGES]:
+        filters['fee_range'] = None
+    return filters
+
+def fee_range_expression():
+    # Programs without a base-currency tuition fall in no bucket
+    return case(
+        (Program.tuition_fee_base.is_(None), None),
+        *[(Program.tuition_fee_base < upper, label) for label, _, upper in FEE_RANGES if upper is not None],
+        else_=FEE_RANGES[-1][0]
+    )
+
+def apply_facet_filters(query, filters):
+    """Apply facet selections to a Program query joined with Institution"""
+    if filters.get('country'):
+        query = query.filter(Institution.country_code == filters['country'])
+    if filters.get('field_of_study'):
+        query = query.filter(Program.field_of_study == filters['field_of_study'])
+    if filters.get('degree_type'):
+        query = query.filter(Program.degree_type == filters['degree_type'])
+    for name in BOOLEAN_FACETS:
+        if filters.get(name) is not None:
+            query = query.filter(getattr(Program, name) == filters[name])
+    if filters.get('fee_range'):
+        _, lower, upper = next(r for r in FEE_RANGES if r[0] == filters['fee_range'])
+        query = query.filter(Program.tuition_fee_base >= lower)
+        if upper is not None:
+            query = query.filter(Program.tuition_fee_base < upper)
+    return query
+
+def _combination_rows(filters):
+    """Program counts per combination of facet values (the single pass)"""
+    query = db.session.query(
+        Institution.country_code,
+        Institution.country,
+        Program.field_of_study,
+        Program.degree_type,
+        Program.scholarships_available,
+        Program.work_permit_eligible,
+        Program.online_available,
+        fee_range_expression().label('fee_range'),
+        func.count(Program.id)
+    ).join(Institution, Program.institution_id == Institution.id).filter(
+        Program.is_active == True,
+        Institution.is_active == True
+    )
+
+    if filters.get('university_id'):
+        query = query.filter(Program.institution_id == filters['university_id'])
+    if filters.get('q'):
+        query = match_programs(query, filters['q']).order_by(None)
+
+    query = query.group_by(
+        Institution.country_code, Institution.country, Program.field_of_study,
+        Program.degree_type, Program.scholarships_available, Program.work_permit_eligible,
+        Program.online_available, 'fee_range'
+    )
+
+    rows = []
+    for code, country, field, degree, scholarships, work_permit, online, fee_range, count in query:
+        rows.append(({
+            'country': code.upper() if code else code,
+            'field_of_study': field,
+            'degree_type': degree,
+            'scholarships_available': bool(scholarships),
+            'work_permit_eligible': bool(work_permit),
+            'online_available': bool(online),
+            'fee_range': fee_range,
+        }, country, count))
+    return rows
+
+def _sort_key(name):
+    if name == 'fee_range':
+        order = [label for label, _, _ in FEE_RANGES]
+        return lambda item: order.index(item[0])
+    return lambda item: (-item[1], str(item[0]))
+
+def _compute_facets(filters):
+    rows = _combination_rows(filters)
+    selected = {name: filters.get(name) for name in FACETS if filters.get(name) is not None}
+
+    def matches(values, skip=None):
+        return all(values[name] == value for name, value in selected.items() if name != skip)
+
+    facets = {}
+    for name in FACETS:
+        counts = {}
+        labels = {}
+        for values, country, count in rows:
+            if matches(values, skip=name) and values[name] is not None:
+                counts[values[name]] = counts.get(values[name], 0) + count
+                if name == 'country':
+                    labels[values[name]] = country
+        facets[name] = [{
+            'value': value,
+            'label': labels.get(value, value),
+            'count': count
+        } for value, count in sorted(counts.items(), key=_sort_key(name))]
+
+    return {
+        'total': sum(count for values, _, count in rows if matches(values)),
+        'facets': facets,
+        'selected': selected
+    }
+
+def get_facets(filters):
+    """Facet counts for the given filters, served from cache while the catalog is unchanged"""
+    key = tuple(sorted((name, value) for name, value in filters.items() if value is not None))
+    return _facet_cache.get_or_compute(key, lambda: _compute_facets(filters))
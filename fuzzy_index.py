@@ -0,0 +1,146 @@
+"""
+Typo-tolerant matching for institution names and cities.
+
+Words from Institution.name, short_name and city are collected into a
+vocabulary of distinct words, and each word is indexed by its trigrams
+(pg_trgm style: lower-cased, accents stripped, padded with blanks). A query
+word only visits the posting lists of its own trigrams, so lookups cost
+time proportional to the number of similar words, not to the number of
+institutions. The index is built in memory and rebuilt when the catalog
+version changes.
+"""
+
+import time
+import unicodedata
+from collections import defaultdict
+from app import db
+from models import Institution
+from catalog_cache import CatalogCache
+from search_index import tokenize
+
+# Minimum trigram similarity for a vocabulary word to count as a match
+MIN_SIMILARITY = 0.3
+# Best vocabulary words kept per query word
+WORDS_PER_TERM = 20
+# Words shared by more institutions than this only re-rank candidates
+COMMON_WORD_LIMIT = 1000
+# Latency budget for a lookup; the best matches found so far are returned
+BUDGET_MS = 25
+
+_index_cache = CatalogCache(max_entries=1)
+
+def _normalize(word):
+    decomposed = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """Trigram index over the distinct words of institution names and cities"""
+
+    def __init__(self, rows):
+        self.words = []
+        self.word_trigrams = []
+        self.word_institutions = []
+        self.postings = defaultdict(list)
+
+        word_ids = {}
+        for institution_id, *texts in rows:
+            for text in texts:
+                for word in tokenize(_normalize(text or '')):
+                    if word not in word_ids:
+                        word_ids[word] = len(self.words)
+                        self.words.append(word)
+                        grams = trigrams(word)
+                        self.word_trigrams.append(len(grams))
+                        self.word_institutions.append(set())
+                        for gram in grams:
+                            self.postings[gram].append(word_ids[word])
+                    self.word_institutions[word_ids[word]].add(institution_id)
+
+    def similar_words(self, word, deadline=None):
+        """(vocabulary word index, similarity) pairs for word, best first"""
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        # Rarest trigrams first, so a budget cut-off drops the least selective ones
+        for gram in sorted(grams, key=lambda g: len(self.postings.get(g, ()))):
+            for word_index in self.postings.get(gram, ()):
+                shared[word_index] += 1
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+        scored = []
+        for word_index, count in shared.items():
+            similarity = count / (len(grams) + self.word_trigrams[word_index] - count)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((word_index, similarity))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:WORDS_PER_TERM]
+
+    def search(self, term, limit=20, budget_ms=BUDGET_MS):
+        """[(institution_id, score)] best first; score is the mean best similarity per query word"""
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        terms = [word for word in tokenize(_normalize(term)) if len(word) >= 2]
+        if not terms:
+            return []
+
+        # Per query word: best similarity per institution from selective words,
+        # and the matched words too common to enumerate (e.g. "university")
+        per_term = []
+        for word in terms:
+            best = {}
+            common = []
+            for word_index, similarity in self.similar_words(word, deadline):
+                institutions = self.word_institutions[word_index]
+                if len(institutions) > COMMON_WORD_LIMIT:
+                    common.append((institutions, similarity))
+                    continue
+                for institution_id in institutions:
+                    if similarity > best.get(institution_id, 0):
+                        best[institution_id] = similarity
+            per_term.append((best, common))
+            if time.perf_counter() > deadline:
+                break
+
+        # Candidates come from selective words only; common words just add to their score
+        candidates = set()
+        for best, _ in per_term:
+            candidates.update(best)
+
+        scores = {}
+        for institution_id in candidates:
+            score = 0.0
+            for best, common in per_term:
+                score += max([best.get(institution_id, 0)] +
+                             [similarity for institutions, similarity in common
+                              if institution_id in institutions])
+            scores[institution_id] = score / len(terms)
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [(institution_id, score) for institution_id, score in ranked[:limit]
+                if score >= MIN_SIMILARITY]
+
+def _build_index():
+    rows = db.session.query(
+        Institution.id,
+        Institution.name,
+        Institution.short_name,
+        Institution.city
+    ).filter(Institution.is_active == True).all()
+    return TrigramIndex(rows)
+
+def get_trigram_index():
+    return _index_cache.get_or_compute('institutions', _build_index)
+
+def fuzzy_institutions(query, term, limit=20):
+    """Institutions from query that fuzzily match term, best match first"""
+    # Over-fetch, since other filters on query (e.g. country) may drop some
+    matches = get_trigram_index().search(term, limit=limit * 5)
+    if not matches:
+        return []
+    by_id = {inst.id: inst for inst in query.filter(
+        Institution.id.in_([institution_id for institution_id, _ in matches])
+    ).all()}
+    return [by_id[institution_id] for institution_id, _ in matches if institution_id in by_id][:limit]
@@ -0,0 +1,106 @@
+"""
+Parsed, indexed program intake months.
+
+Program.intake_months is free text such as "1,5,9" (or "Jan, Sep"). Its
+parsed months are kept in the program_intakes table, one (month, program_id)
+row per intake, whose primary key makes "programs starting in September" an
+index range lookup. Rows are kept in sync by mapper events for ORM writes;
+bulk updates of intake_months call sync_program_intakes().
+"""
+
+import re
+from sqlalchemy import event, inspect, select, delete, func
+from app import db
+from models import Program, ProgramIntake
+
+MONTH_NAMES = ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+               'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+
+_PART_RE = re.compile(r'[\s,;/]+')
+
+def parse_month(value):
+    """Month number 1-12 from "9", "09", "Sep" or "September"; None if not a month"""
+    value = str(value).strip().lower()
+    if value.isdigit():
+        month = int(value)
+        return month if 1 <= month <= 12 else None
+    if len(value) >= 3 and value[:3] in MONTH_NAMES:
+        return MONTH_NAMES.index(value[:3]) + 1
+    return None
+
+def parse_intake_months(text):
+    """Sorted distinct months in an intake_months string; unreadable parts are skipped"""
+    months = {parse_month(part) for part in _PART_RE.split(text or '') if part}
+    return sorted(month for month in months if month is not None)
+
+def months_in_window(window):
+    """Months in a window such as "9-11", "sep-nov" or "11-2" (wrapping over new year)"""
+    start, _, end = (window or '').partition('-')
+    start = parse_month(start)
+    end = parse_month(end) if end else start
+    if start is None or end is None:
+        return []
+    if start <= end:
+        return list(range(start, end + 1))
+    return list(range(start, 13)) + list(range(1, end + 1))
+
+def intake_mask(months):
+    """12-bit mask of months, bit 0 for January"""
+    mask = 0
+    for month in months:
+        mask |= 1 << (month - 1)
+    return mask
+
+def filter_by_intake(query, months):
+    """Restrict a Program query to programs with an intake in any of months"""
+    return query.filter(Program.id.in_(
+        select(ProgramIntake.program_id).where(ProgramIntake.month.in_(months))
+    ))
+
+def _replace_intakes(connection, program_id, intake_months):
+    connection.execute(delete(ProgramIntake).where(ProgramIntake.program_id == program_id))
+    months = parse_intake_months(intake_months)
+    if months:
+        connection.execute(ProgramIntake.__table__.insert(),
+                           [{'month': month, 'program_id': program_id} for month in months])
+
+@event.listens_for(Program, 'after_insert')
+def _add_intakes(mapper, connection, target):
+    _replace_intakes(connection, target.id, target.intake_months)
+
+@event.listens_for(Program, 'after_update')
+def _update_intakes(mapper, connection, target):
+    if inspect(target).attrs.intake_months.history.has_changes():
+        _replace_intakes(connection, target.id, target.intake_months)
+
+@event.listens_for(Program, 'before_delete')
+def _remove_intakes(mapper, connection, target):
+    connection.execute(delete(ProgramIntake).where(ProgramIntake.program_id == target.id))
+
+def sync_program_intakes(*criteria):
+    """Rebuild the intake rows of all programs (or those matching criteria) from intake_months
+
+    Runs in the current transaction; the caller commits.
+    """
+    program_ids = select(Program.id)
+    if criteria:
+        program_ids = program_ids.where(*criteria)
+    db.session.execute(delete(ProgramIntake).where(ProgramIntake.program_id.in_(program_ids)))
+
+    rows = db.session.query(Program.id, Program.intake_months).filter(
+        Program.intake_months.isnot(None), *criteria
+    )
+    values = [{'month': month, 'program_id': program_id}
+              for program_id, intake_months in rows
+              for month in parse_intake_months(intake_months)]
+    if values:
+        db.session.execute(ProgramIntake.__table__.insert(), values)
+
+def init_program_intakes():
+    """Fill program_intakes for programs written before it existed; call after db.create_all()"""
+    has_intakes = db.session.query(Program.id).filter(
+        Program.intake_months.isnot(None), Program.intake_months != ''
+    ).first() is not None
+    if has_intakes and db.session.query(func.count(ProgramIntake.program_id)).scalar() == 0:
+        sync_program_intakes()
+        db.session.commit()
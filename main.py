@@ -5,6 +5,16 @@ from admin import admin as admin_blueprint
 from api import api as api_blueprint  
 from payments import payments as payments_blueprint
 import routes
+from search_index import init_search_index
+from autocomplete import get_autocomplete_index
+from schema import upgrade_schema
+from currency import init_exchange_rates
+from intakes import init_program_intakes
+from eligibility import init_english_requirements
+from deadlines import init_effective_deadlines
+from similar_institutions import init_similar_institutions
+from rollups import init_daily_stats
+from audit_log import init_audit_log
 
 # Initialize authentication
 init_auth(login_manager, User, db)
@@ -18,6 +28,16 @@ app.register_blueprint(payments_blueprint, url_prefix='/payments')
 # Create tables
 with app.app_context():
     db.create_all()
+    upgrade_schema()
+    init_exchange_rates()
+    init_program_intakes()
+    init_english_requirements()
+    init_effective_deadlines()
+    init_search_index()
+    init_similar_institutions()
+    init_daily_stats()
+    init_audit_log()
+    get_autocomplete_index()
     print("Database tables created")
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import func, literal_column
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 import enum
@@ -46,7 +47,7 @@ class User(UserMixin, db.Model):
     is_verified = db.Column(db.Boolean, default=False, nullable=False)
     verification_token = db.Column(db.String(100))
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
@@ -71,7 +72,7 @@ class Institution(db.Model):
     __tablename__ = 'institutions'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200), nullable=False, index=True)
     short_name = db.Column(db.String(50))
     description = db.Column(db.Text)
     
@@ -114,7 +115,7 @@ class Institution(db.Model):
     is_verified = db.Column(db.Boolean, default=False, nullable=False)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     programs = db.relationship('Program', backref='institution', lazy='dynamic', cascade='all, delete-orphan')
@@ -123,8 +124,19 @@ class Institution(db.Model):
     def __repr__(self):
         return f'<Institution {self.name}>'
 
+# Ranking order for cursor pagination: unranked institutions sort after all
+# ranked ones. The sentinel is a literal, not a bound parameter, so queries
+# ordering by INSTITUTION_RANKING_KEY match the expression index exactly.
+UNRANKED = 2 ** 31 - 1
+INSTITUTION_RANKING_KEY = func.coalesce(Institution.world_ranking, literal_column(str(UNRANKED)))
+db.Index('ix_institutions_active_ranking_id', Institution.is_active, INSTITUTION_RANKING_KEY, Institution.id)
+
 class Program(db.Model):
     __tablename__ = 'programs'
+    __table_args__ = (
+        db.Index('ix_programs_institution_active', 'institution_id', 'is_active'),
+        db.Index('ix_programs_active_deadline', 'is_active', 'effective_deadline', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     institution_id = db.Column(db.Integer, db.ForeignKey('institutions.id'), nullable=False)
@@ -144,6 +156,10 @@ class Program(db.Model):
     currency = db.Column(db.String(3), default='USD')
     additional_fees = db.Column(db.Numeric(10, 2), default=0.00)
     
+    # Costs in the base currency (see currency.py); NULL when the currency has no rate
+    tuition_fee_base = db.Column(db.Numeric(12, 2))  # annual tuition
+    total_cost_base = db.Column(db.Numeric(14, 2))  # tuition for the whole program plus additional fees
+    
     # Requirements
     min_gpa = db.Column(db.Numeric(3, 2))
     english_requirements = db.Column(db.Text)  # JSON string
@@ -152,6 +168,7 @@ class Program(db.Model):
     # Intake
     intake_months = db.Column(db.String(50))  # e.g., "1,5,9" for Jan, May, Sep
     application_deadline = db.Column(db.Date)
+    effective_deadline = db.Column(db.Date)  # own deadline, else the institution's (see deadlines.py)
     
     # Program features
     scholarships_available = db.Column(db.Boolean, default=False)
@@ -163,7 +180,7 @@ class Program(db.Model):
     seats_available = db.Column(db.Integer)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     applications = db.relationship('Application', backref='program', lazy='dynamic')
@@ -175,6 +192,61 @@ class Program(db.Model):
     def __repr__(self):
         return f'<Program {self.name} at {self.institution.name}>'
 
+# Cost sort keys: programs without a base-currency cost (no exchange rate)
+# sort after all priced ones. As with INSTITUTION_RANKING_KEY, the sentinel
+# is a literal so the queries match the expression indexes.
+UNPRICED = 10 ** 11
+PROGRAM_COST_KEYS = {
+    'tuition': func.coalesce(Program.tuition_fee_base, literal_column(str(UNPRICED))),
+    'total_cost': func.coalesce(Program.total_cost_base, literal_column(str(UNPRICED))),
+}
+db.Index('ix_programs_active_tuition_key_id', Program.is_active, PROGRAM_COST_KEYS['tuition'], Program.id)
+db.Index('ix_programs_active_total_cost_key_id', Program.is_active, PROGRAM_COST_KEYS['total_cost'], Program.id)
+
+class ProgramIntake(db.Model):
+    """One row per intake month of a program, parsed from Program.intake_months (see intakes.py)"""
+    __tablename__ = 'program_intakes'
+    
+    # Month first, so "programs starting in <month>" is a primary key range scan
+    month = db.Column(db.SmallInteger, primary_key=True)  # 1-12
+    program_id = db.Column(db.Integer, db.ForeignKey('programs.id', ondelete='CASCADE'), primary_key=True)
+    
+    def __repr__(self):
+        return f'<ProgramIntake {self.program_id}: {self.month}>'
+
+class ProgramEnglishRequirement(db.Model):
+    """Minimum score of one English test a program accepts, parsed from Program.english_requirements (see eligibility.py)"""
+    __tablename__ = 'program_english_requirements'
+    
+    program_id = db.Column(db.Integer, db.ForeignKey('programs.id', ondelete='CASCADE'), primary_key=True)
+    test = db.Column(db.String(20), primary_key=True)  # one of eligibility.ENGLISH_TESTS
+    min_score = db.Column(db.Float, nullable=False)
+    
+    def __repr__(self):
+        return f'<ProgramEnglishRequirement {self.program_id}: {self.test} {self.min_score}>'
+
+class CatalogVersion(db.Model):
+    """Single-row catalog version stamp, bumped with every committed catalog write (see catalog_cache.py)"""
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False)
+    def __repr__(self): return f'<CatalogVersion {self.version}>'
+
+class SimilarInstitution(db.Model):
+    """Precomputed nearest neighbours of an institution (see similar_institutions.py)"""
+    __tablename__ = 'similar_institutions'
+    
+    institution_id = db.Column(db.Integer, db.ForeignKey('institutions.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)  # 1 = most similar
+    similar_institution_id = db.Column(db.Integer, db.ForeignKey('institutions.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)  # 1 / (1 + distance between the feature vectors)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    similar_institution = db.relationship('Institution', foreign_keys=[similar_institution_id])
+    
+    def __repr__(self):
+        return f'<SimilarInstitution {self.institution_id} #{self.rank}: {self.similar_institution_id}>'
+
 class Application(db.Model):
     __tablename__ = 'applications'
     
@@ -205,7 +277,7 @@ class Application(db.Model):
     decision_notes = db.Column(db.Text)
     offer_conditions = db.Column(db.Text)
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
@@ -236,7 +308,7 @@ class Payment(db.Model):
     status = db.Column(db.Enum(PaymentStatus), default=PaymentStatus.PENDING, nullable=False)
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     completed_at = db.Column(db.DateTime)
     
     # Stripe metadata
@@ -245,9 +317,56 @@ class Payment(db.Model):
     def __repr__(self):
         return f'<Payment {self.id}: {self.amount} {self.currency}>'
 
+class ExchangeRate(db.Model):
+    __tablename__ = 'exchange_rates'
+    
+    currency = db.Column(db.String(3), primary_key=True)
+    rate_to_base = db.Column(db.Numeric(18, 8), nullable=False)  # 1 unit of currency in the base currency
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ExchangeRate {self.currency}: {self.rate_to_base}>'
+
+class DailyStat(db.Model):
+    """Per-day rollup of one dashboard metric (see rollups.py)"""
+    __tablename__ = 'daily_stats'
+    
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    amount = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<DailyStat {self.day} {self.metric}: {self.count}>'
+
+# Student notifications, queued in the transaction that causes them; a sender
+# delivers the rows whose sent_at is still unset
+class Notification(db.Model):
+    __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_pending', 'sent_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    application_id = db.Column(db.Integer, db.ForeignKey('applications.id'))
+    kind = db.Column(db.String(50), nullable=False)  # e.g., application_accepted
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Notification {self.kind} for {self.user_id}>'
+
 # Admin activity logging
 class AdminLog(db.Model):
     __tablename__ = 'admin_logs'
+    # Holds recent months only; older months are compacted into archive files (audit_archive.py)
+    __table_args__ = (
+        db.Index('ix_admin_logs_action_created', 'action', 'created_at', 'id'),
+        db.Index('ix_admin_logs_target', 'target_type', 'target_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     admin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -256,7 +375,7 @@ class AdminLog(db.Model):
     target_id = db.Column(db.Integer)
     details = db.Column(db.Text)  # JSON string
     ip_address = db.Column(db.String(45))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     admin = db.relationship('User', backref='admin_logs')
     
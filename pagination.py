@@ -0,0 +1,153 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor is an opaque, URL-safe token holding the sort key of the last row
+of the previous page. The next page is selected with a row-value comparison
+against that key, so a deep page costs the same as the first one and never
+needs OFFSET or COUNT(*).
+"""
+
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from sqlalchemy import tuple_
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+def encode_cursor(values):
+    payload = json.dumps(list(values), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, keys):
+    """Turn a cursor back into typed values matching the sort keys"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor(cursor)
+
+    try:
+        return [_from_json(value, key.type) for value, key in zip(values, keys)]
+    except (TypeError, ValueError, NotImplementedError, ArithmeticError):
+        raise InvalidCursor(cursor)
+
+def _from_json(value, sql_type):
+    if value is None:
+        return None
+    python_type = sql_type.python_type
+    if python_type in (date, datetime):
+        return python_type.fromisoformat(value)
+    return python_type(value)
+
+def keyset_page(query, keys, cursor=None, per_page=20, descending=False):
+    """Fetch one page of query ordered by keys.
+
+    keys is a list of column expressions forming a unique sort key, ending
+    with the primary key as a tie-breaker (e.g. [Program.tuition_fee,
+    Program.id]). Keys must not be NULL; wrap nullable columns in coalesce().
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    # Any ordering already on the query (e.g. relevance) would break the key
+    query = query.order_by(None)
+
+    if cursor:
+        values = decode_cursor(cursor, keys)
+        after = tuple_(*values)
+        row_key = tuple_(*keys)
+        query = query.filter(row_key < after if descending else row_key > after)
+        # Redundant with the row comparison, but lets SQLite seek an index on
+        # the leading key when that key is an expression such as coalesce()
+        query = query.filter(keys[0] <= values[0] if descending else keys[0] >= values[0])
+
+    order = [key.desc() for key in keys] if descending else list(keys)
+    # One extra row tells us whether there is a next page without a COUNT
+    rows = query.add_columns(*keys).order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][1:])
+
+    return [row[0] for row in rows], next_cursor
+
+class ListPage:
+    """One page of a list, shaped like Flask-SQLAlchemy's Pagination
+
+    Works both by page number (OFFSET) and by cursor. total may be an
+    estimate (total_is_estimate); has_next is always exact because one
+    extra row is fetched.
+    """
+
+    def __init__(self, items, page, per_page, total, total_is_estimate=False,
+                 has_next=False, next_cursor=None, cursor=None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    @property
+    def pages(self):
+        if not self.total:
+            return 0
+        return -(-self.total // self.per_page)
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        """Page numbers for a pager, with None marking gaps"""
+        pages = max(self.pages, self.page + (1 if self.has_next else 0))
+        last = 0
+        for num in range(1, pages + 1):
+            if (num <= left_edge
+                    or self.page - left_current - 1 < num < self.page + right_current
+                    or num > pages - right_edge):
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+def paginate_list(query, keys, page=1, cursor=None, per_page=20, descending=False, count=None):
+    """Page through query in keys order, by cursor when one is given, else by page number
+
+    count(query) returns (total, is_estimate) and is only called in
+    page-number mode; cursor pages never count.
+    """
+    if cursor is not None:
+        items, next_cursor = keyset_page(query, keys, cursor, per_page, descending)
+        return ListPage(items, 1, per_page, None, has_next=next_cursor is not None,
+                        next_cursor=next_cursor, cursor=cursor)
+
+    page = max(page, 1)
+    order = [key.desc() for key in keys] if descending else list(keys)
+    rows = query.order_by(None).add_columns(*keys).order_by(*order).offset(
+        (page - 1) * per_page).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    # The key of the last row lets the client switch to cursor paging from here
+    next_cursor = encode_cursor(rows[-1][1:]) if has_next else None
+
+    total, is_estimate = count(query) if count else (None, False)
+    if total is not None and not is_estimate:
+        # An exact total can still be stale by a few rows; never contradict the page itself
+        total = max(total, (page - 1) * per_page + len(rows))
+    return ListPage([row[0] for row in rows], page, per_page, total, is_estimate,
+                    has_next=has_next, next_cursor=next_cursor)
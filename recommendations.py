@@ -0,0 +1,207 @@
+"""
+Personalized program recommendations.
+
+Every active program is described by a row of a feature matrix (field of
+study code, degree level, destination country code, normalized cost,
+ranking score, scholarships), built once per catalog version. A student's
+profile (field_of_interest, education_level, preferred_destinations) is
+turned into per-feature weights and all programs are scored in one NumPy
+pass, followed by an argpartition top-k.
+
+Results are cached per user, keyed by the profile fields, so they are
+recomputed when the profile or the catalog changes.
+"""
+
+import json
+import numpy as np
+from app import db
+from models import Institution, Program
+from catalog_cache import CatalogCache
+from search_index import tokenize
+
+# How much each feature contributes to a program's score
+WEIGHTS = {
+    'field': 0.40,
+    'degree': 0.20,
+    'destination': 0.20,
+    'cost': 0.10,
+    'ranking': 0.07,
+    'scholarships': 0.03,
+}
+
+# Number of recommendations kept per user; callers slice what they show
+CACHED_RESULTS = 50
+
+# Registration form categories and the words they cover in field_of_study
+FIELD_KEYWORDS = {
+    'business': {'business', 'management', 'administration', 'finance', 'accounting', 'marketing', 'economics'},
+    'technology': {'computer', 'computing', 'software', 'data', 'information', 'technology', 'it'},
+    'engineering': {'engineering'},
+    'science': {'science', 'sciences', 'physics', 'chemistry', 'biology', 'mathematics'},
+    'health': {'health', 'medicine', 'nursing', 'pharmacy', 'medical'},
+    'arts': {'arts', 'humanities', 'philosophy', 'history', 'literature', 'design'},
+    'social': {'social', 'politics', 'psychology', 'sociology', 'economics'},
+    'education': {'education', 'teaching'},
+    'law': {'law', 'legal'},
+}
+
+# Degree levels a student at each education level is looking for, with how good a fit each is
+DEGREE_FIT = {
+    'high_school': {'diploma': 0.6, 'bachelor': 1.0},
+    'diploma': {'diploma': 0.5, 'bachelor': 1.0},
+    'bachelor': {'master': 1.0, 'phd': 0.4, 'diploma': 0.3},
+    'master': {'phd': 1.0, 'master': 0.5},
+    'phd': {'phd': 0.5},
+}
+
+_features_cache = CatalogCache(max_entries=1)
+_results_cache = CatalogCache(max_entries=4096)
+
+def degree_level(degree_type):
+    words = set(tokenize(degree_type))
+    if words & {'phd', 'doctorate', 'doctoral'}:
+        return 'phd'
+    if words & {'master', 'masters', 'mba', 'msc', 'ma'}:
+        return 'master'
+    if words & {'bachelor', 'bachelors', 'bsc', 'ba', 'undergraduate'}:
+        return 'bachelor'
+    if words & {'diploma', 'certificate'}:
+        return 'diploma'
+    return None
+
+class ProgramFeatures:
+    """Feature matrix of all active programs, one row per program"""
+
+    def __init__(self, rows):
+        count = len(rows)
+        self.program_ids = np.zeros(count, dtype=np.int32)
+        self.fields = []
+        self.degree_levels = []
+        self.countries = []
+        field_codes = {}
+        degree_codes = {}
+        country_codes = {}
+        self.field = np.zeros(count, dtype=np.int32)
+        self.degree = np.zeros(count, dtype=np.int32)
+        self.country = np.zeros(count, dtype=np.int32)
+        costs = np.full(count, np.nan)
+        rankings = np.full(count, np.nan)
+        self.scholarships = np.zeros(count)
+
+        def encode(codes, values, value):
+            if value not in codes:
+                codes[value] = len(values)
+                values.append(value)
+            return codes[value]
+
+        for i, row in enumerate(rows):
+            self.program_ids[i] = row.id
+            self.field[i] = encode(field_codes, self.fields, row.field_of_study or '')
+            self.degree[i] = encode(degree_codes, self.degree_levels, degree_level(row.degree_type))
+            self.country[i] = encode(country_codes, self.countries, (row.country_code or '').upper())
+            if row.tuition_fee_base is not None:
+                costs[i] = float(row.tuition_fee_base)
+            if row.world_ranking:
+                rankings[i] = row.world_ranking
+            self.scholarships[i] = 1.0 if row.scholarships_available else 0.0
+
+        # Cost: 1 for the cheapest program, 0 for the most expensive (by rank,
+        # so a few very expensive programs do not squash everyone else)
+        self.cost = np.full(count, 0.5)
+        priced = ~np.isnan(costs)
+        if priced.sum() > 1:
+            order = costs[priced].argsort().argsort()
+            self.cost[priced] = 1.0 - order / (priced.sum() - 1)
+
+        # Ranking: log scale, 1 for #1, falling towards 0 at #1000; unranked 0
+        self.ranking = np.zeros(count)
+        ranked = ~np.isnan(rankings)
+        self.ranking[ranked] = np.clip(1.0 - np.log10(rankings[ranked]) / 3.0, 0.0, 1.0)
+
+        # Score parts that do not depend on the student
+        self.base_score = (WEIGHTS['cost'] * self.cost
+                           + WEIGHTS['ranking'] * self.ranking
+                           + WEIGHTS['scholarships'] * self.scholarships)
+
+    def __len__(self):
+        return len(self.program_ids)
+
+    def _field_scores(self, field_of_interest):
+        """Match score per distinct field of study (0..1)"""
+        interest = set(tokenize(field_of_interest))
+        for word in list(interest):
+            interest |= FIELD_KEYWORDS.get(word, set())
+        scores = np.zeros(len(self.fields))
+        if not interest:
+            return scores
+        for code, field in enumerate(self.fields):
+            words = set(tokenize(field))
+            if words:
+                scores[code] = len(words & interest) / len(words)
+        return scores
+
+    def score(self, profile):
+        """Score of every program for a profile"""
+        field_scores = self._field_scores(profile['field_of_interest'])
+        fit = DEGREE_FIT.get(profile['education_level'], {})
+        degree_scores = np.array([fit.get(level, 0.0) for level in self.degree_levels])
+        destination_scores = np.array([1.0 if country in profile['destinations'] else 0.0
+                                       for country in self.countries])
+
+        # Per-program scores by indexing the per-code scores with the code columns
+        score = self.base_score.copy()
+        if len(self):
+            score += WEIGHTS['field'] * field_scores[self.field]
+            score += WEIGHTS['degree'] * degree_scores[self.degree]
+            score += WEIGHTS['destination'] * destination_scores[self.country]
+        return score
+
+    def top(self, profile, k):
+        """[(program_id, score)] of the k best programs, best first"""
+        score = self.score(profile)
+        k = min(k, len(score))
+        if k == 0:
+            return []
+        best = np.argpartition(-score, k - 1)[:k]
+        best = best[np.argsort(-score[best], kind='stable')]
+        return [(int(self.program_ids[i]), round(float(score[i]), 4)) for i in best]
+
+def _build_features():
+    rows = db.session.query(
+        Program.id,
+        Program.field_of_study,
+        Program.degree_type,
+        Program.tuition_fee_base,
+        Program.scholarships_available,
+        Institution.country_code,
+        Institution.world_ranking
+    ).join(Institution, Program.institution_id == Institution.id).filter(
+        Program.is_active == True,
+        Institution.is_active == True
+    ).order_by(Program.id).all()
+    return ProgramFeatures(rows)
+
+def get_program_features():
+    return _features_cache.get_or_compute('programs', _build_features)
+
+def user_profile(user):
+    """The profile fields recommendations depend on, in a hashable form"""
+    try:
+        destinations = json.loads(user.preferred_destinations) if user.preferred_destinations else []
+    except (TypeError, ValueError):
+        destinations = []
+    return {
+        'field_of_interest': user.field_of_interest or '',
+        'education_level': (user.education_level or '').lower(),
+        'destinations': frozenset(str(code).upper() for code in destinations if code),
+    }
+
+def recommend_programs(user, limit=10):
+    """[(program_id, score)] recommended for user, best first"""
+    profile = user_profile(user)
+    # The profile is part of the key, so editing it misses the cache
+    key = (user.id, profile['field_of_interest'], profile['education_level'], profile['destinations'])
+    results = _results_cache.get_or_compute(
+        key, lambda: get_program_features().top(profile, CACHED_RESULTS)
+    )
+    return results[:limit]
@@ -0,0 +1,232 @@
+"""
+Daily rollups behind the admin dashboard.
+
+daily_stats holds one row per (day, metric) with a count and an amount:
+
+- flows, counted on the day they happen: "signups" (new students),
+  "applications" (new applications), "status:<status>" (applications
+  entering a status) and "revenue" (completed payments; a refund subtracts
+  on the day it happens)
+- gauges, prefixed "total:", stored as +1/-1 deltas so their sum over all
+  days is the current value: "total:students", "total:institutions" and
+  "total:programs" (active ones), "total:status:<status>" (applications
+  per current status)
+
+Mapper events upsert the deltas in the same transaction as the write, so the
+dashboard only reads a few small rows. Bulk UPDATEs bypass the events;
+rebuild_daily_stats() recomputes everything from the base tables and also
+folds the gauge deltas into one row per metric. Run it periodically:
+
+    python rollups.py
+"""
+
+from datetime import datetime, date
+from decimal import Decimal
+from sqlalchemy import event, inspect, delete, func
+from app import app, db
+from models import (User, Institution, Program, Application, Payment, DailyStat,
+                    UserRole, ApplicationStatus, PaymentStatus)
+
+def _insert(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def bump(connection, day, metric, count=0, amount=0):
+    """Add count and amount to a (day, metric) row, creating it if needed"""
+    table = DailyStat.__table__
+    statement = _insert(connection.dialect.name)(table).values(
+        day=day, metric=metric, count=count, amount=amount
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', 'metric'],
+        set_={
+            'count': table.c.count + statement.excluded.count,
+            'amount': table.c.amount + statement.excluded.amount,
+        }
+    )
+    connection.execute(statement)
+
+def _day(value=None):
+    """UTC day of a timestamp, today when None"""
+    return (value or datetime.utcnow()).date()
+
+def _old(target, name):
+    """Value of an attribute before the current flush"""
+    history = inspect(target).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, name)
+
+# Attributes whose previous value the handlers compare against. Listening
+# with active_history loads the old value even when the attribute was
+# expired (e.g. by a commit) before being set.
+TRACKED_ATTRIBUTES = (User.role, Institution.is_active, Program.is_active,
+                      Application.status, Payment.status, Payment.amount)
+
+def _load_old_value(target, value, oldvalue, initiator):
+    pass
+
+for _attribute in TRACKED_ATTRIBUTES:
+    event.listen(_attribute, 'set', _load_old_value, active_history=True)
+
+# The gauge each model's rows count towards, given a getter for its attributes
+def _student_gauge(get):
+    return 'total:students' if (get('role') or UserRole.STUDENT) == UserRole.STUDENT else None
+
+def _active_gauge(metric):
+    def gauge(get):
+        return metric if get('is_active') in (True, None) else None
+    return gauge
+
+def _status_gauge(get):
+    return f"total:status:{(get('status') or ApplicationStatus.DRAFT).value}"
+
+GAUGES = {
+    User: _student_gauge,
+    Institution: _active_gauge('total:institutions'),
+    Program: _active_gauge('total:programs'),
+    Application: _status_gauge,
+}
+
+def _track_gauge(model):
+    gauge = GAUGES[model]
+
+    @event.listens_for(model, 'after_insert')
+    def gauge_insert(mapper, connection, target):
+        metric = gauge(lambda name: getattr(target, name))
+        if metric:
+            bump(connection, _day(), metric, 1)
+
+    @event.listens_for(model, 'after_update')
+    def gauge_update(mapper, connection, target):
+        old = gauge(lambda name: _old(target, name))
+        new = gauge(lambda name: getattr(target, name))
+        if old != new:
+            if old:
+                bump(connection, _day(), old, -1)
+            if new:
+                bump(connection, _day(), new, 1)
+
+    @event.listens_for(model, 'after_delete')
+    def gauge_delete(mapper, connection, target):
+        metric = gauge(lambda name: _old(target, name))
+        if metric:
+            bump(connection, _day(), metric, -1)
+
+for _model in GAUGES:
+    _track_gauge(_model)
+
+# Flows
+@event.listens_for(User, 'after_insert')
+def _count_signup(mapper, connection, target):
+    if (target.role or UserRole.STUDENT) == UserRole.STUDENT:
+        bump(connection, _day(target.created_at), 'signups', 1)
+
+@event.listens_for(Application, 'after_insert')
+def _count_application(mapper, connection, target):
+    bump(connection, _day(target.created_at), 'applications', 1)
+    bump(connection, _day(target.created_at), f"status:{(target.status or ApplicationStatus.DRAFT).value}", 1)
+
+@event.listens_for(Application, 'after_update')
+def _count_status_change(mapper, connection, target):
+    if inspect(target).attrs.status.history.has_changes() and target.status != _old(target, 'status'):
+        bump(connection, _day(), f'status:{target.status.value}', 1)
+
+def _revenue(get):
+    if get('status') != PaymentStatus.COMPLETED:
+        return None
+    return get('amount') or Decimal('0')
+
+@event.listens_for(Payment, 'after_insert')
+def _count_payment(mapper, connection, target):
+    amount = _revenue(lambda name: getattr(target, name))
+    if amount is not None:
+        bump(connection, _day(target.completed_at), 'revenue', 1, amount)
+
+@event.listens_for(Payment, 'after_update')
+def _count_payment_change(mapper, connection, target):
+    old = _revenue(lambda name: _old(target, name))
+    new = _revenue(lambda name: getattr(target, name))
+    if old == new:
+        return
+    if old is not None:
+        bump(connection, _day(), 'revenue', -1, -old)
+    if new is not None:
+        bump(connection, _day(target.completed_at), 'revenue', 1, new)
+
+@event.listens_for(Payment, 'after_delete')
+def _count_payment_delete(mapper, connection, target):
+    amount = _revenue(lambda name: _old(target, name))
+    if amount is not None:
+        bump(connection, _day(), 'revenue', -1, -amount)
+
+def _as_date(value):
+    # func.date() returns a string on SQLite
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def rebuild_daily_stats():
+    """Recompute the rollups from the base tables
+
+    Gauges become one row per metric dated today. Status flows cannot be
+    recovered from the base tables, so those rows are kept as they are.
+    """
+    today = _day()
+    rows = []
+
+    def add(day, metric, count, amount=0):
+        rows.append({'day': _as_date(day), 'metric': metric, 'count': count, 'amount': amount or 0})
+
+    add(today, 'total:students', User.query.filter_by(role=UserRole.STUDENT).count())
+    add(today, 'total:institutions', Institution.query.filter_by(is_active=True).count())
+    add(today, 'total:programs', Program.query.filter_by(is_active=True).count())
+    for status, count in db.session.query(Application.status, func.count(Application.id)).group_by(Application.status):
+        add(today, f'total:status:{status.value}', count)
+
+    for day, count in db.session.query(func.date(User.created_at), func.count(User.id)).filter(
+            User.role == UserRole.STUDENT).group_by(func.date(User.created_at)):
+        add(day, 'signups', count)
+    for day, count in db.session.query(func.date(Application.created_at), func.count(Application.id)).group_by(
+            func.date(Application.created_at)):
+        add(day, 'applications', count)
+    for day, count, amount in db.session.query(
+        func.date(Payment.completed_at), func.count(Payment.id), func.sum(Payment.amount)
+    ).filter(Payment.status == PaymentStatus.COMPLETED).group_by(func.date(Payment.completed_at)):
+        add(day or today, 'revenue', count, amount)
+
+    db.session.execute(delete(DailyStat).where(~DailyStat.metric.like('status:%')))
+    rows = [row for row in rows if row['count'] or row['amount']]
+    if rows:
+        # A day can appear twice (e.g. revenue with no completed_at); merge before inserting
+        merged = {}
+        for row in rows:
+            key = (row['day'], row['metric'])
+            if key in merged:
+                merged[key]['count'] += row['count']
+                merged[key]['amount'] += row['amount']
+            else:
+                merged[key] = row
+        db.session.execute(DailyStat.__table__.insert(), list(merged.values()))
+    db.session.commit()
+
+def init_daily_stats():
+    """Build the rollups on first start; call after db.create_all()"""
+    if db.session.query(DailyStat.day).first() is None:
+        rebuild_daily_stats()
+
+def month_starts(count, today=None):
+    """First days of the last `count` calendar months, oldest first"""
+    today = today or _day()
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(count):
+        starts.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+if __name__ == '__main__':
+    with app.app_context():
+        rebuild_daily_stats()
+        print("Daily stats rebuilt")
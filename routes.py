@@ -4,6 +4,14 @@ from flask import render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app import app
 from models import User, Institution, Program, Application, Payment, db, ApplicationStatus
+from search_index import match_institutions, match_programs
+from facets import get_facets
+from fuzzy_index import fuzzy_institutions
+from catalog_cache import catalog_etag, CatalogCache
+from recommendations import recommend_programs
+from api import programs_by_ids
+from similar_institutions import similar_institutions
+from sqlalchemy import func
 
 def load_json_data(filename):
     """Helper function to load JSON data from the data directory"""
@@ -16,28 +24,76 @@ def load_json_data(filename):
     except json.JSONDecodeError:
         return []
 
-@app.route('/')
-def index():
-    """Homepage with hero section and featured universities"""
-    # Get featured institutions from database
-    institutions = Institution.query.filter_by(is_active=True).all()
+# Homepage featured universities: top N per country by world ranking
+FEATURED_COUNTRIES = ['ca', 'us', 'gb', 'au', 'ie', 'de']
+FEATURED_PER_COUNTRY = 3
+
+_homepage_cache = CatalogCache(max_entries=4)
+
+# Programs shown under "Recommended for You" on the dashboard
+RECOMMENDED_COUNT = 4
+
+def load_featured_universities():
+    """Top institutions per featured country, selected with one windowed query"""
+    country_key = func.lower(Institution.country_code)
+    position = func.row_number().over(
+        partition_by=country_key,
+        order_by=(func.coalesce(Institution.world_ranking, 2 ** 31 - 1), Institution.id)
+    )
+    ranked = db.session.query(
+        Institution.id, Institution.name, Institution.city, Institution.country,
+        Institution.description, Institution.website, Institution.logo_url,
+        Institution.world_ranking,
+        country_key.label('country_key'),
+        position.label('position')
+    ).filter(
+        Institution.is_active == True,
+        country_key.in_(FEATURED_COUNTRIES)
+    ).subquery()
+    
+    rows = db.session.query(ranked).filter(
+        ranked.c.position <= FEATURED_PER_COUNTRY
+    ).order_by(ranked.c.country_key, ranked.c.position).all()
     
-    # Group universities by country for display
     featured_universities = {}
-    countries = ['ca', 'us', 'gb', 'au', 'ie', 'de']
+    for country in FEATURED_COUNTRIES:
+        universities = [{
+            'id': row.id,
+            'name': row.name,
+            'location': f"{row.city}, {row.country}",
+            'description': row.description or '',
+            'website': row.website,
+            'logo': row.logo_url,
+            'world_ranking': row.world_ranking
+        } for row in rows if row.country_key == country]
+        if universities:
+            featured_universities[country] = universities
+    return featured_universities
+
+def homepage_content():
+    """Featured universities and testimonials, cached until the catalog or testimonials change"""
+    try:
+        testimonials_mtime = os.path.getmtime(os.path.join('data', 'testimonials.json'))
+    except OSError:
+        testimonials_mtime = None
     
-    for country in countries:
-        country_unis = [uni for uni in institutions if uni.country_code.lower() == country]
-        if country_unis:
-            featured_universities[country] = country_unis[:3]  # Get top 3 per country
+    def build():
+        testimonials = load_json_data('testimonials.json')
+        return {
+            'featured_universities': load_featured_universities(),
+            'testimonials': testimonials[:6] if testimonials else []
+        }
     
-    # Load testimonials from JSON for now
-    testimonials = load_json_data('testimonials.json')
-    featured_testimonials = testimonials[:6] if testimonials else []
+    return _homepage_cache.get_or_compute(('homepage', testimonials_mtime), build)
+
+@app.route('/')
+def index():
+    """Homepage with hero section and featured universities"""
+    content = homepage_content()
     
     return render_template('index.html', 
-                         featured_universities=featured_universities,
-                         testimonials=featured_testimonials)
+                         featured_universities=content['featured_universities'],
+                         testimonials=content['testimonials'])
 
 @app.route('/search')
 def search():
@@ -53,42 +109,38 @@ def search():
     if country:
         query = query.filter_by(country_code=country)
     
+    fuzzy_match = False
     if search_query:
-        query = query.filter(
-            db.or_(
-                Institution.name.contains(search_query),
-                Institution.city.contains(search_query),
-                Institution.description.contains(search_query)
-            )
-        )
-    
-    institutions = query.all()
+        institutions = match_institutions(query, search_query).all()
+        if not institutions:
+            # Nothing matched as typed; try typo-tolerant matching
+            institutions = fuzzy_institutions(query, search_query)
+            fuzzy_match = bool(institutions)
+    else:
+        institutions = query.all()
     
     # Get programs if field is specified
     programs = []
     if field:
-        programs = Program.query.filter(
-            Program.field_of_study.contains(field),
-            Program.is_active == True
+        programs = match_programs(
+            Program.query.filter(Program.is_active == True), field, field_only=True
         ).all()
     
-    # Get unique countries for filter dropdown
-    countries = db.session.query(
-        Institution.country_code, 
-        Institution.country
-    ).filter_by(is_active=True).distinct().all()
-    
-    # Get unique fields for filter dropdown
-    fields = db.session.query(Program.field_of_study).filter_by(is_active=True).distinct().all()
+    # Countries and fields for the filter dropdowns, with program counts
+    facets = get_facets({'country': country.upper() or None})
+    countries = [(f['value'], f['label']) for f in facets['facets']['country']]
+    fields = [f['value'] for f in facets['facets']['field_of_study']]
     
     return render_template('search.html',
                          universities=institutions,
                          programs=programs,
                          countries=countries,
-                         fields=[f[0] for f in fields],
+                         fields=fields,
+                         facets=facets['facets'],
                          selected_country=country,
                          selected_field=field,
-                         search_query=search_query)
+                         search_query=search_query,
+                         fuzzy_match=fuzzy_match)
 
 @app.route('/institution/<int:institution_id>')
 def institution_detail(institution_id):
@@ -99,9 +151,12 @@ def institution_detail(institution_id):
         is_active=True
     ).all()
     
+    similar = [inst for inst, _ in similar_institutions(institution_id)]
+    
     return render_template('institution_detail.html', 
                          institution=institution, 
-                         programs=programs)
+                         programs=programs,
+                         similar_institutions=similar)
 
 @app.route('/program/<int:program_id>')
 def program_detail(program_id):
@@ -116,9 +171,16 @@ def dashboard():
     applications = Application.query.filter_by(user_id=current_user.id).all()
     payments = Payment.query.filter_by(user_id=current_user.id).all()
     
+    # Recommendations are cached per user; skip programs already applied to
+    applied = {application.program_id for application in applications}
+    recommended_ids = [program_id for program_id, _ in recommend_programs(
+        current_user, RECOMMENDED_COUNT + len(applied)
+    ) if program_id not in applied][:RECOMMENDED_COUNT]
+    
     return render_template('dashboard.html', 
                          applications=applications,
-                         payments=payments)
+                         payments=payments,
+                         recommended_programs=programs_by_ids(recommended_ids))
 
 @app.route('/apply/<int:program_id>', methods=['GET', 'POST'])
 @login_required
@@ -194,6 +256,7 @@ def contact():
 
 # API endpoints for dynamic content
 @app.route('/api/universities')
+@catalog_etag
 def api_universities():
     """API endpoint to get universities data"""
     country = request.args.get('country', '')
@@ -205,9 +268,9 @@ def api_universities():
         query = query.filter_by(country_code=country)
     
     if search:
-        query = query.filter(Institution.name.contains(search))
-    
-    institutions = query.all()
+        institutions = match_institutions(query, search).all() or fuzzy_institutions(query, search)
+    else:
+        institutions = query.all()
     
     return jsonify([{
         'id': inst.id,
@@ -218,6 +281,7 @@ def api_universities():
     } for inst in institutions])
 
 @app.route('/api/programs')
+@catalog_etag
 def api_programs():
     """API endpoint to get programs data"""
     university_id = request.args.get('university_id', type=int)
@@ -0,0 +1,61 @@
+"""
+In-place upgrades for databases created by an older version of the models.
+
+db.create_all() creates missing tables but never alters existing ones, so a
+database created before a column or index was added would fail on its first
+query. upgrade_schema() adds the missing columns (always nullable; derived
+ones are backfilled by the init_* helpers that run after it) and creates
+the missing indexes, and drops indexes the models no longer declare. It is
+idempotent and runs at start-up, right after db.create_all().
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import db
+
+# Indexes earlier versions created that nothing reads any more
+OBSOLETE_INDEXES = (
+    'ix_programs_tuition_base_id',  # replaced by ix_programs_active_tuition_key_id
+    'ix_programs_total_cost_base_id',  # replaced by ix_programs_active_total_cost_key_id
+)
+
+def _column_names(table_name):
+    return {column['name'] for column in inspect(db.engine).get_columns(table_name)}
+
+def _add_column(table, column):
+    preparer = db.engine.dialect.identifier_preparer
+    statement = (f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                 f'{preparer.format_column(column)} {column.type.compile(dialect=db.engine.dialect)}')
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text(statement))
+    except Exception:
+        # Another worker starting at the same time may have added it first
+        if column.name not in _column_names(table.name):
+            raise
+
+def upgrade_schema():
+    """Add columns and indexes missing from existing tables; returns the columns added"""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = _column_names(table.name)
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if column.primary_key or not column.nullable:
+                raise RuntimeError(f'Cannot add required column {table.name}.{column.name} in place')
+            _add_column(table, column)
+            added.append(f'{table.name}.{column.name}')
+
+    # IF NOT EXISTS rather than checkfirst: reflection skips expression indexes
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+        for name in OBSOLETE_INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {preparer.quote(name)}'))
+    return added
@@ -0,0 +1,180 @@
+"""
+Full-text search index for institutions and programs.
+
+On SQLite the index lives in two FTS5 virtual tables keyed by the row id of
+the indexed record and kept in sync by mapper events. On PostgreSQL it is a
+pair of GIN expression indexes over weighted tsvectors, which the database
+maintains by itself.
+"""
+
+import re
+from sqlalchemy import event, text, func, literal_column, table, column
+from app import db
+from models import Institution, Program
+
+INSTITUTION_FTS = 'institution_fts'
+PROGRAM_FTS = 'program_fts'
+
+# Text search configuration used on PostgreSQL. 'simple' avoids stemming so
+# proper names such as "Toronto" or "McGill" are indexed as typed.
+TS_CONFIG = "'simple'"
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(term):
+    """Split user input into plain word tokens, dropping query syntax"""
+    return _TOKEN_RE.findall((term or '').lower())
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+# PostgreSQL expressions. The same expressions are used to build the GIN
+# indexes and to query them, so the planner can match the index.
+def _weighted(col, weight):
+    vector = func.to_tsvector(literal_column(TS_CONFIG), func.coalesce(col, ''))
+    return func.setweight(vector, literal_column(f"'{weight}'"))
+
+def institution_vector():
+    return (_weighted(Institution.name, 'A')
+            .op('||')(_weighted(Institution.short_name, 'A'))
+            .op('||')(_weighted(Institution.city, 'B'))
+            .op('||')(_weighted(Institution.country, 'B'))
+            .op('||')(_weighted(Institution.description, 'C')))
+
+def program_vector():
+    # field_of_study carries weight A so field filters can be restricted to it
+    return (_weighted(Program.field_of_study, 'A')
+            .op('||')(_weighted(Program.name, 'B'))
+            .op('||')(_weighted(Program.description, 'C')))
+
+def _ts_query(tokens, weight=''):
+    """Prefix tsquery, e.g. ['comp', 'sci'] -> 'comp:*A & sci:*A'"""
+    return func.to_tsquery(literal_column(TS_CONFIG),
+                           ' & '.join(f'{token}:*{weight}' for token in tokens))
+
+# SQLite FTS5 helpers
+_institution_fts = table(INSTITUTION_FTS, column('rowid'), column('rank'))
+_program_fts = table(PROGRAM_FTS, column('rowid'), column('rank'))
+
+def _fts_match(tokens, column_name=None):
+    """FTS5 prefix query, e.g. ['comp', 'sci'] -> '"comp"* "sci"*'"""
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    if column_name:
+        match = f'{column_name} : ({match})'
+    return match
+
+def match_institutions(query, term):
+    """Restrict an Institution query to full-text matches for term, best match first"""
+    tokens = tokenize(term)
+    if not tokens:
+        return query
+
+    if _is_postgres():
+        vector = institution_vector()
+        ts_query = _ts_query(tokens)
+        return query.filter(vector.op('@@')(ts_query)).order_by(
+            func.ts_rank(vector, ts_query).desc()
+        )
+
+    return (query.join(_institution_fts, _institution_fts.c.rowid == Institution.id)
+            .filter(literal_column(INSTITUTION_FTS).op('MATCH')(_fts_match(tokens)))
+            .order_by(_institution_fts.c.rank))
+
+def match_programs(query, term, field_only=False):
+    """Restrict a Program query to full-text matches for term, best match first.
+
+    With field_only the match is limited to field_of_study, which replaces the
+    old Program.field_of_study.contains() filters.
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return query
+
+    if _is_postgres():
+        vector = program_vector()
+        ts_query = _ts_query(tokens, 'A' if field_only else '')
+        return query.filter(vector.op('@@')(ts_query)).order_by(
+            func.ts_rank(vector, ts_query).desc()
+        )
+
+    match = _fts_match(tokens, 'field_of_study' if field_only else None)
+    return (query.join(_program_fts, _program_fts.c.rowid == Program.id)
+            .filter(literal_column(PROGRAM_FTS).op('MATCH')(match))
+            .order_by(_program_fts.c.rank))
+
+# Keeping the FTS5 tables in sync. These run inside the flush, on the same
+# connection, so the index commits or rolls back together with the row.
+_INSTITUTION_COLUMNS = ('name', 'short_name', 'city', 'country', 'description')
+_PROGRAM_COLUMNS = ('name', 'field_of_study', 'description')
+
+def _upsert(connection, fts_table, columns, target):
+    connection.execute(text(f'DELETE FROM {fts_table} WHERE rowid = :id'), {'id': target.id})
+    connection.execute(
+        text(f"INSERT INTO {fts_table}(rowid, {', '.join(columns)}) "
+             f"VALUES (:id, {', '.join(':' + c for c in columns)})"),
+        dict({c: getattr(target, c) for c in columns}, id=target.id)
+    )
+
+@event.listens_for(Institution, 'after_insert')
+@event.listens_for(Institution, 'after_update')
+def _index_institution(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        _upsert(connection, INSTITUTION_FTS, _INSTITUTION_COLUMNS, target)
+
+@event.listens_for(Program, 'after_insert')
+@event.listens_for(Program, 'after_update')
+def _index_program(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        _upsert(connection, PROGRAM_FTS, _PROGRAM_COLUMNS, target)
+
+@event.listens_for(Institution, 'after_delete')
+def _unindex_institution(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f'DELETE FROM {INSTITUTION_FTS} WHERE rowid = :id'), {'id': target.id})
+
+@event.listens_for(Program, 'after_delete')
+def _unindex_program(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f'DELETE FROM {PROGRAM_FTS} WHERE rowid = :id'), {'id': target.id})
+
+def rebuild_search_index():
+    """Repopulate the FTS5 tables from the base tables (SQLite only)"""
+    if _is_postgres():
+        return
+
+    for fts_table, source, columns in ((INSTITUTION_FTS, 'institutions', _INSTITUTION_COLUMNS),
+                                       (PROGRAM_FTS, 'programs', _PROGRAM_COLUMNS)):
+        db.session.execute(text(f'DELETE FROM {fts_table}'))
+        db.session.execute(text(
+            f"INSERT INTO {fts_table}(rowid, {', '.join(columns)}) "
+            f"SELECT id, {', '.join(columns)} FROM {source}"
+        ))
+    db.session.commit()
+
+def init_search_index():
+    """Create the full-text index if missing; call after db.create_all()"""
+    if _is_postgres():
+        for name, vector in (('ix_institutions_fts', institution_vector()),
+                             ('ix_programs_fts', program_vector())):
+            db.Index(name, vector, postgresql_using='gin').create(db.engine, checkfirst=True)
+        return
+
+    db.session.execute(text(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {INSTITUTION_FTS} USING fts5('
+        f"{', '.join(_INSTITUTION_COLUMNS)}, tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    db.session.execute(text(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {PROGRAM_FTS} USING fts5('
+        f"{', '.join(_PROGRAM_COLUMNS)}, tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    db.session.commit()
+
+    # Rows written before the index existed (e.g. by seed_data.py) are picked up here
+    out_of_sync = (
+        db.session.execute(text(f'SELECT count(*) FROM {INSTITUTION_FTS}')).scalar()
+        != db.session.query(func.count(Institution.id)).scalar()
+        or db.session.execute(text(f'SELECT count(*) FROM {PROGRAM_FTS}')).scalar()
+        != db.session.query(func.count(Program.id)).scalar()
+    )
+    if out_of_sync:
+        rebuild_search_index()
@@ -6,6 +6,7 @@ Run this after setting up the database
 
 from app import app, db
 from models import User, Institution, Program, UserRole, PaymentStatus
+from currency import init_exchange_rates
 from werkzeug.security import generate_password_hash
 import json
 
@@ -14,6 +15,7 @@ def create_sample_data():
         # Clear existing data
         db.drop_all()
         db.create_all()
+        init_exchange_rates()
         
         # Create admin user
         admin = User(
@@ -153,10 +155,12 @@ def create_sample_data():
                 'degree_type': 'Bachelor',
                 'field_of_study': 'Computer Science',
                 'duration_months': 48,
+                'intake_months': '9',
                 'tuition_fee': 58160.00,
                 'currency': 'CAD',
                 'description': 'A comprehensive program covering algorithms, software engineering, and computer systems.',
                 'min_gpa': 3.7,
+                'english_requirements': json.dumps({'ielts': 6.5, 'toefl': 100}),
                 'scholarships_available': True,
                 'work_permit_eligible': True
             },
@@ -167,6 +171,7 @@ def create_sample_data():
                 'degree_type': 'Master',
                 'field_of_study': 'Business Administration',
                 'duration_months': 20,
+                'intake_months': '9,1',
                 'tuition_fee': 124080.00,
                 'currency': 'CAD',
                 'description': 'A world-class MBA program preparing leaders for global business.',
@@ -182,6 +187,7 @@ def create_sample_data():
                 'degree_type': 'Bachelor',
                 'field_of_study': 'Engineering',
                 'duration_months': 48,
+                'intake_months': '9',
                 'tuition_fee': 55000.00,
                 'currency': 'CAD',
                 'description': 'Comprehensive engineering program with multiple specializations.',
@@ -197,10 +203,12 @@ def create_sample_data():
                 'degree_type': 'Bachelor',
                 'field_of_study': 'Economics',
                 'duration_months': 48,
+                'intake_months': '9',
                 'tuition_fee': 54880.00,
                 'currency': 'USD',
                 'description': 'Rigorous economics program at one of the world\'s top universities.',
                 'min_gpa': 3.9,
+                'english_requirements': json.dumps({'ielts': 7.0, 'toefl': 104, 'duolingo': 125}),
                 'scholarships_available': True,
                 'work_permit_eligible': False
             },
@@ -212,10 +220,12 @@ def create_sample_data():
                 'degree_type': 'Bachelor',
                 'field_of_study': 'Liberal Arts',
                 'duration_months': 36,
+                'intake_months': '10',
                 'tuition_fee': 39000.00,
                 'currency': 'GBP',
                 'description': 'Oxford\'s famous PPE degree combining three disciplines.',
                 'min_gpa': 3.8,
+                'english_requirements': json.dumps({'ielts': 7.5, 'toefl': 110, 'cambridge': 191}),
                 'scholarships_available': True,
                 'work_permit_eligible': False
             },
@@ -227,10 +237,12 @@ def create_sample_data():
                 'degree_type': 'Bachelor',
                 'field_of_study': 'Data Science',
                 'duration_months': 36,
+                'intake_months': '2,7',
                 'tuition_fee': 45000.00,
                 'currency': 'AUD',
                 'description': 'Cutting-edge data science program with industry partnerships.',
                 'min_gpa': 3.6,
+                'english_requirements': json.dumps({'ielts': 6.5, 'toefl': 79, 'pte': 58}),
                 'scholarships_available': True,
                 'work_permit_eligible': True
             }
@@ -0,0 +1,282 @@
+"""
+Precomputed "similar institutions".
+
+Each active institution is embedded as a numeric feature vector: one-hot
+country and type, log-scaled world ranking, student population and average
+base-currency tuition, international student ratio, and the mix of its
+programs' fields of study (hashed into a fixed number of buckets). The k
+nearest neighbours by Euclidean distance are stored in the
+similar_institutions table, so a detail page reads them with one indexed
+lookup.
+
+Every feature depends only on the institution itself, which makes
+incremental refreshes exact: only institutions that changed, and those
+whose neighbour list a changed institution enters or leaves, are
+recomputed. Stored lists are served with the catalog ETag, so a run that
+changes any bumps the catalog version in the same transaction. Run this
+module periodically (e.g. from cron):
+
+    python similar_institutions.py          # incremental since the last run
+    python similar_institutions.py --full   # recompute everything
+"""
+
+import sys
+import threading
+import zlib
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+from sqlalchemy import func, delete
+from app import app, db
+from models import Institution, Program, SimilarInstitution
+from catalog_cache import mark_catalog_changed
+
+# Neighbours stored per institution
+SIMILAR_COUNT = 8
+# Buckets the program field mix is hashed into
+FIELD_BUCKETS = 64
+# Bytes of distance matrix computed at a time; a block holds as many rows
+# as fit, so its size stays flat however many institutions there are
+BLOCK_BYTES = 4 * 1024 * 1024
+# Squared distances equal to this many decimals count as ties
+DISTANCE_DECIMALS = 5
+# Ids per IN list when replacing stored rows
+ID_CHUNK = 500
+
+# Relative importance of each feature group
+WEIGHTS = {
+    'country': 1.0,
+    'type': 0.5,
+    'ranking': 1.0,
+    'population': 0.5,
+    'international': 0.5,
+    'fee': 0.75,
+    'fields': 1.5,
+}
+
+# Stand-ins for missing values: unranked sorts with #1000, a 20,000 student
+# institution, 15% international students, USD 20,000 tuition
+DEFAULT_RANKING = 1000
+DEFAULT_POPULATION = 20000
+DEFAULT_INTERNATIONAL_RATIO = 0.15
+DEFAULT_FEE = 20000
+
+def _log_scale(value, default, decades):
+    return min(np.log10(max(value or default, 1)) / decades, 1.0)
+
+def _field_bucket(field_of_study):
+    return zlib.crc32((field_of_study or '').strip().lower().encode()) % FIELD_BUCKETS
+
+def _block_size(count):
+    """Rows per block of a float32 distance matrix with count columns"""
+    return max(1, BLOCK_BYTES // (np.dtype(np.float32).itemsize * max(count, 1)))
+
+def build_features():
+    """(institution ids, feature matrix) for all active institutions"""
+    institutions = db.session.query(
+        Institution.id,
+        Institution.country_code,
+        Institution.type,
+        Institution.world_ranking,
+        Institution.student_population,
+        Institution.international_students
+    ).filter(Institution.is_active == True).order_by(Institution.id).all()
+
+    # Average fee and field mix of each institution's active programs
+    fees = dict(db.session.query(
+        Program.institution_id,
+        func.avg(Program.tuition_fee_base)
+    ).filter(Program.is_active == True).group_by(Program.institution_id).all())
+    field_mix = defaultdict(lambda: np.zeros(FIELD_BUCKETS, dtype=np.float32))
+    for institution_id, field_of_study, count in db.session.query(
+        Program.institution_id,
+        Program.field_of_study,
+        func.count(Program.id)
+    ).filter(Program.is_active == True).group_by(Program.institution_id, Program.field_of_study):
+        field_mix[institution_id][_field_bucket(field_of_study)] += count
+
+    countries = sorted({(row.country_code or '').upper() for row in institutions})
+    types = sorted({(row.type or '').lower() for row in institutions})
+    country_index = {code: i for i, code in enumerate(countries)}
+    type_index = {name: i for i, name in enumerate(types)}
+
+    offset_type = len(countries)
+    offset_numeric = offset_type + len(types)
+    offset_fields = offset_numeric + 4
+    features = np.zeros((len(institutions), offset_fields + FIELD_BUCKETS), dtype=np.float32)
+    ids = np.zeros(len(institutions), dtype=np.int64)
+
+    for i, row in enumerate(institutions):
+        ids[i] = row.id
+        features[i, country_index[(row.country_code or '').upper()]] = WEIGHTS['country']
+        features[i, offset_type + type_index[(row.type or '').lower()]] = WEIGHTS['type']
+
+        if row.student_population and row.international_students is not None:
+            ratio = min(row.international_students / row.student_population, 1.0)
+        else:
+            ratio = DEFAULT_INTERNATIONAL_RATIO
+        fee = fees.get(row.id)
+        features[i, offset_numeric:offset_fields] = (
+            WEIGHTS['ranking'] * _log_scale(row.world_ranking, DEFAULT_RANKING, 3),
+            WEIGHTS['population'] * _log_scale(row.student_population, DEFAULT_POPULATION, 6),
+            WEIGHTS['international'] * ratio,
+            WEIGHTS['fee'] * _log_scale(float(fee) if fee is not None else None, DEFAULT_FEE, 6),
+        )
+
+        mix = field_mix.get(row.id)
+        if mix is not None and mix.sum() > 0:
+            features[i, offset_fields:] = WEIGHTS['fields'] * mix / mix.sum()
+
+    return ids, features
+
+def nearest_neighbours(features, rows, k=SIMILAR_COUNT):
+    """For each row index in rows: [(neighbour row index, score)], most similar first
+
+    The score is 1 / (1 + Euclidean distance), so 1 means identical features.
+    """
+    squared = (features ** 2).sum(axis=1)
+    k = min(k, len(features) - 1)
+    result = {}
+    if k <= 0:
+        return {row: [] for row in rows}
+
+    block_size = _block_size(len(features))
+    for start in range(0, len(rows), block_size):
+        block = np.asarray(rows[start:start + block_size])
+        distances = squared[block, None] + squared[None, :] - 2 * features[block] @ features.T
+        distances[np.arange(len(block)), block] = np.inf  # never your own neighbour
+        # float32 results vary in the last bits with the block shape; round them
+        # off and break ties by row, so every run picks the same neighbours
+        rounded = np.round(distances, DISTANCE_DECIMALS)
+        kth = np.partition(rounded, k - 1, axis=1)[:, k - 1]
+        for i, row in enumerate(block):
+            tied = np.flatnonzero(rounded[i] <= kth[i])
+            candidates = tied[np.lexsort((tied, rounded[i, tied]))[:k]]
+            result[int(row)] = [(int(j), 1.0 / (1.0 + float(np.sqrt(max(distances[i, j], 0.0)))))
+                                for j in candidates]
+    return result
+
+def _store(ids, neighbours, computed_at):
+    """Replace the stored neighbour lists of the given rows"""
+    institution_ids = [int(ids[row]) for row in neighbours]
+    for start in range(0, len(institution_ids), ID_CHUNK):
+        db.session.execute(delete(SimilarInstitution).where(
+            SimilarInstitution.institution_id.in_(institution_ids[start:start + ID_CHUNK])
+        ))
+    values = [{
+        'institution_id': int(ids[row]),
+        'rank': rank,
+        'similar_institution_id': int(ids[neighbour]),
+        'score': round(score, 6),
+        'computed_at': computed_at,
+    } for row, pairs in neighbours.items() for rank, (neighbour, score) in enumerate(pairs, 1)]
+    if values:
+        db.session.execute(SimilarInstitution.__table__.insert(), values)
+
+def rebuild_similar_institutions():
+    """Recompute the neighbours of every active institution"""
+    computed_at = datetime.utcnow()
+    ids, features = build_features()
+    neighbours = nearest_neighbours(features, list(range(len(ids))))
+    db.session.execute(delete(SimilarInstitution))
+    _store(ids, neighbours, computed_at)
+    mark_catalog_changed()
+    db.session.commit()
+    return len(neighbours)
+
+def refresh_similar_institutions():
+    """Recompute only the neighbour lists that changes since the last run can affect"""
+    last_run = db.session.query(func.max(SimilarInstitution.computed_at)).scalar()
+    if last_run is None:
+        return rebuild_similar_institutions()
+
+    computed_at = datetime.utcnow()
+    changed = {institution_id for (institution_id,) in db.session.query(Institution.id).filter(
+        Institution.updated_at >= last_run)}
+    changed |= {institution_id for (institution_id,) in db.session.query(Program.institution_id).filter(
+        Program.updated_at >= last_run).distinct()}
+
+    ids, features = build_features()
+    row_of = {int(institution_id): row for row, institution_id in enumerate(ids)}
+
+    stored = defaultdict(list)
+    for institution_id, similar_id, score in db.session.query(
+        SimilarInstitution.institution_id,
+        SimilarInstitution.similar_institution_id,
+        SimilarInstitution.score
+    ).order_by(SimilarInstitution.institution_id, SimilarInstitution.rank):
+        stored[institution_id].append((similar_id, score))
+
+    # Institutions that were deactivated or deleted count as changed too
+    gone = set(stored) - set(row_of)
+    changed |= gone | {similar_id for pairs in stored.values()
+                       for similar_id, _ in pairs if similar_id not in row_of}
+    if not changed:
+        return 0
+
+    affected = {row_of[institution_id] for institution_id in changed if institution_id in row_of}
+    # Rows whose list holds a changed institution
+    for institution_id, pairs in stored.items():
+        if institution_id in row_of and any(similar_id in changed for similar_id, _ in pairs):
+            affected.add(row_of[institution_id])
+    # Rows a changed institution is now closer to than their current k-th neighbour
+    changed_rows = [row_of[institution_id] for institution_id in changed if institution_id in row_of]
+    if changed_rows:
+        worst = np.zeros(len(ids))
+        for institution_id, pairs in stored.items():
+            if institution_id in row_of and len(pairs) >= SIMILAR_COUNT:
+                worst[row_of[institution_id]] = pairs[-1][1]
+        squared = (features ** 2).sum(axis=1)
+        block_size = _block_size(len(ids))
+        for start in range(0, len(changed_rows), block_size):
+            block = np.asarray(changed_rows[start:start + block_size])
+            distances = squared[block, None] + squared[None, :] - 2 * features[block] @ features.T
+            best = 1.0 / (1.0 + np.sqrt(np.maximum(distances, 0.0)))
+            best[np.arange(len(block)), block] = 0.0
+            affected.update(np.flatnonzero((best > worst[None, :]).any(axis=0)).tolist())
+
+    if gone:
+        db.session.execute(delete(SimilarInstitution).where(SimilarInstitution.institution_id.in_(gone)))
+    neighbours = nearest_neighbours(features, sorted(affected))
+    _store(ids, neighbours, computed_at)
+    mark_catalog_changed()
+    db.session.commit()
+    return len(neighbours)
+
+_init_lock = threading.Lock()
+
+def init_similar_institutions():
+    """Compute the table on first start, in a background thread; later runs are left to the periodic job"""
+    if (db.session.query(SimilarInstitution.institution_id).first() is not None
+            or db.session.query(Institution.id).filter(Institution.is_active == True).count() <= 1):
+        return
+    if not _init_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with app.app_context():
+                rebuild_similar_institutions()
+        except Exception as e:
+            print(f"Error computing similar institutions: {e}")
+        finally:
+            _init_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def similar_institutions(institution_id, limit=SIMILAR_COUNT):
+    """Stored neighbours of an institution, most similar first, as [(Institution, score)]"""
+    return db.session.query(Institution, SimilarInstitution.score).join(
+        SimilarInstitution, SimilarInstitution.similar_institution_id == Institution.id
+    ).filter(
+        SimilarInstitution.institution_id == institution_id,
+        Institution.is_active == True
+    ).order_by(SimilarInstitution.rank).limit(limit).all()
+
+if __name__ == '__main__':
+    with app.app_context():
+        if '--full' in sys.argv[1:]:
+            count = rebuild_similar_institutions()
+        else:
+            count = refresh_similar_institutions()
+        print(f"Similar institutions computed for {count} institutions")
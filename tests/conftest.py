@@ -0,0 +1,34 @@
+"""
+Shared fixtures.
+
+The app is imported against a throwaway SQLite database (DATABASE_URL must be
+set before app.py is first imported) and filled once with the sample data
+from seed_data.py. Tests that write restore what they change.
+"""
+
+import os
+import tempfile
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix='applyboard-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+
+@pytest.fixture(scope='session')
+def app():
+    import main
+    from seed_data import create_sample_data
+    create_sample_data()
+    main.app.config['TESTING'] = True
+    return main.app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def session(app):
+    """db.session inside an app context, rolled back afterwards"""
+    from app import db
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
@@ -0,0 +1,61 @@
+import multiprocessing
+from datetime import datetime
+import pytest
+import audit_log
+from audit_log import AuditWriter, replay_fallback, writer
+
+def _entry(action):
+    return {'admin_id': 1, 'action': action, 'target_type': None, 'target_id': None,
+            'details': None, 'ip_address': None, 'created_at': datetime.utcnow()}
+
+@pytest.fixture
+def fallback(tmp_path, monkeypatch):
+    """Fallback file in a temporary folder; replayed entries are collected instead of inserted"""
+    monkeypatch.setattr(audit_log, 'FALLBACK_FILE', str(tmp_path / 'audit_fallback.jsonl'))
+    monkeypatch.setattr(audit_log, '_FALLBACK_LOCK_FILE', str(tmp_path / 'audit_fallback.jsonl.lock'))
+    inserted = []
+    monkeypatch.setattr(AuditWriter, '_insert', staticmethod(inserted.extend))
+    return inserted
+
+def _spill(worker, count):
+    for i in range(count):
+        writer.spill([_entry(f'{worker}-{i}')])
+
+def test_spilled_entries_are_replayed(fallback):
+    writer.spill([_entry('first'), _entry('second')])
+    assert replay_fallback() == 2
+    assert [entry['action'] for entry in fallback] == ['first', 'second']
+    assert isinstance(fallback[0]['created_at'], datetime)
+    assert replay_fallback() == 0
+
+def test_unreadable_lines_are_skipped(fallback):
+    writer.spill([_entry('kept')])
+    with open(audit_log.FALLBACK_FILE, 'a') as file:
+        file.write('{"admin_id": 1, "act\n')
+    assert replay_fallback() == 1
+    assert [entry['action'] for entry in fallback] == ['kept']
+
+def test_failed_replay_keeps_the_entries(fallback, monkeypatch):
+    writer.spill([_entry('kept')])
+    def fail(rows):
+        raise RuntimeError('database down')
+    monkeypatch.setattr(AuditWriter, '_insert', staticmethod(fail))
+    with pytest.raises(RuntimeError):
+        replay_fallback()
+    monkeypatch.setattr(AuditWriter, '_insert', staticmethod(fallback.extend))
+    assert replay_fallback() == 1
+
+@pytest.mark.skipif(audit_log.fcntl is None, reason='no cross-process lock on this platform')
+def test_no_entry_is_lost_while_other_workers_spill(fallback):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_spill, args=(worker, 200)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    while any(process.is_alive() for process in workers):
+        replay_fallback()
+    for process in workers:
+        process.join()
+    replay_fallback()
+
+    actions = [entry['action'] for entry in fallback]
+    assert len(actions) == len(set(actions)) == 800
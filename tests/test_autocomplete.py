@@ -0,0 +1,46 @@
+import pytest
+from app import db
+from models import Institution
+from autocomplete import PrefixIndex, autocomplete
+
+def test_prefix_index_build_and_patch():
+    index = PrefixIndex()
+    with index.building():
+        index.put(('program', 2), 'Master of Data Science', 1)
+        index.put(('program', 1), 'Bachelor of Computer Science', 3)
+    assert index._keys == sorted(index._keys)
+    assert [entry['text'] for entry in index.complete('sci')] == [
+        'Bachelor of Computer Science', 'Master of Data Science']
+
+    index.put(('program', 3), 'Computer Engineering', 5)
+    assert index._keys == sorted(index._keys)
+    assert [entry['text'] for entry in index.complete('comp')] == [
+        'Computer Engineering', 'Bachelor of Computer Science']
+
+    index.discard(('program', 3))
+    assert [entry['text'] for entry in index.complete('comp')] == ['Bachelor of Computer Science']
+
+@pytest.fixture
+def institution_toggle(app):
+    def set_active(active):
+        with app.app_context():
+            db.session.get(Institution, 1).is_active = active
+            db.session.commit()
+    yield set_active
+    set_active(True)
+
+def _program_ids(app, prefix):
+    with app.app_context():
+        return {entry['id'] for entry in autocomplete(prefix, limit=50) if entry['type'] == 'program'}
+
+def test_programs_follow_their_institution(app, institution_toggle):
+    with app.app_context():
+        programs = db.session.get(Institution, 1).programs
+        name, program_ids = programs[0].name, {program.id for program in programs if program.is_active}
+    assert program_ids & _program_ids(app, name)
+
+    institution_toggle(False)
+    assert not program_ids & _program_ids(app, name)
+
+    institution_toggle(True)
+    assert program_ids & _program_ids(app, name)
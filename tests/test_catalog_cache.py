@@ -0,0 +1,70 @@
+import pytest
+from app import db
+from models import Institution, CatalogVersion
+from catalog_cache import CatalogCache, catalog_version, bump_catalog_version
+
+@pytest.fixture
+def renamed_institution(app):
+    """Rename institution 1 for the test (a committed catalog write), then put the name back"""
+    with app.app_context():
+        name = db.session.get(Institution, 1).name
+    def rename(new_name):
+        with app.app_context():
+            db.session.get(Institution, 1).name = new_name
+            db.session.commit()
+    yield rename
+    rename(name)
+
+def test_etag_and_304(client):
+    response = client.get('/api/universities')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    revalidated = client.get('/api/universities', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+    assert revalidated.data == b''
+
+def test_etag_depends_on_the_url(client):
+    etag = client.get('/api/universities').headers['ETag']
+    assert client.get('/api/universities?country=CA', headers={'If-None-Match': etag}).status_code == 200
+
+def test_catalog_write_changes_the_etag(client, renamed_institution):
+    etag = client.get('/api/universities').headers['ETag']
+    renamed_institution('Renamed University')
+
+    response = client.get('/api/universities', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'Renamed University' in response.get_data(as_text=True)
+
+def test_version_is_stored_with_the_write(app, renamed_institution):
+    with app.app_context():
+        before = catalog_version()
+    renamed_institution('Renamed University')
+    with app.app_context():
+        after = catalog_version()
+        assert after != before
+        # Other hosts read the stamp from the database
+        assert str(db.session.get(CatalogVersion, 1).version) == after
+
+def test_rollback_keeps_the_version(session):
+    before = catalog_version()
+    session.get(Institution, 1).name = 'Never Committed'
+    session.flush()
+    session.rollback()
+    session.commit()
+    assert catalog_version() == before
+
+def test_cache_drops_entries_when_the_version_moves(session):
+    cache = CatalogCache()
+    calls = []
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_compute('key', compute) == 1
+    assert cache.get_or_compute('key', compute) == 1
+    bump_catalog_version()
+    assert cache.get_or_compute('key', compute) == 2
@@ -0,0 +1,34 @@
+from decimal import Decimal
+from models import Program, ExchangeRate
+from currency import DEFAULT_RATES, CENTS, default_rates, set_exchange_rates
+
+def _expected_costs(program, rate):
+    tuition = Decimal(str(program.tuition_fee))
+    months = Decimal(program.duration_months or 0)
+    additional = Decimal(str(program.additional_fees or 0))
+    return ((tuition * rate).quantize(CENTS), ((tuition * months / 12 + additional) * rate).quantize(CENTS))
+
+def test_default_rates_are_rebased_onto_the_base_currency():
+    assert default_rates('USD') == {currency: Decimal(rate) for currency, rate in DEFAULT_RATES.items()}
+    rates = default_rates('CAD')
+    assert rates['CAD'] == 1
+    assert rates['USD'] == (Decimal(1) / Decimal(DEFAULT_RATES['CAD'])).quantize(Decimal('0.00000001'))
+    assert default_rates('JPY') is None
+
+def test_program_write_is_normalized(session):
+    program = session.get(Program, 1)
+    program.tuition_fee = Decimal('10000')
+    session.flush()
+    rate = session.get(ExchangeRate, program.currency).rate_to_base
+    assert (program.tuition_fee_base, program.total_cost_base) == _expected_costs(program, rate)
+
+def test_rate_change_recomputes_every_program(app, session):
+    currency = session.get(Program, 1).currency
+    old_rate = session.get(ExchangeRate, currency).rate_to_base
+    try:
+        set_exchange_rates({currency: old_rate * 2})
+        session.expire_all()
+        for program in Program.query.filter_by(currency=currency):
+            assert (program.tuition_fee_base, program.total_cost_base) == _expected_costs(program, old_rate * 2)
+    finally:
+        set_exchange_rates({currency: old_rate})
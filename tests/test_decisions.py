@@ -0,0 +1,70 @@
+import json
+import pytest
+from sqlalchemy import delete
+from app import db
+from models import Application, ApplicationStatus, AdminLog, Notification
+
+@pytest.fixture
+def applications(app):
+    """Three submitted applications, removed with their notifications and audit rows afterwards"""
+    with app.app_context():
+        created = [Application(user_id=2, institution_id=1, program_id=1, reference_number=f'TEST-{i}',
+                               status=ApplicationStatus.SUBMITTED) for i in range(3)]
+        db.session.add_all(created)
+        db.session.commit()
+        ids = [application.id for application in created]
+    yield ids
+    with app.app_context():
+        db.session.execute(delete(Notification).where(Notification.application_id.in_(ids)))
+        db.session.execute(delete(AdminLog).where(AdminLog.target_type == 'application', AdminLog.target_id.in_(ids)))
+        for application in Application.query.filter(Application.id.in_(ids)):
+            db.session.delete(application)
+        db.session.commit()
+
+@pytest.fixture
+def admin_client(client):
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    return client
+
+@pytest.mark.parametrize('body, message', [
+    ({'status': 'accepted', 'ids': '12'}, 'ids'),
+    ({'status': 'accepted', 'ids': [1, '2']}, 'ids'),
+    ({'status': 'accepted', 'ids': [True]}, 'ids'),
+    ({'status': 'accepted', 'filter': 'x'}, 'filter'),
+    ({'status': 'accepted', 'ids': [1], 'notes': ['x']}, 'notes'),
+    ({'status': 'accepted', 'ids': [1], 'notes': 'x' * 2001}, 'notes'),
+    ({'status': 'draft', 'ids': [1]}, 'draft'),
+    ([1, 2], 'JSON object'),
+])
+def test_rejects_bad_input(admin_client, body, message):
+    response = admin_client.post('/admin/applications/decisions', json=body)
+    assert response.status_code == 400
+    assert message in response.get_json()['message']
+
+def test_batch_decision(app, admin_client, applications):
+    response = admin_client.post('/admin/applications/decisions', json={
+        'status': 'accepted', 'ids': applications + [999999], 'notes': '  Welcome  '})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['requested'], data['updated'], data['failed']) == (4, 3, 1)
+    assert [result['success'] for result in data['results']] == [True, True, True, False]
+
+    with app.app_context():
+        for application in Application.query.filter(Application.id.in_(applications)):
+            assert application.status == ApplicationStatus.ACCEPTED
+            assert application.decision_date is not None
+            assert application.decision_notes == 'Welcome'
+        assert Notification.query.filter(Notification.application_id.in_(applications)).count() == 3
+        # Written with the decision, not through the write-behind audit queue
+        logs = AdminLog.query.filter(AdminLog.target_type == 'application',
+                                     AdminLog.target_id.in_(applications)).all()
+        assert len(logs) == 3
+        assert json.loads(logs[0].details)['new_status'] == 'accepted'
+
+def test_disallowed_transition_is_reported_per_id(admin_client, applications):
+    admin_client.post('/admin/applications/decisions', json={'status': 'rejected', 'ids': applications[:1]})
+    response = admin_client.post('/admin/applications/decisions', json={'status': 'under_review', 'ids': applications})
+    results = response.get_json()['results']
+    assert [result['success'] for result in results] == [False, True, True]
+    assert 'Cannot move from rejected' in results[0]['error']
@@ -0,0 +1,37 @@
+import itertools
+import pytest
+from models import Program, ProgramEnglishRequirement
+from eligibility import (ENGLISH_TESTS, parse_english_requirements, eligibility_criteria,
+                         eligible_program_ids)
+
+PROFILES = [
+    dict({test: None for test in ENGLISH_TESTS}, gpa=gpa, english_exempt=exempt, **scores)
+    for gpa, exempt, scores in itertools.product(
+        [None, 2.5, 3.2, 3.7, 4.0],
+        [False, True],
+        [{}, {'ielts': 6.0}, {'ielts': 7.5}, {'toefl': 95}, {'toefl': 80, 'ielts': 6.5}],
+    )
+]
+
+def test_parse_english_requirements():
+    assert parse_english_requirements('{"ielts": {"overall": 6.5}, "toefl_ibt": {"overall": 90}}') == {
+        'ielts': 6.5, 'toefl': 90.0}
+    assert parse_english_requirements(None) == {}
+    assert parse_english_requirements('not json') == {}
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_sql_criteria_match_the_snapshot_matcher(session, profile):
+    in_memory = sorted(eligible_program_ids(profile))
+    in_sql = sorted(program_id for (program_id,) in session.query(Program.id).filter(*eligibility_criteria(profile)))
+    assert in_sql == in_memory
+
+def test_requirement_rows_follow_program_writes(session):
+    program = session.get(Program, 4)
+    program.english_requirements = '{"toefl_ibt": {"overall": 90}}'
+    session.flush()
+    rows = session.query(ProgramEnglishRequirement).filter_by(program_id=4).all()
+    assert [(row.test, row.min_score) for row in rows] == [('toefl', 90.0)]
+
+    program.english_requirements = None
+    session.flush()
+    assert session.query(ProgramEnglishRequirement).filter_by(program_id=4).count() == 0
@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+import zlib
+import pytest
+from sqlalchemy import select
+from models import Institution, Program, User
+from exports import ndjson_lines, csv_lines, csv_value, streamed_response
+
+def _export(client, **headers):
+    response = client.get('/api/catalog/export', headers=headers)
+    assert response.status_code == 200
+    data = response.data
+    if response.headers.get('Content-Encoding') == 'gzip':
+        data = zlib.decompress(data, 31)
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+def test_catalog_export_record_shape(app, client):
+    lines = _export(client)
+    assert lines[0]['record_type'] == 'meta'
+    assert 'exported_at' in lines[0]
+
+    institutions = [line for line in lines if line['record_type'] == 'institution']
+    programs = [line for line in lines if line['record_type'] == 'program']
+    assert len(institutions) + len(programs) + 1 == len(lines)
+
+    with app.app_context():
+        # Every column survives, including Institution.type
+        expected = {institution.id: institution.type for institution in Institution.query}
+        assert {line['id']: line['type'] for line in institutions} == expected
+        assert set(institutions[0]) == set(Institution.__table__.columns.keys()) | {'record_type'}
+        assert len(programs) == Program.query.count()
+
+def test_catalog_export_gzip(client):
+    # Everything but the meta line's timestamp
+    assert _export(client, **{'Accept-Encoding': 'gzip'})[1:] == _export(client)[1:]
+
+def test_catalog_export_rejects_a_bad_updated_since(client):
+    assert client.get('/api/catalog/export?updated_since=yesterday').status_code == 400
+
+def test_ndjson_extra_keys_cannot_replace_columns(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            ndjson_lines(select(Institution.__table__), type='institution')
+
+def test_csv_value_quotes_formulas():
+    assert csv_value('=HYPERLINK("http://example.com")') == '\'=HYPERLINK("http://example.com")'
+    assert csv_value('@SUM(A1)') == "'@SUM(A1)"
+    assert csv_value('+1') == "'+1"
+    assert csv_value('-1') == "'-1"
+    assert csv_value(-1) == -1
+    assert csv_value('University of Toronto') == 'University of Toronto'
+
+def test_gzip_stream_flushes_every_batch(app):
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = streamed_response(lambda: iter(['first\n', 'second\n']), 'text/csv', 'rows.csv')
+        chunks = list(response.response)
+    decompressor = zlib.decompressobj(31)
+    # The first batch can be decoded before the rest of the stream arrives
+    assert decompressor.decompress(chunks[0]) == b'first\n'
+    assert decompressor.decompress(b''.join(chunks[1:])) == b'second\n'
+    assert decompressor.eof
+
+def test_csv_lines_escape_formulas(session):
+    student = User.query.filter_by(email='student@example.com').one()
+    student.first_name = '=cmd()'
+    session.flush()
+    text = ''.join(csv_lines(select(User.email, User.first_name).where(User.id == student.id)))
+    assert list(csv.reader(io.StringIO(text))) == [['email', 'first_name'], ['student@example.com', "'=cmd()"]]
@@ -0,0 +1,70 @@
+import pytest
+import api
+from app import db
+from models import Institution, Program, UNRANKED, PROGRAM_COST_KEYS
+from pagination import encode_cursor, decode_cursor, InvalidCursor
+
+def _walk(client, url, key):
+    """Ids of every item, following next_cursor from the first page to the last"""
+    ids, cursor, pages = [], '', 0
+    while True:
+        data = client.get(f'{url}&cursor={cursor}').get_json()
+        ids += [item['id'] for item in data[key]]
+        pages += 1
+        if not data['has_next']:
+            assert data['next_cursor'] is None
+            return ids, pages
+        cursor = data['next_cursor']
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    monkeypatch.setattr(api, 'PER_PAGE', 2)
+
+@pytest.fixture
+def unranked_institution(app):
+    # One NULL ranking, so the walk crosses the coalesce() sentinel
+    with app.app_context():
+        institution = db.session.get(Institution, 3)
+        ranking = institution.world_ranking
+        institution.world_ranking = None
+        db.session.commit()
+    yield 3
+    with app.app_context():
+        db.session.get(Institution, 3).world_ranking = ranking
+        db.session.commit()
+
+def test_cursor_round_trip():
+    keys = [Program.tuition_fee, Program.id]
+    cursor = encode_cursor([12345.5, 7])
+    assert decode_cursor(cursor, keys) == [12345.5, 7]
+
+def test_cursor_rejects_garbage():
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not-a-cursor', [Program.id])
+
+def test_invalid_cursor_is_a_400(client):
+    response = client.get('/api/universities/search?cursor=not-a-cursor')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+def test_university_cursor_walk(app, client, small_pages, unranked_institution):
+    ids, pages = _walk(client, '/api/universities/search?', 'universities')
+
+    with app.app_context():
+        expected = [institution.id for institution in sorted(
+            Institution.query.filter_by(is_active=True),
+            key=lambda institution: (institution.world_ranking or UNRANKED, institution.id)
+        )]
+    assert ids == expected
+    assert ids[-1] == unranked_institution
+    assert pages == (len(expected) + 1) // 2
+
+def test_program_cursor_walk(app, client, small_pages):
+    ids, _ = _walk(client, '/api/programs/search?sort=tuition', 'programs')
+
+    with app.app_context():
+        expected = [program_id for (program_id,) in db.session.query(Program.id).join(Institution).filter(
+            Program.is_active == True, Institution.is_active == True
+        ).order_by(PROGRAM_COST_KEYS['tuition'], Program.id)]
+    assert ids == expected
+    assert len(ids) == len(set(ids))
@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import text
+from app import db
+from models import Program
+import totals
+from totals import count_total
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    totals._cache.clear()
+    yield
+    totals._cache.clear()
+
+@pytest.fixture
+def as_postgresql(app, monkeypatch):
+    """Take the PostgreSQL branch of count_total on the test database"""
+    with app.app_context():
+        monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+    yield
+
+def test_exact_count(session):
+    query = Program.query.filter(Program.is_active == True)
+    assert count_total(query) == (query.count(), False)
+
+def test_cached_until_a_write_commits(session):
+    query = Program.query.filter(Program.is_active == True)
+    total, _ = count_total(query)
+
+    program = session.get(Program, 1)
+    program.is_active = not program.is_active
+    session.flush()
+    # Not committed yet: the cached total is still served
+    assert count_total(query) == (total, False)
+
+    session.commit()
+    try:
+        assert count_total(query) == (query.count(), False)
+        assert count_total(query)[0] != total
+    finally:
+        program.is_active = not program.is_active
+        session.commit()
+
+def test_large_estimate_is_used(session, as_postgresql, monkeypatch):
+    monkeypatch.setattr(totals, '_planner_estimate', lambda statement, tables: 50000)
+    assert count_total(Program.query) == (50000, True)
+
+def test_small_estimate_is_counted_exactly(session, as_postgresql, monkeypatch):
+    monkeypatch.setattr(totals, '_planner_estimate', lambda statement, tables: 12)
+    assert count_total(Program.query) == (Program.query.count(), False)
+
+def test_failed_estimate_falls_back_to_count(session, as_postgresql, monkeypatch):
+    # SQLite does not abort a transaction on error as PostgreSQL does, so
+    # check the estimate ran in a savepoint that can be rolled back alone
+    in_savepoint = []
+    def failing_estimate(statement, tables):
+        in_savepoint.append(db.session().in_nested_transaction())
+        db.session.execute(text('SELECT reltuples FROM pg_class'))
+    monkeypatch.setattr(totals, '_planner_estimate', failing_estimate)
+
+    program = session.get(Program, 1)
+    name = program.name
+    program.name = 'Pending Change'
+    session.flush()
+
+    assert count_total(Program.query) == (Program.query.count(), False)
+    assert in_savepoint == [True]
+    # Only the estimate's savepoint was rolled back
+    assert session.get(Program, 1).name == 'Pending Change'
+    assert 'programs' in session.info.get('written_tables', ())
+    program.name = name
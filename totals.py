@@ -0,0 +1,119 @@
+"""
+Cheap row totals for paginated lists.
+
+An exact COUNT(*) over a large join is usually the slowest part of a list
+page. count_total() answers from a short-lived per-process cache that is
+dropped as soon as a write to any table the query reads commits. On
+PostgreSQL, large results are not counted at all: the planner's row
+estimate (pg_class.reltuples for an unfiltered table, EXPLAIN otherwise)
+is returned and flagged as an estimate.
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, OrderedDict
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.util import find_tables
+from app import db
+
+# Seconds a cached total is served
+TOTAL_TTL = 30
+# On PostgreSQL, estimates below this are replaced with an exact count
+EXACT_COUNT_LIMIT = 10000
+MAX_ENTRIES = 512
+
+# Per-table write generation, bumped after commits that touched the table
+_generations = defaultdict(int)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+@event.listens_for(Session, 'before_flush')
+def _track_flush(session, flush_context, instances):
+    written = session.info.setdefault('written_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        written.add(obj.__table__.name)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None:
+        orm_execute_state.session.info.setdefault('written_tables', set()).add(mapper.local_table.name)
+
+@event.listens_for(Session, 'after_commit')
+def _publish_writes(session):
+    written = session.info.pop('written_tables', None)
+    if written:
+        with _lock:
+            for name in written:
+                _generations[name] += 1
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_writes(session):
+    # A rolled-back savepoint (e.g. a failed estimate) leaves the outer writes pending
+    if session.in_nested_transaction():
+        return
+    session.info.pop('written_tables', None)
+
+def note_written(*table_names):
+    """Invalidate cached totals over tables written outside the ORM session"""
+    with _lock:
+        for name in table_names:
+            _generations[name] += 1
+
+def _tables(statement):
+    return sorted({table.name for table in find_tables(statement, include_joins=True)
+                   if hasattr(table, 'name')})
+
+def _planner_estimate(statement, tables):
+    """Row estimate from PostgreSQL statistics, or None"""
+    if statement.whereclause is None and len(tables) == 1:
+        estimate = db.session.execute(
+            text('SELECT reltuples::bigint FROM pg_class WHERE relname = :name'),
+            {'name': tables[0]}
+        ).scalar()
+    else:
+        compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {compiled}')).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]['Plan']['Plan Rows']
+    # reltuples is -1 for a table that was never analyzed
+    return int(estimate) if estimate is not None and estimate >= 0 else None
+
+def count_total(query):
+    """(total, is_estimate) for a query, cached until a write to one of its tables or TOTAL_TTL"""
+    query = query.order_by(None)
+    statement = query.statement
+    tables = _tables(statement)
+    compiled = statement.compile(dialect=db.engine.dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items(), key=lambda item: item[0])))
+
+    with _lock:
+        generation = tuple(_generations[name] for name in tables)
+        cached = _cache.get(key)
+        if cached and cached[0] == generation and time.time() - cached[1] < TOTAL_TTL:
+            _cache.move_to_end(key)
+            return cached[2]
+
+    result = None
+    if db.engine.dialect.name == 'postgresql':
+        try:
+            # In a savepoint, so a failed EXPLAIN does not abort the transaction the count runs in
+            with db.session.begin_nested():
+                estimate = _planner_estimate(statement, tables)
+            if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+                result = (estimate, True)
+        except Exception as e:
+            print(f"Error estimating row count: {e}")
+    if result is None:
+        result = (query.count(), False)
+
+    with _lock:
+        _cache[key] = (generation, time.time(), result)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result